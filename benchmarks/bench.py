@@ -0,0 +1,200 @@
+"""Helpers shared by the benchmarks."""
+
+import asyncio
+import math
+import subprocess
+import time
+import tracemalloc
+from typing import Awaitable, Callable, List, Sequence, Tuple
+
+from aries_cloudagent.core.in_memory import InMemoryProfile
+from aries_cloudagent.core.profile import ProfileManager, ProfileManagerProvider
+from aries_cloudagent.storage.base import BaseStorage
+
+from plugins.multitenant_multitoken.claims import TokenClaimRecord
+from plugins.multitenant_multitoken.manager import (
+    TractionMultitenantManager,
+    TokensWalletRecord,
+)
+
+JWT_SECRET = "bench-secret"
+
+
+def git_commit(rootdir) -> str:
+    """Get the commit the benchmarks run on, if in a git checkout."""
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], cwd=str(rootdir), stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_profile(settings: dict = None) -> InMemoryProfile:
+    """Create an in-memory base profile able to open in-memory subwallets."""
+    profile = InMemoryProfile.test_profile(
+        {"multitenant.jwt_secret": JWT_SECRET, **(settings or {})}
+    )
+    profile.context.injector.bind_provider(ProfileManager, ProfileManagerProvider())
+    return profile
+
+
+def make_manager(profile: InMemoryProfile) -> TractionMultitenantManager:
+    """Create the multitoken manager under test."""
+    return TractionMultitenantManager(profile)
+
+
+async def add_wallets(profile: InMemoryProfile, count: int) -> List[TokensWalletRecord]:
+    """Create managed in-memory subwallet records."""
+    wallets = []
+    async with profile.session() as session:
+        for idx in range(count):
+            wallet = TokensWalletRecord(
+                key_management_mode=TokensWalletRecord.MODE_MANAGED,
+                settings={"wallet.type": "in_memory", "wallet.name": f"bench{idx}"},
+            )
+            await wallet.save(session)
+            wallets.append(wallet)
+    return wallets
+
+
+async def seed_claims(profile: InMemoryProfile, wallet_id: str, count: int):
+    """Store outstanding claims for a wallet, all older than any new token.
+
+    Claims are written straight to storage, creating them through the manager
+    would take as long as the benchmark itself for large counts.
+    """
+    now = int(time.time())
+    exp = now + 3600
+    async with profile.session() as session:
+        storage = session.inject(BaseStorage)
+        for idx in range(count):
+            claim = TokenClaimRecord(wallet_id=wallet_id, iat=now - 1 - idx, exp=exp)
+            await storage.add_record(claim.storage_record)
+
+
+def rounds_for(rounds: int, claims: int, budget: int = 100_000) -> int:
+    """Scale down the rounds for sizes where every operation scans all claims."""
+    return max(3, min(rounds, budget // max(claims, 1)))
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    """Nearest rank percentile of sorted samples."""
+    rank = max(math.ceil(pct / 100 * len(samples)), 1)
+    return samples[rank - 1]
+
+
+def summarize(
+    name: str,
+    group: str,
+    params: dict,
+    latencies: Sequence[float],
+    elapsed: float,
+    **extra,
+) -> dict:
+    """Summarize per operation latencies into a result entry."""
+    samples = sorted(latencies)
+    return {
+        "name": name,
+        "group": group,
+        "params": params,
+        "rounds": len(samples),
+        "total_seconds": elapsed,
+        "ops_per_second": len(samples) / elapsed if elapsed else None,
+        "latency_ms": {
+            "min": samples[0] * 1000,
+            "mean": sum(samples) / len(samples) * 1000,
+            "p50": percentile(samples, 50) * 1000,
+            "p95": percentile(samples, 95) * 1000,
+            "p99": percentile(samples, 99) * 1000,
+            "max": samples[-1] * 1000,
+        },
+        "extra": extra,
+    }
+
+
+async def measure(
+    operation: Callable[[int], Awaitable],
+    rounds: int,
+    before: Callable[[], None] = None,
+) -> Tuple[List[float], float]:
+    """Time an operation sequentially.
+
+    Args:
+        operation: Coroutine function called with the round number
+        rounds: Number of times to run the operation
+        before: Untimed setup run before every round
+
+    Returns:
+        The latency of every round and the total time spent in the operation
+
+    """
+    latencies = []
+    for idx in range(rounds):
+        if before:
+            before()
+        started = time.perf_counter()
+        await operation(idx)
+        latencies.append(time.perf_counter() - started)
+    return latencies, sum(latencies)
+
+
+async def measure_concurrent(
+    operation: Callable[[int], Awaitable], concurrency: int
+) -> Tuple[List[float], float, list]:
+    """Time concurrent runs of an operation.
+
+    Returns:
+        The latency of every call, the wall time of the whole burst and the
+        results of the calls
+
+    """
+
+    async def timed(idx: int):
+        started = time.perf_counter()
+        result = await operation(idx)
+        return time.perf_counter() - started, result
+
+    started = time.perf_counter()
+    timings = await asyncio.gather(*(timed(idx) for idx in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return [latency for latency, _ in timings], elapsed, [res for _, res in timings]
+
+
+async def allocated(operation: Callable[[int], Awaitable], rounds: int) -> float:
+    """Average bytes held by the results of an operation.
+
+    Results are kept alive until the end, so the growth of traced memory over
+    all rounds is what each result costs.
+    """
+    results = []
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for idx in range(rounds):
+            results.append(await operation(idx))
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (after - before) / rounds
+
+
+async def peak_allocated(operation: Callable[[int], Awaitable], rounds: int) -> float:
+    """Average peak of the memory allocated while an operation runs.
+
+    Tracing restarts every round to reset the peak, so this counts the
+    temporary allocations of the operation as well as its result.
+    """
+    peaks = []
+    for idx in range(rounds):
+        tracemalloc.start()
+        try:
+            await operation(idx)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return sum(peaks) / rounds
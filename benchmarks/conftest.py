@@ -0,0 +1,60 @@
+"""Benchmark fixtures and result collection.
+
+Run with `pytest benchmarks`. Results of every benchmark are written to a JSON
+file (`--bench-output`, bench_output.json by default) so runs on different
+commits can be compared.
+"""
+
+import json
+import platform
+from datetime import datetime, timezone
+
+import pytest
+
+from aries_cloudagent.version import __version__ as acapy_version
+
+from .bench import git_commit
+
+DEFAULT_OUTPUT = "bench_output.json"
+DEFAULT_ROUNDS = 100
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption(
+        "--bench-output",
+        default=DEFAULT_OUTPUT,
+        help="File the benchmark results are written to",
+    )
+    group.addoption(
+        "--bench-rounds",
+        type=int,
+        default=DEFAULT_ROUNDS,
+        help="Timed rounds per benchmark, scaled down for large claim counts",
+    )
+
+
+@pytest.fixture(scope="session")
+def bench_rounds(request) -> int:
+    # options are only registered when pytest is pointed at this directory
+    return request.config.getoption("--bench-rounds", DEFAULT_ROUNDS)
+
+
+@pytest.fixture(scope="session")
+def bench_results(request):
+    """Collect benchmark results and write them out at the end of the session."""
+    results = []
+    yield results
+
+    report = {
+        "meta": {
+            "commit": git_commit(request.config.rootdir),
+            "created": datetime.now(tz=timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "aries_cloudagent": acapy_version,
+        },
+        "benchmarks": results,
+    }
+    output_path = request.config.getoption("--bench-output", DEFAULT_OUTPUT)
+    with open(output_path, "w") as output:
+        json.dump(report, output, indent=2)
@@ -0,0 +1,489 @@
+"""End-to-end load test of the admin API with many tenants.
+
+Starts an agent in-process through the ACA-Py conductor with the plugins of
+this repo loaded, provisions tenant wallets and tokens through the
+TractionMultitenantManager and drives a mixed workload over HTTP at a fixed
+request rate:
+
+```
+python -m benchmarks.load --tenants 2000 --tokens 3 --rate 200 --duration 60
+```
+
+Requests are started on schedule whether or not earlier ones are done, and
+latency is counted from the scheduled start, so a slow agent shows up as
+latency instead of a lower request rate. The harness shares the process
+with the agent, the peak RSS reported includes both.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Sequence, Tuple
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+from aries_cloudagent.admin.base_server import BaseAdminServer
+from aries_cloudagent.config.default_context import DefaultContextBuilder
+from aries_cloudagent.core.conductor import Conductor
+from aries_cloudagent.version import __version__ as acapy_version
+
+from plugins.multitenant_multitoken.manager import (
+    TokenRequest,
+    TractionMultitenantManager,
+)
+
+from .bench import JWT_SECRET, git_commit, summarize
+
+PLUGINS = [
+    "plugins.multitenant_multitoken",
+    "plugins.override_protocol",
+    "plugins.add_endpoint",
+    "plugins.metrics",
+]
+
+# name: (method, path, json body)
+ROUTES = {
+    "connections": ("GET", "/connections", None),
+    "create-invitation": ("POST", "/connections/create-invitation", {}),
+    "hello-world": ("POST", "/demo/hello-world", {"content": "load"}),
+}
+DEFAULT_MIX = "connections=6,create-invitation=2,hello-world=2"
+BACKENDS = ("in_memory", "sqlite")
+TOKEN_BATCH = 500
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse route weights given as `name=weight,...`."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(
+                f"Unknown route {name}, expected one of {', '.join(ROUTES)}"
+            )
+        weights[name] = float(weight or 1)
+    if not any(weight > 0 for weight in weights.values()):
+        raise argparse.ArgumentTypeError("At least one route needs a weight above 0")
+    return weights
+
+
+def parse_setting(setting: str) -> Tuple[str, object]:
+    """Parse an agent setting given as `key=value`, the value as JSON if it is."""
+    key, sep, value = setting.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Expected key=value, got {setting}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def agent_settings(args) -> dict:
+    """Settings of the agent under test."""
+    admin_port = _free_port()
+    inbound_port = _free_port()
+    settings = {
+        "admin.enabled": True,
+        "admin.host": "127.0.0.1",
+        "admin.port": admin_port,
+        "admin.admin_insecure_mode": True,
+        "admin.webhook_urls": [],
+        "multitenant.enabled": True,
+        "multitenant.admin_enabled": True,
+        "multitenant.jwt_secret": JWT_SECRET,
+        # tokens have to outlive the run
+        "multitenant.token_ttl": int(args.warmup + args.duration) + 3600,
+        "ledger.disabled": True,
+        "transport.inbound_configs": [["http", "127.0.0.1", inbound_port]],
+        "transport.outbound_configs": ["http"],
+        "default_endpoint": f"http://127.0.0.1:{inbound_port}",
+        "external_plugins": PLUGINS,
+    }
+    if args.backend == "sqlite":
+        settings.update(
+            {
+                "wallet.type": "askar",
+                "wallet.name": "load-base",
+                "wallet.key": "load-base-key",
+                "wallet.key_derivation_method": "kdf:argon2i:int",
+            }
+        )
+    else:
+        settings["wallet.type"] = "in_memory"
+        # an in-memory wallet evicted from the cache is reopened empty
+        settings["multitenant.cache_size"] = args.tenants
+    settings.update(dict(args.setting or ()))
+    return settings
+
+
+def tenant_settings(backend: str, idx: int) -> dict:
+    """Settings of a tenant wallet."""
+    settings = {"wallet.name": f"load-tenant-{idx}", "wallet.webhook_urls": []}
+    if backend == "sqlite":
+        settings.update(
+            {
+                "wallet.type": "askar",
+                "wallet.key": f"load-tenant-key-{idx}",
+                "wallet.key_derivation_method": "kdf:argon2i:int",
+            }
+        )
+    else:
+        settings["wallet.type"] = "in_memory"
+    return settings
+
+
+async def provision(
+    manager: TractionMultitenantManager,
+    backend: str,
+    tenants: int,
+    tokens: int,
+    concurrency: int,
+) -> List[str]:
+    """Create tenant wallets and tokens for each of them.
+
+    Returns:
+        The tokens of all tenants
+
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def create(idx: int) -> str:
+        async with semaphore:
+            record = await manager.create_wallet(
+                tenant_settings(backend, idx), "managed"
+            )
+            return record.wallet_id
+
+    wallet_ids = await asyncio.gather(*(create(idx) for idx in range(tenants)))
+
+    issued = []
+    for start in range(0, len(wallet_ids), TOKEN_BATCH):
+        results = await manager.create_auth_tokens(
+            [
+                TokenRequest(wallet_id, count=tokens)
+                for wallet_id in wallet_ids[start : start + TOKEN_BATCH]
+            ]
+        )
+        for result in results:
+            if result.error:
+                raise result.error
+            issued.extend(result.tokens)
+    return issued
+
+
+class Workload:
+    """Open loop mix of admin API requests made with tenant tokens."""
+
+    def __init__(
+        self,
+        base_url: str,
+        tokens: Sequence[str],
+        mix: Dict[str, float],
+        rate: float,
+        max_in_flight: int,
+        seed: int = None,
+    ):
+        """Initialize Workload.
+
+        Args:
+            base_url: The admin API of the agent
+            tokens: Tenant tokens picked from at random for each request
+            mix: Relative weight of each route in ROUTES
+            rate: Requests started per second
+            max_in_flight: Requests pending at once, beyond it requests are skipped
+            seed: Seed of the route and token choices
+        """
+        self.base_url = base_url
+        self.tokens = list(tokens)
+        self.routes = list(mix)
+        self.weights = [mix[name] for name in self.routes]
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.random = random.Random(seed)
+
+    async def _request(
+        self, session: ClientSession, name: str, token: str, scheduled: float
+    ) -> Tuple[str, float, str]:
+        method, path, body = ROUTES[name]
+        try:
+            async with session.request(
+                method,
+                self.base_url + path,
+                json=body,
+                headers={"Authorization": f"Bearer {token}"},
+            ) as response:
+                await response.read()
+                status = str(response.status)
+        except (ClientError, asyncio.TimeoutError) as err:
+            status = type(err).__name__
+        return name, time.perf_counter() - scheduled, status
+
+    async def run(self, session: ClientSession, duration: float) -> dict:
+        """Make requests at the configured rate for a number of seconds.
+
+        Returns:
+            The latencies and status counts of every route, how many requests
+            were skipped and the time taken until all requests were done
+
+        """
+        latencies: Dict[str, List[float]] = {name: [] for name in self.routes}
+        statuses: Dict[str, Counter] = {name: Counter() for name in self.routes}
+        pending = set()
+        skipped = 0
+
+        def done(task: asyncio.Future):
+            pending.discard(task)
+            if task.cancelled():
+                return
+            name, latency, status = task.result()
+            latencies[name].append(latency)
+            statuses[name][status] += 1
+
+        interval = 1 / self.rate
+        started = time.perf_counter()
+        count = int(duration * self.rate)
+        for idx in range(count):
+            scheduled = started + idx * interval
+            delay = scheduled - time.perf_counter()
+            # yield even when behind, so responses are read while catching up
+            await asyncio.sleep(max(delay, 0))
+            if len(pending) >= self.max_in_flight:
+                skipped += 1
+                continue
+            name = self.random.choices(self.routes, self.weights)[0]
+            task = asyncio.ensure_future(
+                self._request(session, name, self.random.choice(self.tokens), scheduled)
+            )
+            pending.add(task)
+            task.add_done_callback(done)
+        if pending:
+            await asyncio.wait(list(pending))
+        return {
+            "latencies": latencies,
+            "statuses": statuses,
+            "skipped": skipped,
+            "elapsed": time.perf_counter() - started,
+        }
+
+
+def report(args, provisioning: dict, outcome: dict, rss: dict) -> dict:
+    """Build the report of a run."""
+    params = {
+        "backend": args.backend,
+        "tenants": args.tenants,
+        "tokens_per_tenant": args.tokens,
+        "target_rate": args.rate,
+        "duration": args.duration,
+        "mix": args.mix,
+    }
+    elapsed = outcome["elapsed"]
+    results = []
+    everything = []
+    all_statuses = Counter()
+    for name, latencies in outcome["latencies"].items():
+        everything.extend(latencies)
+        all_statuses.update(outcome["statuses"][name])
+        if latencies:
+            results.append(
+                summarize(
+                    name,
+                    "route",
+                    params,
+                    latencies,
+                    elapsed,
+                    statuses=dict(outcome["statuses"][name]),
+                )
+            )
+    if everything:
+        results.append(
+            summarize(
+                "all",
+                "route",
+                params,
+                everything,
+                elapsed,
+                statuses=dict(all_statuses),
+                skipped=outcome["skipped"],
+            )
+        )
+    return {
+        "meta": {
+            "commit": git_commit(os.path.dirname(os.path.abspath(__file__))),
+            "created": datetime.now(tz=timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "aries_cloudagent": acapy_version,
+        },
+        "params": params,
+        "provisioning": provisioning,
+        "memory_mb": rss,
+        "benchmarks": results,
+    }
+
+
+def print_report(result: dict):
+    """Print a summary table of a report."""
+    print(
+        "provisioned {tenants} tenants and {tokens} tokens in {seconds:.1f}s".format(
+            **result["provisioning"]
+        )
+    )
+    print(
+        f"{'route':<18} {'requests':>8} {'req/s':>8} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'p99 ms':>8}  statuses"
+    )
+    for entry in result["benchmarks"]:
+        latency = entry["latency_ms"]
+        print(
+            f"{entry['name']:<18} {entry['rounds']:>8} "
+            f"{entry['ops_per_second']:>8.1f} {latency['p50']:>8.1f} "
+            f"{latency['p95']:>8.1f} {latency['p99']:>8.1f}  "
+            f"{entry['extra']['statuses']}"
+        )
+        if "skipped" in entry["extra"]:
+            print(f"skipped for max in flight: {entry['extra']['skipped']}")
+    memory = result["memory_mb"]
+    print(
+        f"peak RSS {memory['peak']:.1f} MiB, "
+        f"{memory['after_provisioning']:.1f} MiB after provisioning"
+    )
+
+
+async def run(args) -> dict:
+    """Start the agent, provision tenants, run the workload and stop."""
+    conductor = Conductor(DefaultContextBuilder(agent_settings(args)))
+    await conductor.setup()
+    await conductor.start()
+    try:
+        admin_server = conductor.context.inject(BaseAdminServer)
+        manager = admin_server.multitenant_manager
+        if not isinstance(manager, TractionMultitenantManager):
+            raise RuntimeError("multitenant_multitoken plugin did not load")
+
+        started = time.perf_counter()
+        tokens = await provision(
+            manager, args.backend, args.tenants, args.tokens, args.concurrency
+        )
+        provisioning = {
+            "tenants": args.tenants,
+            "tokens": len(tokens),
+            "seconds": time.perf_counter() - started,
+        }
+        after_provisioning = peak_rss_mb()
+
+        settings = conductor.context.settings
+        workload = Workload(
+            f"http://127.0.0.1:{settings['admin.port']}",
+            tokens,
+            args.mix,
+            args.rate,
+            args.max_in_flight,
+            args.seed,
+        )
+        async with ClientSession(
+            connector=TCPConnector(limit=args.max_in_flight),
+            timeout=ClientTimeout(total=args.timeout),
+        ) as session:
+            if args.warmup:
+                await workload.run(session, args.warmup)
+            outcome = await workload.run(session, args.duration)
+    finally:
+        await conductor.stop()
+
+    return report(
+        args,
+        provisioning,
+        outcome,
+        {"after_provisioning": after_provisioning, "peak": peak_rss_mb()},
+    )
+
+
+def parser() -> argparse.ArgumentParser:
+    """Command line of the load test."""
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.load", description=__doc__.split("\n\n")[0]
+    )
+    parser.add_argument("--tenants", type=int, default=1000)
+    parser.add_argument("--tokens", type=int, default=3, help="Tokens per tenant")
+    parser.add_argument(
+        "--rate", type=float, default=100, help="Requests started per second"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Seconds of measured load"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=5, help="Seconds of load before measuring"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix(DEFAULT_MIX),
+        help=f"Route weights, default {DEFAULT_MIX}",
+    )
+    parser.add_argument("--backend", choices=BACKENDS, default="in_memory")
+    parser.add_argument(
+        "--concurrency", type=int, default=20, help="Wallets created at once"
+    )
+    parser.add_argument("--max-in-flight", type=int, default=500)
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="Seconds before a request fails"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--setting",
+        type=parse_setting,
+        action="append",
+        help="Agent setting as key=value, e.g. multitenant.cache_size=100",
+    )
+    parser.add_argument(
+        "--output", default="load_output.json", help="File the report is written to"
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    return parser
+
+
+def main(argv: Sequence[str] = None):
+    """Run the load test from the command line."""
+    args = parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    home = None
+    if args.backend == "sqlite" and not os.getenv("ACAPY_HOME"):
+        # keep the wallet files of a run out of the user's agent home
+        home = tempfile.TemporaryDirectory(prefix="acapy-load-")
+        os.environ["ACAPY_HOME"] = home.name
+    try:
+        result = asyncio.get_event_loop().run_until_complete(run(args))
+    finally:
+        if home:
+            home.cleanup()
+    with open(args.output, "w") as output:
+        json.dump(result, output, indent=2)
+    print_report(result)
+
+
+if __name__ == "__main__":
+    main()
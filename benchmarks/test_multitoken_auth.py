@@ -0,0 +1,317 @@
+"""Benchmarks of the multitoken auth hot path on an in-memory profile."""
+
+import pytest
+
+from plugins.multitenant_multitoken.claims import TokenClaimRecord
+from plugins.multitenant_multitoken.manager import TokensWalletRecord
+from plugins.multitenant_multitoken.projection import WalletAuthView
+
+from .bench import (
+    add_wallets,
+    allocated,
+    make_manager,
+    make_profile,
+    measure,
+    measure_concurrent,
+    peak_allocated,
+    rounds_for,
+    seed_claims,
+    summarize,
+)
+
+CLAIM_COUNTS = [10, 100, 1_000, 10_000, 100_000]
+TENANT_COUNTS = [1, 10, 100, 1_000]
+CONCURRENCY = [1, 10, 100, 1_000]
+
+
+def _claims_settings(claims: int, rounds: int) -> dict:
+    # keep the trim from collapsing the outstanding claims being measured
+    return {"multitenant.max_token_claims": claims + rounds + 1}
+
+
+async def _count_claims(profile, wallet_id: str) -> int:
+    async with profile.session() as session:
+        return len(await TokenClaimRecord.query(session, {"wallet_id": wallet_id}))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("claims", CLAIM_COUNTS)
+async def test_create_auth_token_by_claims(claims, bench_rounds, bench_results):
+    rounds = rounds_for(bench_rounds, claims)
+    profile = make_profile(_claims_settings(claims, rounds))
+    manager = make_manager(profile)
+    (wallet,) = await add_wallets(profile, 1)
+    await seed_claims(profile, wallet.wallet_id, claims)
+
+    latencies, elapsed = await measure(
+        lambda _: manager.create_auth_token(wallet), rounds
+    )
+
+    assert await _count_claims(profile, wallet.wallet_id) > claims
+    bench_results.append(
+        summarize(
+            "create_auth_token",
+            "claims_per_wallet",
+            {"claims": claims},
+            latencies,
+            elapsed,
+        )
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("claims", CLAIM_COUNTS)
+async def test_get_profile_for_token_by_claims(claims, bench_rounds, bench_results):
+    rounds = rounds_for(bench_rounds, claims)
+    profile = make_profile(_claims_settings(claims, rounds))
+    manager = make_manager(profile)
+    (wallet,) = await add_wallets(profile, 1)
+    await seed_claims(profile, wallet.wallet_id, claims)
+    token = await manager.create_auth_token(wallet)
+
+    async def authenticate(_):
+        assert await manager.get_profile_for_token(profile.context, token)
+
+    latencies, elapsed = await measure(
+        authenticate, rounds, before=manager.token_cache.clear
+    )
+    bench_results.append(
+        summarize(
+            "get_profile_for_token",
+            "claims_per_wallet",
+            {"claims": claims, "token_cache": "cold"},
+            latencies,
+            elapsed,
+        )
+    )
+
+    latencies, elapsed = await measure(authenticate, rounds)
+    bench_results.append(
+        summarize(
+            "get_profile_for_token",
+            "claims_per_wallet",
+            {"claims": claims, "token_cache": "warm"},
+            latencies,
+            elapsed,
+            token_cache=manager.token_cache.stats,
+        )
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("tenants", TENANT_COUNTS)
+async def test_auth_by_tenants(tenants, bench_rounds, bench_results):
+    profile = make_profile()
+    manager = make_manager(profile)
+    wallets = await add_wallets(profile, tenants)
+    rounds = max(bench_rounds, tenants)
+
+    tokens = []
+
+    async def issue(idx):
+        wallet = wallets[idx % tenants]
+        token = await manager.create_auth_token(wallet)
+        if idx < tenants:
+            tokens.append(token)
+
+    latencies, elapsed = await measure(issue, rounds)
+    bench_results.append(
+        summarize(
+            "create_auth_token",
+            "tenants",
+            {"tenants": tenants},
+            latencies,
+            elapsed,
+        )
+    )
+
+    async def authenticate(idx):
+        assert await manager.get_profile_for_token(
+            profile.context, tokens[idx % tenants]
+        )
+
+    latencies, elapsed = await measure(
+        authenticate, rounds, before=manager.token_cache.clear
+    )
+    bench_results.append(
+        summarize(
+            "get_profile_for_token",
+            "tenants",
+            {"tenants": tenants, "token_cache": "cold"},
+            latencies,
+            elapsed,
+            profile_cache=manager.profile_cache.stats,
+        )
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("concurrency", CONCURRENCY)
+async def test_concurrent_issuance_same_wallet(
+    concurrency, bench_rounds, bench_results
+):
+    rounds = max(bench_rounds // concurrency, 1)
+    # every token has a claim of its own, keep them all
+    profile = make_profile(_claims_settings(50, rounds * concurrency))
+    manager = make_manager(profile)
+    (wallet,) = await add_wallets(profile, 1)
+    await seed_claims(profile, wallet.wallet_id, 50)
+
+    latencies = []
+    elapsed = 0.0
+    tokens = set()
+    for _ in range(rounds):
+        burst, burst_elapsed, results = await measure_concurrent(
+            lambda _: manager.create_auth_token(wallet), concurrency
+        )
+        latencies.extend(burst)
+        elapsed += burst_elapsed
+        tokens.update(results)
+
+    for token in tokens:
+        assert await manager.get_profile_for_token(profile.context, token)
+
+    bench_results.append(
+        summarize(
+            "create_auth_token",
+            "concurrent_same_wallet",
+            {"concurrency": concurrency},
+            latencies,
+            elapsed,
+            distinct_tokens=len(tokens),
+        )
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stateless", [False, True])
+async def test_auth_stateless_tokens(stateless, bench_rounds, bench_results):
+    profile = make_profile({"multitenant.stateless_tokens": stateless})
+    manager = make_manager(profile)
+    (wallet,) = await add_wallets(profile, 1)
+    await seed_claims(profile, wallet.wallet_id, 100)
+    tokens = []
+
+    async def issue(_):
+        tokens.append(await manager.create_auth_token(wallet))
+
+    latencies, elapsed = await measure(issue, bench_rounds)
+    bench_results.append(
+        summarize(
+            "create_auth_token",
+            "token_mode",
+            {"stateless": stateless},
+            latencies,
+            elapsed,
+        )
+    )
+
+    async def authenticate(idx):
+        assert await manager.get_profile_for_token(profile.context, tokens[idx])
+
+    latencies, elapsed = await measure(
+        authenticate, bench_rounds, before=manager.token_cache.clear
+    )
+    bench_results.append(
+        summarize(
+            "get_profile_for_token",
+            "token_mode",
+            {"stateless": stateless, "token_cache": "cold"},
+            latencies,
+            elapsed,
+        )
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sample_rate", [0.0, 0.01, 1.0])
+async def test_auth_tracing(sample_rate, bench_rounds, bench_results):
+    profile = make_profile(
+        {
+            "multitenant.trace_sample_rate": sample_rate,
+            "multitenant.trace_sink": "memory",
+        }
+    )
+    manager = make_manager(profile)
+    (wallet,) = await add_wallets(profile, 1)
+    token = await manager.create_auth_token(wallet)
+
+    async def authenticate(_):
+        assert await manager.get_profile_for_token(profile.context, token)
+
+    latencies, elapsed = await measure(
+        authenticate, bench_rounds, before=manager.token_cache.clear
+    )
+
+    traces = manager.tracer.sink.traces
+    if sample_rate == 1.0:
+        stages = [span.name for span in traces[-1].spans]
+        assert stages == ["jwt_decode", "record_fetch", "claim_check", "profile_open"]
+    elif not sample_rate:
+        assert not traces
+    bench_results.append(
+        summarize(
+            "get_profile_for_token",
+            "tracing",
+            {"sample_rate": sample_rate, "token_cache": "cold"},
+            latencies,
+            elapsed,
+            traces=len(traces),
+        )
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("read", ["record", "projection"])
+async def test_auth_wallet_read(read, bench_rounds, bench_results):
+    profile = make_profile()
+    (wallet,) = await add_wallets(profile, 1)
+
+    async def fetch(_):
+        async with profile.session() as session:
+            if read == "record":
+                return await TokensWalletRecord.retrieve_by_id(
+                    session, wallet.wallet_id
+                )
+            return await WalletAuthView.retrieve(
+                session, wallet.wallet_id, TokensWalletRecord
+            )
+
+    latencies, elapsed = await measure(fetch, bench_rounds)
+    bench_results.append(
+        summarize(
+            "wallet_read",
+            "auth_wallet_read",
+            {"read": read},
+            latencies,
+            elapsed,
+            peak_bytes=await peak_allocated(fetch, bench_rounds),
+            bytes_per_result=await allocated(fetch, bench_rounds),
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_auth_profile_open(bench_rounds, bench_results):
+    profile = make_profile()
+    manager = make_manager(profile)
+    (wallet,) = await add_wallets(profile, 1)
+    token = await manager.create_auth_token(wallet)
+
+    async def authenticate(_):
+        manager.token_cache.clear()
+        assert await manager.get_profile_for_token(profile.context, token)
+
+    # the profile is open after the first call, later ones only verify
+    latencies, elapsed = await measure(authenticate, bench_rounds)
+    assert manager.token_cache.get(token).wallet._record is None
+    bench_results.append(
+        summarize(
+            "get_profile_for_token",
+            "auth_wallet_read",
+            {"token_cache": "cold", "profile_cache": "warm"},
+            latencies,
+            elapsed,
+            peak_bytes=await peak_allocated(authenticate, bench_rounds),
+        )
+    )
@@ -0,0 +1,106 @@
+"""Benchmarks of traction decorator handling on agent messages."""
+
+import pytest
+
+from aries_cloudagent.messaging.agent_message import AgentMessageSchema
+from aries_cloudagent.messaging.models.base import BaseModel
+
+from plugins.common.traction_decorator import TractionDecorator, TractionDecoratorSchema
+from plugins.common.traction_message import TractionMessage
+
+from .bench import allocated, measure, summarize
+
+TRACTION = {"external_reference_id": "ext-1", "tags": ["campaign", "onboarding"]}
+
+
+class BenchMessage(TractionMessage):
+    class Meta:
+        handler_class = None
+        message_type = "https://didcomm.org/traction-bench/1.0/message"
+        schema_class = "BenchMessageSchema"
+
+
+class BenchMessageSchema(AgentMessageSchema):
+    class Meta:
+        model_class = BenchMessage
+
+
+class SchemaTractionDecorator(TractionDecorator):
+    """Decorator going through the schema, as before the fast path."""
+
+    serialize = BaseModel.serialize
+    deserialize = classmethod(BaseModel.deserialize.__func__)
+
+
+class EagerMessage(BenchMessage):
+    """Message building an empty decorator up front, as before lazy creation."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._decorators["traction"] = SchemaTractionDecorator()
+
+
+def _new_message(path: str, traction: bool):
+    if path == "fast":
+        message = BenchMessage()
+        if traction:
+            message.assign_traction(**TRACTION)
+    else:
+        message = EagerMessage()
+        if traction:
+            message._traction = SchemaTractionDecorator(**TRACTION)
+    return message
+
+
+@pytest.mark.parametrize("value", [TRACTION, {"tags": []}, {"tags": ["a"] * 50}])
+def test_fast_path_matches_schema(value):
+    schema = TractionDecoratorSchema()
+    decorator = TractionDecorator.deserialize(value)
+    assert decorator.serialize() == schema.dump(schema.load(value))
+    assert TractionDecorator.deserialize(decorator.serialize()).serialize() == (
+        decorator.serialize()
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("traction", [False, True])
+@pytest.mark.parametrize("path", ["schema", "fast"])
+async def test_message_round_trip(path, traction, bench_rounds, bench_results):
+    rounds = max(bench_rounds, 1_000)
+    serialized = _new_message(path, traction).serialize()
+
+    async def build(_):
+        return _new_message(path, traction)
+
+    async def create(_):
+        return _new_message(path, traction).serialize()
+
+    latencies, elapsed = await measure(create, rounds)
+    bench_results.append(
+        summarize(
+            "traction_message_serialize",
+            "traction_decorator",
+            {"path": path, "traction": traction},
+            latencies,
+            elapsed,
+            bytes_per_message=await allocated(build, rounds),
+        )
+    )
+
+    async def receive(_):
+        message = BenchMessage.deserialize(serialized)
+        if path == "fast":
+            return message._traction
+        value = message._decorators.get("traction")
+        return value and SchemaTractionDecorator.deserialize(value)
+
+    latencies, elapsed = await measure(receive, rounds)
+    bench_results.append(
+        summarize(
+            "traction_message_deserialize",
+            "traction_decorator",
+            {"path": path, "traction": traction},
+            latencies,
+            elapsed,
+        )
+    )
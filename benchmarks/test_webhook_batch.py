@@ -0,0 +1,255 @@
+"""Benchmarks and checks of batched webhook dispatch against a local receiver."""
+
+import asyncio
+import time
+from typing import List, Sequence
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from aries_cloudagent.core.event_bus import Event
+from aries_cloudagent.core.in_memory import InMemoryProfile
+
+from plugins.multitenant_multitoken.webhooks import (
+    BATCHES,
+    DROPPED,
+    BatchWebhookDispatcher,
+)
+
+from .bench import summarize
+
+TOPIC = "acapy::record::connections::active"
+
+
+class Receiver:
+    """Webhook receiver answering with scripted statuses, 200 once they run out."""
+
+    def __init__(self, statuses: Sequence[int] = (), delay: float = 0.0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        # set to hold back answers until the test releases them
+        self.release = asyncio.Event()
+        self.release.set()
+        self.attempts: List[float] = []
+        self.batches: List[dict] = []
+        self.received: List[float] = []
+        self._server: TestServer = None
+
+    async def __aenter__(self) -> "Receiver":
+        app = web.Application()
+        app.router.add_post("/hooks", self._handle)
+        self._server = TestServer(app)
+        await self._server.start_server()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._server.close()
+
+    @property
+    def url(self) -> str:
+        return str(self._server.make_url("/hooks"))
+
+    def events(self, wallet_id: str) -> List[dict]:
+        return [
+            event
+            for batch in self.batches
+            if batch["wallet_id"] == wallet_id
+            for event in batch["events"]
+        ]
+
+    async def _handle(self, request: web.Request):
+        self.attempts.append(time.perf_counter())
+        body = await request.json()
+        await self.release.wait()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        status = self.statuses.pop(0) if self.statuses else 200
+        if status < 300:
+            self.batches.append(body)
+            self.received.append(time.perf_counter())
+        return web.Response(status=status)
+
+
+def _tenant(idx: int) -> InMemoryProfile:
+    return InMemoryProfile.test_profile({"wallet.id": f"tenant{idx}"})
+
+
+def _event(seq: int) -> Event:
+    return Event(TOPIC, {"seq": seq, "created": time.perf_counter()})
+
+
+async def _wait_for(condition, timeout: float = 10.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "timed out waiting for webhooks"
+        await asyncio.sleep(0.005)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("tenants", [1, 10, 100])
+async def test_batch_delivery(tenants, bench_rounds, bench_results):
+    events = max(bench_rounds, 100)
+    max_batch = 50
+    profiles = [_tenant(idx) for idx in range(tenants)]
+    async with Receiver(delay=0.001) as receiver:
+        dispatcher = BatchWebhookDispatcher(
+            [receiver.url], max_batch=max_batch, max_delay=0.05, concurrency=4
+        )
+        dispatcher.start()
+        try:
+            started = time.perf_counter()
+            for seq in range(events):
+                for profile in profiles:
+                    await dispatcher.on_record_event(profile, _event(seq))
+            await _wait_for(
+                lambda: sum(len(batch["events"]) for batch in receiver.batches)
+                == events * tenants
+            )
+            elapsed = time.perf_counter() - started
+        finally:
+            await dispatcher.stop()
+
+    latencies = []
+    for batch, received in zip(receiver.batches, receiver.received):
+        assert 0 < len(batch["events"]) <= max_batch
+        latencies.extend(
+            received - event["payload"]["created"] for event in batch["events"]
+        )
+    for profile in profiles:
+        seqs = [
+            event["payload"]["seq"]
+            for event in receiver.events(profile.settings["wallet.id"])
+        ]
+        # nothing lost, nothing repeated, in the order it happened
+        assert seqs == list(range(events))
+
+    bench_results.append(
+        summarize(
+            "webhook_batch_delivery",
+            "webhook_batch",
+            {"tenants": tenants, "events": events, "max_batch": max_batch},
+            latencies,
+            elapsed,
+            batches=len(receiver.batches),
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_flush_by_size_and_time():
+    profile = _tenant(0)
+    async with Receiver() as receiver:
+        dispatcher = BatchWebhookDispatcher([receiver.url], max_batch=10, max_delay=0.2)
+        dispatcher.start()
+        try:
+            started = time.perf_counter()
+            for seq in range(13):
+                await dispatcher.on_record_event(profile, _event(seq))
+            await _wait_for(lambda: len(receiver.batches) == 2)
+        finally:
+            await dispatcher.stop()
+
+    full, rest = receiver.batches
+    assert [len(full["events"]), len(rest["events"])] == [10, 3]
+    # a full buffer goes out at once, the rest waits for max_delay
+    assert receiver.received[0] - started < 0.2
+    assert receiver.received[1] - started >= 0.2
+
+
+@pytest.mark.asyncio
+async def test_backpressure_drops_oldest():
+    profile = _tenant(0)
+    dropped = DROPPED.labels().value
+    async with Receiver() as receiver:
+        dispatcher = BatchWebhookDispatcher(
+            [receiver.url],
+            max_batch=10,
+            max_delay=0.01,
+            max_pending=20,
+            max_queued=1,
+            concurrency=1,
+        )
+        dispatcher.start()
+        try:
+            receiver.release.clear()
+            await dispatcher.on_record_event(profile, _event(0))
+            # the first batch is stuck at the receiver
+            await _wait_for(lambda: receiver.attempts)
+            started = time.perf_counter()
+            for seq in range(1, 101):
+                await dispatcher.on_record_event(profile, _event(seq))
+            handler_seconds = time.perf_counter() - started
+            assert dispatcher.pending <= 20
+            receiver.release.set()
+            await _wait_for(lambda: len(receiver.batches) == 3)
+        finally:
+            await dispatcher.stop()
+
+    seqs = [event["payload"]["seq"] for event in receiver.events("tenant0")]
+    # the buffer kept the newest events, in order
+    assert seqs == [0] + list(range(81, 101))
+    assert DROPPED.labels().value - dropped == 80
+    # buffering never waits for the receiver
+    assert handler_seconds < 0.5
+
+
+@pytest.mark.asyncio
+async def test_total_pending_bound():
+    profiles = [_tenant(idx) for idx in range(100)]
+    dropped = DROPPED.labels().value
+    async with Receiver() as receiver:
+        dispatcher = BatchWebhookDispatcher(
+            [receiver.url], max_batch=100, max_delay=0.05, max_total_pending=50
+        )
+        dispatcher.start()
+        try:
+            for seq in range(3):
+                for profile in profiles:
+                    await dispatcher.on_record_event(profile, _event(seq))
+            # the per tenant bound is far off, the total one holds
+            assert dispatcher.pending == 50
+            await _wait_for(lambda: len(receiver.batches) == 50)
+        finally:
+            await dispatcher.stop()
+
+    assert DROPPED.labels().value - dropped == 250
+    for batch in receiver.batches:
+        # a tenant at the bound keeps its newest event
+        assert [event["payload"]["seq"] for event in batch["events"]] == [2]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "statuses,outcome,attempts",
+    [
+        ([503, 503], "sent", 3),
+        ([429], "sent", 2),
+        ([503, 503, 503], "failed", 3),
+        ([400], "rejected", 1),
+    ],
+)
+async def test_retry_with_backoff(statuses, outcome, attempts):
+    backoff = 0.05
+    profile = _tenant(0)
+    before = BATCHES.labels(outcome).value
+    async with Receiver(statuses) as receiver:
+        dispatcher = BatchWebhookDispatcher(
+            [receiver.url], max_batch=1, retries=2, backoff=backoff
+        )
+        dispatcher.start()
+        try:
+            await dispatcher.on_record_event(profile, _event(0))
+            await _wait_for(lambda: BATCHES.labels(outcome).value > before)
+        finally:
+            await dispatcher.stop()
+
+    assert len(receiver.attempts) == attempts
+    assert len(receiver.batches) == (outcome == "sent")
+    gaps = [
+        later - earlier
+        for earlier, later in zip(receiver.attempts, receiver.attempts[1:])
+    ]
+    # each retry waits twice as long as the one before
+    for retry, gap in enumerate(gaps):
+        assert gap >= backoff * 2 ** retry
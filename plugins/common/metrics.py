@@ -0,0 +1,235 @@
+"""In-process metrics in Prometheus text format.
+
+Recording is a dict lookup and a few additions. Everything runs on the event
+loop thread, so no locks are taken, and histogram buckets are fixed when the
+histogram is created.
+"""
+
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        # the last slot counts values above the largest bound
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """Base class of a metric family with fixed label names."""
+
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """Initialize Metric.
+
+        Args:
+            name: The metric name
+            documentation: Help text of the metric
+            labelnames: Names of the labels each sample is recorded with
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values: str):
+        """Get the child recording samples for a set of label values."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(
+                    f"Metric {self.name} expects labels {self.labelnames}"
+                )
+            child = self._children[values] = self._new_child()
+        return child
+
+    def remove(self, *values: str):
+        """Drop the samples recorded for a set of label values."""
+        self._children.pop(values, None)
+
+    def clear(self):
+        """Drop all recorded samples."""
+        self._children.clear()
+
+    def samples(self) -> Iterator[str]:
+        """Iterate over the sample lines of this metric."""
+        for values, child in list(self._children.items()):
+            yield (
+                f"{self.name}{_format_labels(self.labelnames, values)} "
+                f"{_format_value(child.value)}"
+            )
+
+    def expose(self) -> List[str]:
+        """Get the lines exposing this metric in Prometheus text format."""
+        return [
+            f"# HELP {self.name} {_escape_help(self.documentation)}",
+            f"# TYPE {self.name} {self.TYPE}",
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    TYPE = "counter"
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    TYPE = "gauge"
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        """Initialize Histogram.
+
+        Args:
+            name: The metric name
+            documentation: Help text of the metric
+            labelnames: Names of the labels each sample is recorded with
+            buckets: Upper bounds of the buckets, the +Inf bucket is implied
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def samples(self) -> Iterator[str]:
+        """Iterate over the sample lines of this metric."""
+        bucket_labels = (*self.labelnames, "le")
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip((*child.bounds, float("inf")), child.counts):
+                cumulative += count
+                labels = _format_labels(bucket_labels, (*values, _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+
+class MetricsRegistry:
+    """Collection of the metrics exposed together."""
+
+    def __init__(self):
+        """Initialize MetricsRegistry."""
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric, returning the one already registered under its name."""
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        """Get or create a counter."""
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        """Get or create a gauge."""
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Get or create a histogram."""
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Metric:
+        """Get a registered metric by name."""
+        return self._metrics.get(name)
+
+    def expose(self) -> str:
+        """Render all metrics in Prometheus text format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
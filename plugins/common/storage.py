@@ -0,0 +1,86 @@
+"""Storage helpers shared by the traction plugins."""
+
+from typing import AsyncIterator, Mapping, Sequence
+
+from aries_cloudagent.core.profile import ProfileSession
+from aries_cloudagent.storage.base import BaseStorage, BaseStorageSearch
+from aries_cloudagent.storage.error import StorageError
+from aries_cloudagent.storage.record import StorageRecord
+
+DEFAULT_BATCH_SIZE = 100
+
+
+def get_storage_search(session: ProfileSession) -> BaseStorageSearch:
+    """Get the paged search implementation for a session.
+
+    Indy and askar profiles bind a dedicated search provider, the in-memory
+    storage implements searching itself.
+
+    Args:
+        session: The profile session to use
+
+    Raises:
+        StorageError: If the storage backend does not support searching
+
+    """
+    search = session.inject_or(BaseStorageSearch)
+    if search:
+        return search
+    storage = session.inject(BaseStorage)
+    if isinstance(storage, BaseStorageSearch):
+        return storage
+    raise StorageError("Storage backend does not support paged searches")
+
+
+async def iter_record_batches(
+    session: ProfileSession,
+    record_type: str,
+    tag_query: Mapping = None,
+    *,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> AsyncIterator[Sequence[StorageRecord]]:
+    """Iterate over the storage records of a type one page at a time.
+
+    Args:
+        session: The profile session to use
+        record_type: The record type to search for
+        tag_query: An optional tag query to apply
+        batch_size: The maximum number of records per page
+
+    """
+    search = get_storage_search(session).search_records(
+        record_type, tag_query, page_size=batch_size
+    )
+    try:
+        while True:
+            rows = await search.fetch(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        await search.close()
+
+
+async def fetch_records(
+    session: ProfileSession,
+    record_type: str,
+    tag_query: Mapping = None,
+    *,
+    limit: int = DEFAULT_BATCH_SIZE,
+) -> Sequence[StorageRecord]:
+    """Fetch the first storage records of a type matching a query.
+
+    Args:
+        session: The profile session to use
+        record_type: The record type to search for
+        tag_query: An optional tag query to apply
+        limit: The maximum number of records to return
+
+    """
+    search = get_storage_search(session).search_records(
+        record_type, tag_query, page_size=limit
+    )
+    try:
+        return await search.fetch(limit)
+    finally:
+        await search.close()
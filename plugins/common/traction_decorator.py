@@ -1,10 +1,11 @@
 """
-A message decorator for threads.
+A message decorator for traction fields.
 
-A thread decorator identifies a message that may require additional
-context from previous messages.
+A traction decorator carries the external reference and tags a message is
+filed under in the traction tenant's system.
 """
 
+import json
 from typing import List, Optional
 
 from marshmallow import EXCLUDE, fields
@@ -13,6 +14,10 @@ from aries_cloudagent.messaging.models.base import BaseModel, BaseModelSchema
 from aries_cloudagent.messaging.valid import UUIDFour
 
 
+def _plain_tags(tags) -> bool:
+    return type(tags) is list and all(type(tag) is str for tag in tags)
+
+
 class TractionDecorator(BaseModel):
 
     class Meta:
@@ -27,7 +32,8 @@ class TractionDecorator(BaseModel):
 
         super().__init__()
         self._external_reference_id = external_reference_id
-        self._tags = tags
+        # the schema requires tags, so an empty list stands in for none
+        self._tags = tags if tags is not None else []
 
     @property
     def external_reference_id(self):
@@ -37,6 +43,43 @@ class TractionDecorator(BaseModel):
     def tags(self):
         return self._tags
 
+    @property
+    def is_empty(self) -> bool:
+        """Whether the decorator carries no traction data."""
+        return not (self._external_reference_id or self._tags)
+
+    def serialize(self, as_string=False, unknown: str = None) -> dict:
+        """Serialize the decorator, skipping the schema for plain field values.
+
+        Produces the same output as `TractionDecoratorSchema`, which is used
+        for any value that is not already a JSON string or list of strings.
+        """
+        ext_id = self._external_reference_id
+        if not (ext_id is None or type(ext_id) is str) or not _plain_tags(self._tags):
+            return super().serialize(as_string, unknown)
+
+        data = {}
+        if ext_id is not None:
+            data["external_reference_id"] = ext_id
+        data["tags"] = list(self._tags)
+        return json.dumps(data, separators=(",", ":")) if as_string else data
+
+    @classmethod
+    def deserialize(cls, obj, unknown: str = None, none2none: str = False):
+        """Deserialize a decorator, skipping the schema for well-formed input.
+
+        Anything the fast path does not accept as is goes through
+        `TractionDecoratorSchema`, so invalid input fails as it always has.
+        """
+        if obj is None and none2none:
+            return None
+        if isinstance(obj, dict) and unknown in (None, EXCLUDE):
+            ext_id = obj.get("external_reference_id")
+            tags = obj.get("tags")
+            if (ext_id is None or type(ext_id) is str) and _plain_tags(tags):
+                return cls(external_reference_id=ext_id, tags=list(tags))
+        return super().deserialize(obj, unknown, none2none)
+
 
 class TractionDecoratorSchema(BaseModelSchema):
 
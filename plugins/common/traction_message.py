@@ -1,11 +1,15 @@
-from typing import Union
+from typing import List, Optional, Union
 
 from aries_cloudagent.messaging.agent_message import AgentMessage
 
 from .traction_decorator import TractionDecorator
 
 class TractionMessage(AgentMessage):
+    """Agent message that can carry traction fields in a ~traction decorator.
 
+    The decorator is only created once traction data is set, messages without
+    any serialize exactly like plain agent messages.
+    """
 
     def __init__(
         self,
@@ -13,15 +17,29 @@ class TractionMessage(AgentMessage):
     ):
 
         super().__init__(**kwargs)
-        self._decorators["traction"] = TractionDecorator()
 
     @property
-    def _traction(self) -> TractionDecorator:
-        return self._decorators.get("traction")
+    def _traction(self) -> Optional[TractionDecorator]:
+        value = self._decorators.get("traction")
+        if isinstance(value, dict):
+            # received decorators stay raw until they are first read
+            value = TractionDecorator.deserialize(value)
+            self._decorators["traction"] = value
+        return value
 
     @_traction.setter
     def _traction(self, val: Union[TractionDecorator, dict]):
-        if val is None:
+        if isinstance(val, dict):
+            val = TractionDecorator.deserialize(val)
+        if val is None or val.is_empty:
             self._decorators.pop("traction", None)
         else:
-            self._decorators["traction"] = val
\ No newline at end of file
+            self._decorators["traction"] = val
+
+    def assign_traction(
+        self, external_reference_id: str = None, tags: List[str] = None
+    ):
+        """Set the traction fields of this message, clearing them when empty."""
+        self._traction = TractionDecorator(
+            external_reference_id=external_reference_id, tags=tags
+        )
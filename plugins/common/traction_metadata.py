@@ -0,0 +1,33 @@
+"""Traction fields stored as connection metadata, shared by the plugins."""
+
+import json
+from typing import Dict, Iterable
+
+from aries_cloudagent.connections.models.conn_record import ConnRecord
+from aries_cloudagent.core.profile import ProfileSession
+from aries_cloudagent.storage.base import BaseStorage
+
+TRACTION_METADATA_KEY = "traction"
+
+
+async def find_traction(
+    session: ProfileSession, connection_ids: Iterable[str]
+) -> Dict[str, dict]:
+    """Read the traction fields of several connections with one query.
+
+    Args:
+        session: The profile session to use
+        connection_ids: The connections to read the traction fields of
+
+    Returns:
+        The traction fields by connection id, for connections that have them
+
+    """
+    connection_ids = sorted(set(connection_ids))
+    if not connection_ids:
+        return {}
+    rows = await session.inject(BaseStorage).find_all_records(
+        ConnRecord.RECORD_TYPE_METADATA,
+        {"key": TRACTION_METADATA_KEY, "connection_id": {"$in": connection_ids}},
+    )
+    return {row.tags["connection_id"]: json.loads(row.value) for row in rows}
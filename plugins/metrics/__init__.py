@@ -0,0 +1,30 @@
+import logging
+
+from aries_cloudagent.admin.base_server import BaseAdminServer
+from aries_cloudagent.config.injection_context import InjectionContext
+from aries_cloudagent.core.event_bus import Event, EventBus
+from aries_cloudagent.core.profile import Profile
+from aries_cloudagent.core.util import STARTUP_EVENT_PATTERN
+
+from .routes import METRICS_PATH
+
+LOGGER = logging.getLogger(__name__)
+
+
+async def setup(context: InjectionContext):
+    """Setup plugin."""
+    LOGGER.info("> metrics loading...")
+    bus = context.inject(EventBus)
+    if not bus:
+        raise ValueError("EventBus missing in context")
+
+    bus.subscribe(STARTUP_EVENT_PATTERN, on_startup)
+
+
+async def on_startup(profile: Profile, event: Event):
+    # with multitenancy only server paths are open to the base wallet, the
+    # metrics must be scraped without a subwallet token
+    srv = profile.inject_or(BaseAdminServer)
+    server_paths = getattr(srv, "server_paths", None)
+    if server_paths is not None and METRICS_PATH not in server_paths:
+        server_paths.append(METRICS_PATH)
@@ -0,0 +1,85 @@
+"""Admin request metrics middleware."""
+
+import asyncio
+import time
+
+from aiohttp import web
+
+from ..common.metrics import REGISTRY
+
+REQUESTS = REGISTRY.counter(
+    "acapy_admin_requests_total",
+    "Admin requests handled",
+    ["method", "route"],
+)
+REQUEST_ERRORS = REGISTRY.counter(
+    "acapy_admin_request_errors_total",
+    "Admin requests answered with an error status",
+    ["method", "route", "status"],
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "acapy_admin_requests_in_flight",
+    "Admin requests currently being handled",
+    ["method", "route"],
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "acapy_admin_request_seconds",
+    "Admin request latency including authentication and all middleware",
+    ["method", "route"],
+)
+HANDLER_SECONDS = REGISTRY.histogram(
+    "acapy_admin_handler_seconds",
+    "Admin route handler latency, excluding authentication",
+    ["method", "route"],
+)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+# status recorded for requests abandoned by the client, as nginx does
+CLIENT_CLOSED_REQUEST = 499
+
+
+def route_label(request: web.BaseRequest) -> str:
+    """Get the route template of a request, bounding the label cardinality."""
+    # match info is a dict of the path variables, empty for plain routes
+    match_info = getattr(request, "match_info", None)
+    resource = match_info.route.resource if match_info is not None else None
+    return resource.canonical if resource else UNMATCHED_ROUTE
+
+
+@web.middleware
+async def request_metrics_middleware(request: web.BaseRequest, handler):
+    """Record count, latency, errors and in-flight requests per route."""
+    labels = (request.method, route_label(request))
+    in_flight = IN_FLIGHT.labels(*labels)
+    in_flight.inc()
+    status = 500
+    started = time.perf_counter()
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as err:
+        status = err.status
+        raise
+    except asyncio.CancelledError:
+        status = CLIENT_CLOSED_REQUEST
+        raise
+    finally:
+        REQUEST_SECONDS.labels(*labels).observe(time.perf_counter() - started)
+        REQUESTS.labels(*labels).inc()
+        if status >= 400:
+            REQUEST_ERRORS.labels(*labels, str(status)).inc()
+        in_flight.dec()
+
+
+@web.middleware
+async def handler_metrics_middleware(request: web.BaseRequest, handler):
+    """Record the latency of the route handler alone."""
+    started = time.perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        HANDLER_SECONDS.labels(request.method, route_label(request)).observe(
+            time.perf_counter() - started
+        )
@@ -0,0 +1,40 @@
+"""Metrics admin routes."""
+
+from aiohttp import web
+from aiohttp_apispec import docs
+
+from ..common.metrics import REGISTRY
+from .middleware import handler_metrics_middleware, request_metrics_middleware
+
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@docs(tags=["server"], summary="Fetch metrics in Prometheus text format")
+async def metrics_handler(request: web.BaseRequest):
+    """
+    Request handler for exposing the collected metrics.
+
+    Args:
+        request: aiohttp request object
+    """
+
+    # metrics cover all tenants, subwallets may not read them
+    if request.headers.get("Authorization"):
+        raise web.HTTPForbidden()
+
+    return web.Response(
+        body=REGISTRY.expose().encode("utf-8"),
+        headers={"Content-Type": CONTENT_TYPE},
+    )
+
+
+async def register(app: web.Application):
+    """Register routes."""
+
+    # outermost, so the request latency covers authentication as well
+    app.middlewares.insert(0, request_metrics_middleware)
+    # innermost, so only the route handler itself is timed
+    app.middlewares.append(handler_metrics_middleware)
+
+    app.add_routes([web.get(METRICS_PATH, metrics_handler, allow_head=False)])
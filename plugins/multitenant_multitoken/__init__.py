@@ -10,7 +10,12 @@ from aries_cloudagent.core.event_bus import Event, EventBus, EventWithMetadata
 from aries_cloudagent.core.profile import Profile
 from aries_cloudagent.multitenant.base import BaseMultitenantManager
 
+from .invalidation import InvalidationChannel, invalidation_channel_from_settings
+from .migration import WalletClaimsMigration
 from .provider import TractionMultitenantManagerProvider
+from .sweeper import ClaimSweeper
+from .warmup import ProfileWarmup
+from .webhooks import RECORD_EVENT_PATTERN, BatchWebhookDispatcher
 
 LOGGER = logging.getLogger(__name__)
 
@@ -25,6 +30,7 @@ async def setup(context: InjectionContext):
 
 
     bus.subscribe(STARTUP_EVENT_PATTERN, on_startup)
+    bus.subscribe(SHUTDOWN_EVENT_PATTERN, on_shutdown)
 
 
 
@@ -38,3 +44,54 @@ async def on_startup(profile: Profile, event: Event):
     # replace it...
     srv = profile.context.inject(BaseAdminServer)
     srv.multitenant_manager = profile.context.inject(BaseMultitenantManager)
+
+    # stateless tokens are checked against revocation state held in memory
+    await srv.multitenant_manager.load_revocations()
+
+    # keep the caches of other replicas from serving revoked tokens
+    channel = invalidation_channel_from_settings(profile.settings)
+    if channel:
+        profile.context.injector.bind_instance(InvalidationChannel, channel)
+        await srv.multitenant_manager.subscribe_invalidations(channel)
+
+    # expire claims of tokens that are never presented again
+    sweeper = ClaimSweeper.from_settings(profile, srv.multitenant_manager)
+    profile.context.injector.bind_instance(ClaimSweeper, sweeper)
+    sweeper.start()
+
+    # open the profiles of recently active tenants without holding up startup
+    warmup = ProfileWarmup.from_settings(profile, srv.multitenant_manager)
+    profile.context.injector.bind_instance(ProfileWarmup, warmup)
+    warmup.start()
+
+    # send record events of all tenants as batches, when configured
+    dispatcher = BatchWebhookDispatcher.from_settings(profile.settings)
+    if dispatcher:
+        profile.context.injector.bind_instance(BatchWebhookDispatcher, dispatcher)
+        dispatcher.start()
+        profile.inject(EventBus).subscribe(
+            RECORD_EVENT_PATTERN, dispatcher.on_record_event
+        )
+
+
+async def on_shutdown(profile: Profile, event: Event):
+    LOGGER.info("> on_shutdown")
+    dispatcher = profile.inject_or(BatchWebhookDispatcher)
+    if dispatcher:
+        profile.inject(EventBus).unsubscribe(
+            RECORD_EVENT_PATTERN, dispatcher.on_record_event
+        )
+        await dispatcher.stop()
+    warmup = profile.inject_or(ProfileWarmup)
+    if warmup:
+        await warmup.stop()
+    migration = profile.inject_or(WalletClaimsMigration)
+    if migration:
+        await migration.stop()
+    sweeper = profile.inject_or(ClaimSweeper)
+    if sweeper:
+        await sweeper.stop()
+    channel = profile.inject_or(InvalidationChannel)
+    if channel:
+        await channel.stop()
+
@@ -0,0 +1,146 @@
+"""Per-wallet admission control for token authenticated requests."""
+
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from aiohttp import web
+
+from aries_cloudagent.config.settings import BaseSettings
+
+from ..common.metrics import REGISTRY
+
+LOGGER = logging.getLogger(__name__)
+
+# only tenants with requests waiting have a series, the counters are totals
+# across tenants so their series don't grow with the number of tenants
+QUEUE_DEPTH = REGISTRY.gauge(
+    "acapy_tenant_admission_queue_depth",
+    "Requests of a tenant waiting for admission",
+    ["wallet_id"],
+)
+REJECTIONS = REGISTRY.counter(
+    "acapy_tenant_admission_rejections_total",
+    "Requests rejected for exceeding the rate of their tenant",
+)
+QUEUED = REGISTRY.counter(
+    "acapy_tenant_admission_queued_total",
+    "Requests that waited for admission within the rate of their tenant",
+)
+
+
+class TenantThrottledError(web.HTTPTooManyRequests):
+    """Raised for a request of a tenant that is over its rate."""
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "waiting")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+        self.waiting = 0
+
+
+class WalletAdmission:
+    """Token bucket rate limiter with a bounded wait queue per wallet.
+
+    Each wallet may make `burst` requests at once and `rate` requests per
+    second on average. A request over the rate waits for its turn while
+    fewer than `max_queue` requests of the wallet are waiting, otherwise it
+    is rejected with 429. Waiting requests hold a reservation on the bucket,
+    so they are admitted in arrival order. Buckets are kept in least recently
+    used order and the least recently used is dropped to make room once
+    `MAX_TRACKED` wallets are tracked.
+    """
+
+    # the least recently used wallet has mostly refilled its bucket by the
+    # time it is dropped, so dropping it is close to forgetting a full bucket
+    MAX_TRACKED = 10_000
+
+    def __init__(self, rate: float, burst: int = None, max_queue: int = 10):
+        """Initialize WalletAdmission.
+
+        Args:
+            rate: Requests per second admitted per wallet
+            burst: Requests admitted at once per wallet, the rate if not given
+            max_queue: Requests per wallet that may wait for admission
+        """
+        self.rate = rate
+        self.burst = max(burst or math.ceil(rate), 1)
+        self.max_queue = max(max_queue, 0)
+        self._buckets: "OrderedDict[str, _Bucket]" = OrderedDict()
+
+    @classmethod
+    def from_settings(cls, settings: BaseSettings) -> Optional["WalletAdmission"]:
+        """Create the admission control configured in settings, if enabled."""
+        rate = float(settings.get("multitenant.admission_rate") or 0)
+        if rate <= 0:
+            return None
+        max_queue = settings.get_int("multitenant.admission_max_queue")
+        return cls(
+            rate,
+            settings.get_int("multitenant.admission_burst"),
+            10 if max_queue is None else max_queue,
+        )
+
+    def __len__(self) -> int:
+        """Return the number of wallets tracked."""
+        return len(self._buckets)
+
+    def _refill(self, bucket: _Bucket, now: float):
+        bucket.tokens = min(
+            self.burst, bucket.tokens + (now - bucket.updated) * self.rate
+        )
+        bucket.updated = now
+
+    async def admit(self, wallet_id: str):
+        """Admit a request of a wallet, waiting for its turn if needed.
+
+        Raises:
+            TenantThrottledError: If the wallet has too many requests waiting
+
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(wallet_id)
+        if bucket is None:
+            while len(self._buckets) >= self.MAX_TRACKED:
+                # requests still waiting keep their own reference to it
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[wallet_id] = _Bucket(self.burst, now)
+        else:
+            self._buckets.move_to_end(wallet_id)
+            self._refill(bucket, now)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return
+
+        if bucket.waiting >= self.max_queue:
+            REJECTIONS.labels().inc()
+            LOGGER.debug("Rejected request of wallet %s over its rate", wallet_id)
+            retry_after = math.ceil((1 - bucket.tokens) / self.rate)
+            raise TenantThrottledError(
+                headers={"Retry-After": str(retry_after)},
+                reason="Too many requests for this wallet",
+            )
+
+        # reserve the next token, the bucket goes negative while requests wait
+        bucket.tokens -= 1
+        bucket.waiting += 1
+        QUEUED.labels().inc()
+        QUEUE_DEPTH.labels(wallet_id).set(bucket.waiting)
+        try:
+            await asyncio.sleep(-bucket.tokens / self.rate)
+        except asyncio.CancelledError:
+            bucket.tokens += 1
+            raise
+        finally:
+            bucket.waiting -= 1
+            if bucket.waiting:
+                QUEUE_DEPTH.labels(wallet_id).set(bucket.waiting)
+            else:
+                QUEUE_DEPTH.remove(wallet_id)
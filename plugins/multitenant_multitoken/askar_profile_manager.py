@@ -0,0 +1,29 @@
+"""Multitoken manager for askar profile multitenancy mode."""
+
+from aries_cloudagent.askar.profile import AskarProfile
+from aries_cloudagent.core.profile import Profile
+from aries_cloudagent.multitenant.askar_profile_manager import (
+    AskarProfileMultitenantManager,
+)
+
+from .manager import MultitokenManagerMixin
+
+
+class TractionAskarProfileMultitenantManager(
+    MultitokenManagerMixin, AskarProfileMultitenantManager
+):
+    """Askar profile multitenant manager with multiple tokens per wallet.
+
+    All tenants share one askar store, each in a profile of its own. Token
+    claims are kept in the base wallet exactly as in basic mode, so claim
+    validation, revocation and expiry behave the same in both modes.
+    """
+
+    def __init__(self, profile: Profile, multitenant_profile: AskarProfile = None):
+        """Initialize askar profile multitoken multitenant manager.
+
+        Args:
+            profile: The base profile for this manager
+            multitenant_profile: The shared store holding the tenant profiles
+        """
+        super().__init__(profile, multitenant_profile)
@@ -0,0 +1,443 @@
+"""Caches for the multitoken multitenant manager."""
+
+import asyncio
+import logging
+import time
+import weakref
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterator, NamedTuple, Optional, Set
+
+from aries_cloudagent.core.profile import Profile
+from aries_cloudagent.wallet.models.wallet_record import WalletRecord
+
+from .projection import WalletAuthView
+
+LOGGER = logging.getLogger(__name__)
+
+
+class VerifiedToken(NamedTuple):
+    """Result of a successful token verification."""
+
+    wallet_id: str
+    iat: int
+    exp: int
+    wallet: WalletAuthView
+    extra_settings: dict
+    jti: Optional[str] = None
+
+    @property
+    def wallet_record(self) -> WalletRecord:
+        """Accessor for the full wallet record, built on first access."""
+        return self.wallet.record
+
+
+class TokenCache:
+    """Verified token cache that caches based on LRU strategy.
+
+    Entries are held until the expiry of the token they were created for, and
+    can be dropped for a whole wallet whenever its claims change.
+    """
+
+    def __init__(self, capacity: int):
+        """Initialize TokenCache.
+
+        Args:
+            capacity: The capacity of the cache. If capacity is exceeded
+                      least recently used tokens are evicted.
+        """
+
+        LOGGER.debug(f"Token cache initialized with capacity {capacity}")
+
+        self._cache: "OrderedDict[str, VerifiedToken]" = OrderedDict()
+        self._wallet_tokens: Dict[str, Set[str]] = {}
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        """Return the number of cached tokens."""
+        return len(self._cache)
+
+    @property
+    def stats(self) -> dict:
+        """Accessor for the cache counters."""
+        return {
+            "size": len(self._cache),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _discard(self, token: str) -> Optional[VerifiedToken]:
+        """Drop a token from the cache and from its wallet index."""
+        entry = self._cache.pop(token, None)
+        if entry:
+            tokens = self._wallet_tokens.get(entry.wallet_id)
+            if tokens:
+                tokens.discard(token)
+                if not tokens:
+                    del self._wallet_tokens[entry.wallet_id]
+        return entry
+
+    def _cleanup(self):
+        """Prune cache until size matches defined capacity."""
+        while len(self._cache) > self.capacity:
+            token = next(iter(self._cache))
+            self._discard(token)
+
+    def get(self, token: str) -> Optional[VerifiedToken]:
+        """Get the verification result for a token.
+
+        Args:
+            token: The encoded token
+
+        Returns:
+            Optional[VerifiedToken]: Result if cached and not yet expired
+
+        """
+        entry = self._cache.get(token)
+        if entry and entry.exp <= time.time():
+            self._discard(token)
+            entry = None
+
+        if entry:
+            self._cache.move_to_end(token)
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return entry
+
+    def put(self, token: str, entry: VerifiedToken):
+        """Add the verification result for a token to the cache.
+
+        Args:
+            token: The encoded token
+            entry: The verification result
+        """
+        if self.capacity <= 0 or entry.exp <= time.time():
+            return
+
+        self._cache[token] = entry
+        self._cache.move_to_end(token)
+        self._wallet_tokens.setdefault(entry.wallet_id, set()).add(token)
+        self._cleanup()
+
+    def invalidate_wallet(self, wallet_id: str):
+        """Drop all cached tokens for a wallet.
+
+        Args:
+            wallet_id: The wallet whose tokens should be dropped
+        """
+        for token in self._wallet_tokens.pop(wallet_id, ()):
+            self._cache.pop(token, None)
+
+    def clear(self):
+        """Drop all cached tokens."""
+        self._cache.clear()
+        self._wallet_tokens.clear()
+
+
+class WalletRecordCache:
+    """LRU cache of the wallet record views read to verify stateless tokens.
+
+    Entries must be dropped whenever the wallet record is updated or removed.
+    """
+
+    def __init__(self, capacity: int):
+        """Initialize WalletRecordCache.
+
+        Args:
+            capacity: The maximum number of cached records
+        """
+        self._cache: "OrderedDict[str, WalletAuthView]" = OrderedDict()
+        self.capacity = capacity
+
+    def __len__(self) -> int:
+        """Return the number of cached records."""
+        return len(self._cache)
+
+    def get(self, wallet_id: str) -> Optional[WalletAuthView]:
+        """Get a cached wallet record view."""
+        record = self._cache.get(wallet_id)
+        if record is not None:
+            self._cache.move_to_end(wallet_id)
+        return record
+
+    def put(self, record: WalletAuthView):
+        """Add a record view, evicting the least recently used over capacity."""
+        if self.capacity <= 0:
+            return
+        self._cache[record.wallet_id] = record
+        self._cache.move_to_end(record.wallet_id)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, wallet_id: str):
+        """Drop the cached record of a wallet."""
+        self._cache.pop(wallet_id, None)
+
+    def clear(self):
+        """Drop all cached records."""
+        self._cache.clear()
+
+
+class _CachedProfile:
+    __slots__ = ("profile", "last_used")
+
+    def __init__(self, profile: Profile, last_used: float):
+        self.profile = profile
+        self.last_used = last_used
+
+
+class WalletProfileCache:
+    """Open wallet profile cache with LRU and idle-timeout eviction.
+
+    Unlike the stock ProfileCache, evicted profiles are closed, but only once
+    nothing references them: eviction drops the reference of the cache, and
+    requests still using the profile keep it open. A request for the wallet
+    in the meantime gets the same profile back rather than opening the store
+    a second time. Concurrent requests for a wallet that is not open yet
+    share a single open.
+    """
+
+    def __init__(self, capacity: int, idle_timeout: float = None):
+        """Initialize WalletProfileCache.
+
+        Args:
+            capacity: The maximum number of profiles held open by the cache
+            idle_timeout: Seconds after which the cache stops holding open a
+                profile it hasn't handed out, never if not set
+        """
+
+        LOGGER.debug(
+            f"Wallet profile cache initialized with capacity {capacity}"
+            f" and idle timeout {idle_timeout}"
+        )
+
+        self._cache: "OrderedDict[str, _CachedProfile]" = OrderedDict()
+        self._opening: Dict[str, asyncio.Future] = {}
+        # evicted profiles that may still be in use, by wallet id; each is
+        # closed by its finalizer once nothing references it
+        self._retired: Dict[str, weakref.finalize] = {}
+        self.capacity = max(capacity, 1)
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.rescues = 0
+        self.lru_evictions = 0
+        self.idle_evictions = 0
+        self.closed = 0
+        self.open_count = 0
+        self.open_seconds_total = 0.0
+        self.open_seconds_max = 0.0
+
+    def __len__(self) -> int:
+        """Return the number of profiles held open by the cache."""
+        return len(self._cache)
+
+    @property
+    def stats(self) -> dict:
+        """Accessor for the cache counters."""
+        return {
+            "size": len(self._cache),
+            "capacity": self.capacity,
+            "retired": len(self._retired),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "rescues": self.rescues,
+            "lru_evictions": self.lru_evictions,
+            "idle_evictions": self.idle_evictions,
+            "closed": self.closed,
+            "open_count": self.open_count,
+            "open_seconds_total": self.open_seconds_total,
+            "open_seconds_max": self.open_seconds_max,
+        }
+
+    def profiles(self) -> Iterator[Profile]:
+        """Iterate over the open profiles, evicted ones still in use included."""
+        profiles = [entry.profile for entry in self._cache.values()]
+        for finalizer in list(self._retired.values()):
+            found = finalizer.peek()
+            if found:
+                profiles.append(found[0])
+        return iter(profiles)
+
+    def get(self, wallet_id: str) -> Optional[Profile]:
+        """Get an open profile, marking it as recently used.
+
+        An evicted profile that is still in use is taken back into the cache.
+
+        Args:
+            wallet_id: The wallet to get the profile for
+
+        Returns:
+            Optional[Profile]: The profile if it is open
+
+        """
+        entry = self._cache.get(wallet_id)
+        if entry is None:
+            profile = self._rescue(wallet_id)
+            if profile is None:
+                return None
+            LOGGER.debug(f"Rescuing evicted profile for wallet {wallet_id}")
+            self._insert(wallet_id, profile)
+            return profile
+        entry.last_used = time.monotonic()
+        self._cache.move_to_end(wallet_id)
+        return entry.profile
+
+    async def get_or_open(
+        self, wallet_id: str, opener: Callable[[], Awaitable[Profile]]
+    ) -> Profile:
+        """Get an open profile, opening it if needed.
+
+        Args:
+            wallet_id: The wallet to get the profile for
+            opener: Coroutine function opening the profile on a miss
+
+        Returns:
+            Profile: The open profile
+
+        """
+        self._evict_idle()
+
+        profile = self.get(wallet_id)
+        if profile:
+            self.hits += 1
+            return profile
+
+        opening = self._opening.get(wallet_id)
+        if opening:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # open in a task of its own so a cancelled caller can't fail the
+            # other callers waiting on the same open
+            opening = asyncio.ensure_future(self._open(wallet_id, opener))
+            self._opening[wallet_id] = opening
+        return await asyncio.shield(opening)
+
+    async def _open(
+        self, wallet_id: str, opener: Callable[[], Awaitable[Profile]]
+    ) -> Profile:
+        started = time.perf_counter()
+        try:
+            profile = await opener()
+        finally:
+            del self._opening[wallet_id]
+
+        elapsed = time.perf_counter() - started
+        self.open_count += 1
+        self.open_seconds_total += elapsed
+        self.open_seconds_max = max(self.open_seconds_max, elapsed)
+
+        await self.put(wallet_id, profile)
+        return profile
+
+    async def put(self, wallet_id: str, profile: Profile):
+        """Add an open profile, evicting least recently used ones over capacity.
+
+        Args:
+            wallet_id: The wallet the profile belongs to
+            profile: The open profile
+        """
+        self._insert(wallet_id, profile)
+
+    def _insert(self, wallet_id: str, profile: Profile):
+        self._cache[wallet_id] = _CachedProfile(profile, time.monotonic())
+        self._cache.move_to_end(wallet_id)
+        while len(self._cache) > self.capacity:
+            evicted_id, entry = self._cache.popitem(last=False)
+            self.lru_evictions += 1
+            self._retire(evicted_id, entry.profile)
+
+    def remove(self, wallet_id: str) -> Optional[Profile]:
+        """Remove a profile without closing it.
+
+        Args:
+            wallet_id: The wallet to remove the profile for
+
+        Returns:
+            Optional[Profile]: The removed profile, if it was open
+
+        """
+        entry = self._cache.pop(wallet_id, None)
+        if entry is None:
+            return self._rescue(wallet_id)
+        self._retired.pop(wallet_id, None)
+        return entry.profile
+
+    def discard(self, wallet_id: str):
+        """Drop the profile of a wallet, closing it once nothing references it.
+
+        Unlike an evicted profile it is never handed out again, the next
+        request for the wallet opens it anew.
+
+        Args:
+            wallet_id: The wallet to drop the profile for
+        """
+        entry = self._cache.pop(wallet_id, None)
+        # the finalizer of a retired profile stays registered, it is still
+        # closed once unreferenced
+        self._retired.pop(wallet_id, None)
+        if entry is not None:
+            self._retire(wallet_id, entry.profile, rescuable=False)
+
+    def _retire(self, wallet_id: str, profile: Profile, rescuable: bool = True):
+        # the store is all a closed profile releases, and the finalizer must
+        # not reference the profile itself
+        finalizer = weakref.finalize(
+            profile,
+            self._close_unreferenced,
+            wallet_id,
+            getattr(profile, "opened", None),
+        )
+        finalizer.atexit = False
+        if rescuable:
+            self._retired[wallet_id] = finalizer
+
+    def _rescue(self, wallet_id: str) -> Optional[Profile]:
+        finalizer = self._retired.pop(wallet_id, None)
+        found = finalizer.detach() if finalizer is not None else None
+        if not found:
+            return None
+        self.rescues += 1
+        return found[0]
+
+    def _evict_idle(self):
+        if not self.idle_timeout:
+            return
+        cutoff = time.monotonic() - self.idle_timeout
+        # entries are in order of use, so idle profiles are always at the front
+        while self._cache:
+            wallet_id, entry = next(iter(self._cache.items()))
+            if entry.last_used > cutoff:
+                break
+            del self._cache[wallet_id]
+            self.idle_evictions += 1
+            # a request may still be using it, so it is only retired
+            self._retire(wallet_id, entry.profile)
+
+    def _close_unreferenced(self, wallet_id: str, opened):
+        finalizer = self._retired.get(wallet_id)
+        if finalizer is not None and not finalizer.alive:
+            del self._retired[wallet_id]
+        self.closed += 1
+        if opened is None:
+            return
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            return
+        if not loop.is_closed():
+            asyncio.ensure_future(self._close(wallet_id, opened), loop=loop)
+
+    async def _close(self, wallet_id: str, opened):
+        LOGGER.debug(f"Closing unreferenced profile for wallet {wallet_id}")
+        try:
+            await opened.close()
+        except Exception:
+            LOGGER.exception(f"Error closing evicted profile for wallet {wallet_id}")
@@ -0,0 +1,203 @@
+"""Token claim bookkeeping for multitoken wallets."""
+
+from bisect import bisect_left, insort
+from typing import Iterable, Iterator, List
+
+from marshmallow import fields
+from marshmallow.utils import EXCLUDE
+
+from aries_cloudagent.messaging.models.base_record import BaseRecord, BaseRecordSchema
+from aries_cloudagent.messaging.valid import UUIDFour
+
+
+class IssuedAtClaims:
+    """Sorted, duplicate free collection of token issued-at claims.
+
+    Claims are kept in ascending order so membership checks are a binary
+    search and expired or surplus claims are always a prefix of the list.
+    """
+
+    __slots__ = ("_iats",)
+
+    def __init__(self, iats: Iterable[int] = None):
+        """Initialize IssuedAtClaims.
+
+        Args:
+            iats: Initial issued-at claims, in any order
+        """
+        self._iats: List[int] = sorted(set(iats or ()))
+
+    def __contains__(self, iat: int) -> bool:
+        """Check whether a claim is present."""
+        idx = bisect_left(self._iats, iat)
+        return idx < len(self._iats) and self._iats[idx] == iat
+
+    def __iter__(self) -> Iterator[int]:
+        """Iterate over the claims, oldest first."""
+        return iter(self._iats)
+
+    def __len__(self) -> int:
+        """Return the number of claims."""
+        return len(self._iats)
+
+    def __repr__(self) -> str:
+        """Return a human readable representation."""
+        return f"<IssuedAtClaims count={len(self._iats)}>"
+
+    def add(self, iat: int) -> bool:
+        """Add a claim.
+
+        Args:
+            iat: The issued-at claim to add
+
+        Returns:
+            bool: Whether the claim was not present before
+
+        """
+        if iat in self:
+            return False
+        insort(self._iats, iat)
+        return True
+
+    def remove(self, iat: int) -> bool:
+        """Remove a claim.
+
+        Args:
+            iat: The issued-at claim to remove
+
+        Returns:
+            bool: Whether the claim was present
+
+        """
+        idx = bisect_left(self._iats, iat)
+        if idx < len(self._iats) and self._iats[idx] == iat:
+            del self._iats[idx]
+            return True
+        return False
+
+    def prune(self, expired_before: int) -> int:
+        """Remove all claims issued before a cutoff.
+
+        Args:
+            expired_before: Claims with an iat before this are expired
+
+        Returns:
+            int: The number of claims removed
+
+        """
+        idx = bisect_left(self._iats, expired_before)
+        del self._iats[:idx]
+        return idx
+
+    def trim(self, max_claims: int) -> int:
+        """Remove the oldest claims until at most max_claims remain.
+
+        Args:
+            max_claims: The maximum number of claims to keep
+
+        Returns:
+            int: The number of claims removed
+
+        """
+        surplus = len(self._iats) - max(max_claims, 0)
+        if surplus <= 0:
+            return 0
+        del self._iats[:surplus]
+        return surplus
+
+    def serialize(self) -> List[int]:
+        """Return the claims as a plain list for storage."""
+        return list(self._iats)
+
+
+class TokenClaimRecord(BaseRecord):
+    """Represents the claim of a single live token.
+
+    The record id is derived from the wallet id, iat and the jti of the token,
+    so validating a token is a single keyed lookup and tokens issued in the
+    same second are told apart. Claims of legacy tokens, which have no jti,
+    are keyed by wallet id and iat alone. The iat and exp tags are
+    unencrypted so expired claims can be found with range queries.
+    """
+
+    class Meta:
+        """TokenClaimRecord metadata."""
+
+        schema_class = "TokenClaimRecordSchema"
+
+    RECORD_TYPE = "token_claim"
+    RECORD_ID_NAME = "claim_id"
+
+    TAG_NAMES = {"wallet_id", "jti", "~iat", "~exp"}
+
+    def __init__(
+        self,
+        *,
+        claim_id: str = None,
+        wallet_id: str = None,
+        iat: int = None,
+        exp: int = None,
+        jti: str = None,
+        **kwargs,
+    ):
+        """Initialize a new TokenClaimRecord."""
+        if not claim_id and wallet_id and iat is not None:
+            claim_id = self.claim_id_for(wallet_id, iat, jti)
+            kwargs.setdefault("new_with_id", True)
+        super().__init__(claim_id, **kwargs)
+        self.wallet_id = wallet_id
+        self.iat = int(iat) if iat is not None else None
+        self.exp = int(exp) if exp is not None else None
+        self.jti = jti
+
+    @staticmethod
+    def claim_id_for(wallet_id: str, iat: int, jti: str = None) -> str:
+        """Get the record id of the claim for a token issued at iat."""
+        if jti:
+            return f"{wallet_id}.{iat}.{jti}"
+        return f"{wallet_id}.{iat}"
+
+    @property
+    def claim_id(self) -> str:
+        """Accessor for the ID associated with this record."""
+        return self._id
+
+    @property
+    def record_tags(self) -> dict:
+        """Accessor for the record tags generated for this record."""
+        tags = {
+            "wallet_id": self.wallet_id,
+            "~iat": str(self.iat),
+            "~exp": str(self.exp),
+        }
+        if self.jti:
+            tags["jti"] = self.jti
+        return tags
+
+
+class TokenClaimRecordSchema(BaseRecordSchema):
+    """Schema to allow serialization/deserialization of token claim records."""
+
+    class Meta:
+        """TokenClaimRecordSchema metadata."""
+
+        model_class = TokenClaimRecord
+        unknown = EXCLUDE
+
+    claim_id = fields.Str(
+        required=True,
+        description="Token claim record ID",
+        example=f"{UUIDFour.EXAMPLE}.1640995200",
+    )
+    wallet_id = fields.Str(
+        required=True,
+        description="Wallet the token was issued for",
+        example=UUIDFour.EXAMPLE,
+    )
+    iat = fields.Int(required=True, description="Issued at timestamp")
+    exp = fields.Int(required=True, description="Expiry timestamp")
+    jti = fields.Str(
+        required=False,
+        description="Token identifier, not set for legacy tokens",
+        example="3fa85f6457174562b3fc2c963f66afa6",
+    )
@@ -0,0 +1,277 @@
+"""Cache invalidation shared between agent replicas."""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+from uuid import uuid4
+
+from aries_cloudagent.config.settings import BaseSettings
+from aries_cloudagent.utils.classloader import ClassLoader
+
+LOGGER = logging.getLogger(__name__)
+
+# the tokens of a wallet changed: claims stored, dropped or revoked
+SCOPE_TOKENS = "tokens"
+# the wallet record itself was updated or removed
+SCOPE_WALLET = "wallet"
+
+
+class Invalidation(NamedTuple):
+    """Cached state of a wallet that another replica changed."""
+
+    wallet_id: str
+    scope: str
+    origin: str
+
+
+InvalidationHandler = Callable[[Invalidation], Awaitable[None]]
+
+
+class InvalidationChannel(ABC):
+    """Broadcast of wallet scoped cache invalidations between replicas.
+
+    Every replica publishes the invalidations it causes and handles the ones
+    published by the others, never its own.
+    """
+
+    def __init__(self):
+        """Initialize InvalidationChannel."""
+        self.origin = uuid4().hex
+        self._handler: Optional[InvalidationHandler] = None
+
+    async def start(self, handler: InvalidationHandler):
+        """Start delivering the invalidations of other replicas to a handler."""
+        self._handler = handler
+
+    async def stop(self):
+        """Stop delivering invalidations."""
+        self._handler = None
+
+    @abstractmethod
+    async def publish(self, wallet_id: str, scope: str):
+        """Tell the other replicas that cached state of a wallet changed.
+
+        Args:
+            wallet_id: The wallet whose state changed
+            scope: What changed, SCOPE_TOKENS or SCOPE_WALLET
+        """
+
+    async def _deliver(self, invalidation: Invalidation):
+        handler = self._handler
+        if not handler or invalidation.origin == self.origin:
+            return
+        try:
+            await handler(invalidation)
+        except Exception:
+            LOGGER.exception(
+                "Error handling invalidation of wallet %s", invalidation.wallet_id
+            )
+
+
+class InProcessInvalidationChannel(InvalidationChannel):
+    """Invalidation channel between managers running in the same process.
+
+    Channels created with the same name reach each other, which is what tests
+    and single process deployments with several managers need.
+    """
+
+    _hubs: Dict[str, List["InProcessInvalidationChannel"]] = {}
+
+    def __init__(self, name: str = "default"):
+        """Initialize InProcessInvalidationChannel.
+
+        Args:
+            name: The name of the hub shared by the channels
+        """
+        super().__init__()
+        self.name = name
+
+    async def start(self, handler: InvalidationHandler):
+        """Start delivering the invalidations of other replicas to a handler."""
+        await super().start(handler)
+        members = self._hubs.setdefault(self.name, [])
+        if self not in members:
+            members.append(self)
+
+    async def stop(self):
+        """Stop delivering invalidations."""
+        members = self._hubs.get(self.name, [])
+        if self in members:
+            members.remove(self)
+        await super().stop()
+
+    async def publish(self, wallet_id: str, scope: str):
+        """Deliver an invalidation to the other channels of the hub."""
+        invalidation = Invalidation(wallet_id, scope, self.origin)
+        for member in list(self._hubs.get(self.name, ())):
+            await member._deliver(invalidation)
+
+
+class SQLiteInvalidationChannel(InvalidationChannel):
+    """Invalidation channel over a SQLite file shared by local replicas.
+
+    Invalidations are appended to a table that every replica polls, so they
+    arrive within `poll_interval`. Rows are kept for `retention` seconds.
+    SQLite calls run off the event loop on a single worker thread, which
+    owns the one connection of the channel.
+    """
+
+    def __init__(
+        self, path: str, *, poll_interval: float = 0.5, retention: float = 300
+    ):
+        """Initialize SQLiteInvalidationChannel.
+
+        Args:
+            path: The SQLite database file
+            poll_interval: Seconds between checks for new invalidations
+            retention: Seconds invalidations are kept in the file
+        """
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._last_seq = 0
+        self._task: Optional[asyncio.Task] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # only ever called on the single worker thread of the executor
+        if not self._conn:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS invalidations ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, "
+                "wallet_id TEXT NOT NULL, scope TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    async def _run_sync(self, func, *args):
+        if not self._executor:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="invalidation"
+            )
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    def _close_sync(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _last_seq_sync(self) -> int:
+        conn = self._connection()
+        return conn.execute("SELECT MAX(seq) FROM invalidations").fetchone()[0] or 0
+
+    def _insert_sync(self, wallet_id: str, scope: str):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO invalidations (origin, wallet_id, scope, created) "
+                "VALUES (?, ?, ?, ?)",
+                (self.origin, wallet_id, scope, time.time()),
+            )
+
+    def _fetch_sync(self, after: int, prune: bool) -> list:
+        conn = self._connection()
+        if prune:
+            with conn:
+                conn.execute(
+                    "DELETE FROM invalidations WHERE created < ?",
+                    (time.time() - self.retention,),
+                )
+        return conn.execute(
+            "SELECT seq, wallet_id, scope, origin FROM invalidations "
+            "WHERE seq > ? ORDER BY seq",
+            (after,),
+        ).fetchall()
+
+    async def start(self, handler: InvalidationHandler):
+        """Start polling for the invalidations of other replicas."""
+        await super().start(handler)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # only what is published from now on is of interest, reading it opens
+        # the connection and creates the table once for the channel's lifetime
+        self._last_seq = await self._run_sync(self._last_seq_sync)
+        if not self._task:
+            self._task = asyncio.ensure_future(self._poll())
+
+    async def stop(self):
+        """Stop polling and close the connection."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor:
+            await self._run_sync(self._close_sync)
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        await super().stop()
+
+    async def publish(self, wallet_id: str, scope: str):
+        """Append an invalidation for the other replicas to pick up."""
+        await self._run_sync(self._insert_sync, wallet_id, scope)
+
+    async def poll(self, prune: bool = False) -> int:
+        """Deliver the invalidations published since the last poll.
+
+        Returns:
+            int: The number of invalidations read
+
+        """
+        rows = await self._run_sync(self._fetch_sync, self._last_seq, prune)
+        for seq, wallet_id, scope, origin in rows:
+            self._last_seq = seq
+            await self._deliver(Invalidation(wallet_id, scope, origin))
+        return len(rows)
+
+    async def _poll(self):
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            prune = time.monotonic() - last_prune > self.retention
+            try:
+                await self.poll(prune)
+            except Exception:
+                LOGGER.exception("Polling for invalidations failed")
+                continue
+            if prune:
+                last_prune = time.monotonic()
+
+
+def invalidation_channel_from_settings(
+    settings: BaseSettings,
+) -> Optional[InvalidationChannel]:
+    """Create the invalidation channel configured in settings, if any.
+
+    `multitenant.invalidation` is "in_process", "sqlite" or the class path of
+    a channel taking no arguments. The SQLite file is given by
+    `multitenant.invalidation_path`.
+    """
+    channel_type = settings.get("multitenant.invalidation")
+    if not channel_type:
+        return None
+    if channel_type == "in_process":
+        return InProcessInvalidationChannel()
+    if channel_type == "sqlite":
+        path = settings.get("multitenant.invalidation_path")
+        if not path:
+            raise ValueError("multitenant.invalidation_path is required for sqlite")
+        poll_interval = settings.get("multitenant.invalidation_poll_interval")
+        return SQLiteInvalidationChannel(
+            path, poll_interval=float(poll_interval or 0.5)
+        )
+    return ClassLoader.load_class(channel_type)()
@@ -0,0 +1,64 @@
+"""Per-wallet lock striping."""
+
+import asyncio
+from typing import Iterable, List
+
+
+class StripedLock:
+    """Fixed pool of asyncio locks shared between keys by hash.
+
+    Operations on the same key are serialized while operations on different
+    keys only contend when they happen to share a stripe.
+    """
+
+    def __init__(self, stripes: int = 64):
+        """Initialize StripedLock.
+
+        Args:
+            stripes: The number of locks in the pool
+        """
+        self._locks = [asyncio.Lock() for _ in range(max(stripes, 1))]
+
+    def _index(self, key: str) -> int:
+        return hash(key) % len(self._locks)
+
+    def get(self, key: str) -> asyncio.Lock:
+        """Get the lock guarding a key."""
+        return self._locks[self._index(key)]
+
+    def many(self, keys: Iterable[str]) -> "MultiLock":
+        """Get a context manager holding the locks of several keys at once."""
+        indexes = sorted({self._index(key) for key in keys})
+        return MultiLock([self._locks[idx] for idx in indexes])
+
+
+class MultiLock:
+    """Acquire a set of locks in a stable order."""
+
+    def __init__(self, locks: List[asyncio.Lock]):
+        """Initialize MultiLock.
+
+        Args:
+            locks: The locks to hold, already in acquisition order
+        """
+        self._locks = locks
+        self._held: List[asyncio.Lock] = []
+
+    async def __aenter__(self):
+        """Acquire all locks."""
+        try:
+            for lock in self._locks:
+                await lock.acquire()
+                self._held.append(lock)
+        except BaseException:
+            self._release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """Release all locks."""
+        self._release()
+
+    def _release(self):
+        while self._held:
+            self._held.pop().release()
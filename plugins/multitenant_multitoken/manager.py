@@ -1,4 +1,6 @@
+import asyncio
 import logging
+import time
 import jwt
 
 
@@ -11,7 +13,20 @@ from aries_cloudagent.multitenant.manager import MultitenantManager
 from datetime import datetime, timedelta, timezone
 
 
-from typing import List, Optional, cast
+from collections import OrderedDict
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
+from uuid import uuid4
 
 from aries_cloudagent.core.profile import (
     Profile,
@@ -26,16 +41,72 @@ from aries_cloudagent.protocols.routing.v1_0.manager import RouteNotFoundError,
 from aries_cloudagent.protocols.routing.v1_0.models.route_record import RouteRecord
 from aries_cloudagent.transport.wire_format import BaseWireFormat
 from aries_cloudagent.storage.base import BaseStorage
-from aries_cloudagent.storage.error import StorageNotFoundError
+from aries_cloudagent.storage.record import StorageRecord
+from aries_cloudagent.storage.error import StorageDuplicateError, StorageNotFoundError
 from aries_cloudagent.protocols.coordinate_mediation.v1_0.manager import (
     MediationManager,
     MediationRecord,
 )
+from marshmallow import fields
 from marshmallow.utils import EXCLUDE
 from aries_cloudagent.multitenant.error import WalletKeyMissingError
 
+from ..common.metrics import REGISTRY
+from .admission import WalletAdmission
+from .invalidation import (
+    SCOPE_TOKENS,
+    SCOPE_WALLET,
+    Invalidation,
+    InvalidationChannel,
+)
+from .cache import TokenCache, VerifiedToken, WalletProfileCache, WalletRecordCache
+from .claims import IssuedAtClaims, TokenClaimRecord
+from .locks import StripedLock
+from .projection import WalletAuthView
+from .revocation import RevocationChanges, TokenRevocations
+from .tracing import NULL_TRACE, Trace, Tracer
+
 LOGGER = logging.getLogger(__name__)
 
+TOKEN_TTL = timedelta(minutes=1)
+
+TOKEN_AUTH_SECONDS = REGISTRY.histogram(
+    "acapy_token_auth_seconds",
+    "Time spent resolving the wallet profile of a bearer token",
+    ["outcome"],
+)
+
+# number of wallets whose claims are written per transaction by bulk operations
+BULK_BATCH_SIZE = 100
+# bulk operations lock a whole batch of wallets, with stripes well above the
+# batch size such a batch holds only a few percent of them
+DEFAULT_WALLET_LOCK_STRIPES = 4096
+
+
+class TokenRequest(NamedTuple):
+    """Request for tokens for a single wallet."""
+
+    wallet_id: str
+    wallet_key: Optional[str] = None
+    count: int = 1
+
+
+class TokenResult(NamedTuple):
+    """Tokens created for a single wallet, or the reason they were not."""
+
+    wallet_id: str
+    iat: int
+    tokens: Sequence[str] = ()
+    error: Optional[BaseError] = None
+    jtis: Sequence[str] = ()
+
+
+class TokenSelection(NamedTuple):
+    """Tokens of a single wallet, by issued-at claim or token identifier."""
+
+    iats: Sequence[int] = ()
+    jtis: Sequence[str] = ()
+
 
 class TokensWalletRecord(WalletRecord):
     class Meta:
@@ -53,19 +124,32 @@ class TokensWalletRecord(WalletRecord):
         # a constructor param
         wallet_name: str = None,
         jwt_iat: Optional[int] = None,
-        issued_at_claims: Optional[List] = [],
+        issued_at_claims: Optional[Sequence[int]] = None,
         **kwargs,
     ):
         """Initialize a new WalletRecord."""
         super().__init__(wallet_id=wallet_id, key_management_mode=key_management_mode, settings=settings, wallet_name=wallet_name, jwt_iat=jwt_iat, **kwargs)
-        self._issued_at_claims = issued_at_claims
+        self._issued_at_claims = IssuedAtClaims(issued_at_claims)
     
     @property
-    def issued_at_claims(self):
+    def issued_at_claims(self) -> IssuedAtClaims:
         return self._issued_at_claims
 
-    def add_issued_at_claims(self, iat):
-        self._issued_at_claims.append(iat)
+    def pop_issued_at_claims(self) -> IssuedAtClaims:
+        """Detach the legacy claims stored inline on this record."""
+        claims = self._issued_at_claims
+        self._issued_at_claims = IssuedAtClaims()
+        return claims
+
+    @property
+    def record_value(self) -> dict:
+        """Accessor for the JSON record value generated for this record."""
+        value = super().record_value
+        # only written while legacy claims remain, a stock WalletRecord
+        # can't be loaded from a value holding unknown fields
+        if self._issued_at_claims:
+            value["issued_at_claims"] = self._issued_at_claims.serialize()
+        return value
 
 
 class TokensWalletRecordSchema(WalletRecordSchema):
@@ -77,75 +161,570 @@ class TokensWalletRecordSchema(WalletRecordSchema):
         model_class = TokensWalletRecord
         unknown = EXCLUDE
 
+    issued_at_claims = fields.List(
+        fields.Int(description="Issued at timestamp"),
+        required=False,
+        description="Legacy issued at claims not yet moved to token claim records",
+    )
 
-class TractionMultitenantManager(MultitenantManager):
 
-    def __init__(self, profile: Profile):
-        super().__init__(profile)
+class MultitokenManagerMixin:
+    """Multiple concurrent tokens per wallet for a multitenant manager.
 
-    async def get_wallet_profile(
-        self,
-        base_context: InjectionContext,
-        wallet_record: WalletRecord,
-        extra_settings: dict = {},
-        *,
-        provision=False,
-    ) -> Profile:
-        LOGGER.info('> get_wallet_profile!!!')
-        return await super().get_wallet_profile(base_context=base_context, wallet_record=wallet_record, extra_settings=extra_settings, provision=provision)
- 
+    Every token issued for a wallet is backed by its own claim record, so a
+    wallet can hold many valid tokens at once and each one can be revoked or
+    expire on its own.
 
-    async def remove_wallet_profile(self, profile: Profile):
-        LOGGER.info('> remove_wallet_profile!!!')
-        return super().remove_wallet_profile(profile)
+    With `multitenant.stateless_tokens` no claims are stored. Tokens carry the
+    revocation epoch of their wallet instead and are verified against the
+    in-memory revocation state, without reading storage.
+    """
 
-    async def create_auth_token(
-        self, wallet_record: WalletRecord, wallet_key: str = None) -> str:
-        LOGGER.info('> create_auth_token!!!')
-        # create and get new token from super class...
-        # token = await super().create_auth_token(wallet_record=wallet_record, wallet_key=wallet_key)
-        async with self._profile.session() as session:
-            tokens_wallet_record = await TokensWalletRecord.retrieve_by_id(session, wallet_record.wallet_id)
-            LOGGER.info(tokens_wallet_record)
+    def __init__(self, profile: Profile, *args, **kwargs):
+        super().__init__(profile, *args, **kwargs)
+        self._token_cache = TokenCache(
+            profile.settings.get_int("multitenant.token_cache_size") or 1000
+        )
+        self._max_token_claims = (
+            profile.settings.get_int("multitenant.max_token_claims") or 100
+        )
+        self._wallet_locks = StripedLock(
+            profile.settings.get_int("multitenant.wallet_lock_stripes")
+            or DEFAULT_WALLET_LOCK_STRIPES
+        )
+        self._token_ttl = profile.settings.get_int("multitenant.token_ttl") or int(
+            TOKEN_TTL.total_seconds()
+        )
+        self._pending_claims: Dict[
+            str, List[Tuple[TokenClaimRecord, Optional[int], asyncio.Future]]
+        ] = {}
+        self._stateless_tokens = bool(
+            profile.settings.get("multitenant.stateless_tokens")
+        )
+        self._revocations = TokenRevocations()
+        self._wallet_records = WalletRecordCache(
+            profile.settings.get_int("multitenant.wallet_record_cache_size") or 1000
+        )
+        self._admission = WalletAdmission.from_settings(profile.settings)
+        self._invalidation: Optional[InvalidationChannel] = None
+        self._tracer = Tracer.from_settings(profile.settings)
+
+    @property
+    def token_cache(self) -> TokenCache:
+        """Accessor for the verified token cache."""
+        return self._token_cache
+
+    @property
+    def wallet_locks(self) -> StripedLock:
+        """Accessor for the locks serializing claim updates per wallet."""
+        return self._wallet_locks
+
+    @property
+    def token_ttl(self) -> int:
+        """Accessor for the lifetime of new tokens, in seconds."""
+        return self._token_ttl
+
+    @property
+    def admission(self) -> Optional[WalletAdmission]:
+        """Accessor for the per-wallet admission control, if enabled."""
+        return self._admission
+
+    @property
+    def stateless_tokens(self) -> bool:
+        """Whether tokens are verified without stored claims."""
+        return self._stateless_tokens
+
+    @property
+    def revocations(self) -> TokenRevocations:
+        """Accessor for the revocation state of stateless tokens."""
+        return self._revocations
+
+    @property
+    def tracer(self) -> Tracer:
+        """Accessor for the tracer sampling token operations."""
+        return self._tracer
+
+    async def load_revocations(self):
+        """Load the revocation state of stateless tokens ahead of first use."""
+        if self._stateless_tokens:
+            await self._revocations.ensure_loaded(self._profile)
+
+    async def subscribe_invalidations(self, channel: InvalidationChannel):
+        """Share cache invalidations with other replicas over a channel.
+
+        Args:
+            channel: The channel to publish and receive invalidations on
+        """
+        self._invalidation = channel
+        await channel.start(self._on_invalidation)
+
+    async def _publish_invalidation(self, wallet_id: str, scope: str):
+        if not self._invalidation:
+            return
+        try:
+            await self._invalidation.publish(wallet_id, scope)
+        except Exception:
+            LOGGER.exception("Error publishing invalidation of wallet %s", wallet_id)
 
-        iat = datetime.now(tz=timezone.utc)
-        exp = iat + timedelta(minutes=1)
+    async def _on_invalidation(self, invalidation: Invalidation):
+        wallet_id = invalidation.wallet_id
+        self._token_cache.invalidate_wallet(wallet_id)
+        if invalidation.scope == SCOPE_WALLET:
+            self._wallet_records.invalidate(wallet_id)
+            await self._evict_wallet_profile(wallet_id)
+        elif self._stateless_tokens:
+            await self._revocations.reload_wallet(self._profile, wallet_id)
+
+    async def _evict_wallet_profile(self, wallet_id: str):
+        """Drop the cached profile of a wallet changed by another replica.
+
+        The profile must not be closed while local requests still use it.
+        """
 
+    async def update_wallet(self, wallet_id: str, new_settings: dict) -> WalletRecord:
+        wallet_record = await super().update_wallet(wallet_id, new_settings)
+        self._token_cache.invalidate_wallet(wallet_id)
+        self._wallet_records.invalidate(wallet_id)
+        await self._publish_invalidation(wallet_id, SCOPE_WALLET)
+        return wallet_record
+
+    async def remove_wallet(self, wallet_id: str, wallet_key: str = None):
+        await super().remove_wallet(wallet_id, wallet_key)
+        self._token_cache.invalidate_wallet(wallet_id)
+        self._wallet_records.invalidate(wallet_id)
+        await self._publish_invalidation(wallet_id, SCOPE_WALLET)
+
+    def _encode_token(
+        self,
+        wallet_record: Union[WalletRecord, WalletAuthView],
+        wallet_key: Optional[str],
+        iat: int,
+        exp: int,
+        jti: str = None,
+        epoch: int = None,
+    ) -> str:
         jwt_payload = {"wallet_id": wallet_record.wallet_id, "iat": iat, "exp": exp}
         jwt_secret = self._profile.settings.get("multitenant.jwt_secret")
 
-        if tokens_wallet_record.requires_external_key:
+        if wallet_record.requires_external_key:
             if not wallet_key:
                 raise WalletKeyMissingError()
 
             jwt_payload["wallet_key"] = wallet_key
 
-        encoded = jwt.encode(jwt_payload, jwt_secret, algorithm="HS256")
-        LOGGER.info(encoded)    
-        decoded = jwt.decode(encoded, jwt_secret, algorithms=["HS256"])
-        LOGGER.info(decoded)
-        token = encoded
+        if jti:
+            jwt_payload["jti"] = jti
 
-        LOGGER.info(f"wallet.issued_at_claims = {tokens_wallet_record.issued_at_claims}")
-        # Store iat for verification later on
-        tokens_wallet_record.jwt_iat = decoded.get("iat")
-        tokens_wallet_record.add_issued_at_claims(decoded.get("iat"))
-        LOGGER.info(f"adding iat... {tokens_wallet_record.issued_at_claims}")
+        if epoch is not None:
+            jwt_payload["epoch"] = epoch
 
+        return jwt.encode(jwt_payload, jwt_secret, algorithm="HS256")
+
+    async def create_auth_token(
+        self, wallet_record: WalletRecord, wallet_key: str = None) -> str:
+        with self._tracer.trace("create_auth_token") as trace:
+            trace.set(wallet_id=wallet_record.wallet_id)
+            iat = int(datetime.now(tz=timezone.utc).timestamp())
+            exp = iat + self._token_ttl
+            jti = uuid4().hex
+
+            if self._stateless_tokens:
+                await self._revocations.ensure_loaded(self._profile)
+                epoch = self._revocations.epoch(wallet_record.wallet_id)
+                with trace.span("jwt_encode"):
+                    return self._encode_token(
+                        wallet_record, wallet_key, iat, exp, jti, epoch
+                    )
+
+            with trace.span("jwt_encode"):
+                token = self._encode_token(wallet_record, wallet_key, iat, exp, jti)
+
+            # Store the claim for verification later on
+            with trace.span("save"):
+                await self._register_claim(
+                    TokenClaimRecord(
+                        wallet_id=wallet_record.wallet_id, iat=iat, exp=exp, jti=jti
+                    )
+                )
+
+            return token
+
+    async def create_auth_tokens(
+        self, requests: Sequence[TokenRequest]
+    ) -> List[TokenResult]:
+        """Create tokens for many wallets, storing their claims in batches.
+
+        Tokens created for one wallet share their iat and are told apart by
+        their jti, each one has a claim of its own.
+
+        Args:
+            requests: The wallets to create tokens for and how many each
+
+        Returns:
+            List[TokenResult]: The tokens, or the error, for each request
+
+        """
+        iat = int(datetime.now(tz=timezone.utc).timestamp())
+        exp = iat + self._token_ttl
+        if self._stateless_tokens:
+            await self._revocations.ensure_loaded(self._profile)
+
+        results = []
+        claims: Dict[str, List[TokenClaimRecord]] = OrderedDict()
         async with self._profile.session() as session:
-            await tokens_wallet_record.save(session)
+            for request in requests:
+                try:
+                    wallet_record = await WalletRecord.retrieve_by_id(
+                        session, request.wallet_id
+                    )
+                    epoch = (
+                        self._revocations.epoch(request.wallet_id)
+                        if self._stateless_tokens
+                        else None
+                    )
+                    jtis = [uuid4().hex for _ in range(request.count)]
+                    tokens = [
+                        self._encode_token(
+                            wallet_record, request.wallet_key, iat, exp, jti, epoch
+                        )
+                        for jti in jtis
+                    ]
+                except (StorageNotFoundError, WalletKeyMissingError) as err:
+                    results.append(TokenResult(request.wallet_id, iat, error=err))
+                else:
+                    results.append(
+                        TokenResult(request.wallet_id, iat, tokens=tokens, jtis=jtis)
+                    )
+                    claims.setdefault(request.wallet_id, []).extend(
+                        TokenClaimRecord(
+                            wallet_id=request.wallet_id, iat=iat, exp=exp, jti=jti
+                        )
+                        for jti in jtis
+                    )
+
+        if self._stateless_tokens:
+            return results
+
+        wallet_ids = list(claims)
+        for start in range(0, len(wallet_ids), BULK_BATCH_SIZE):
+            batch = wallet_ids[start : start + BULK_BATCH_SIZE]
+            stale = []
+            locks = self._wallet_locks.many(batch)
+            async with locks, self._profile.transaction() as txn:
+                for wallet_id in batch:
+                    if await self._store_claims(txn, wallet_id, claims[wallet_id]):
+                        stale.append(wallet_id)
+                await txn.commit()
+            for wallet_id in stale:
+                self._token_cache.invalidate_wallet(wallet_id)
+                await self._publish_invalidation(wallet_id, SCOPE_TOKENS)
+
+        return results
+
+    async def _register_claim(self, claim: TokenClaimRecord, replaces: str = None):
+        """Queue a claim for storage and wait until it has been saved.
+
+        Claims queued for the same wallet while a save is pending are
+        written together by a single flush.
+
+        Args:
+            claim: The claim to store
+            replaces: The id of a claim of the same wallet to drop with it
+        """
+        saved = asyncio.get_event_loop().create_future()
+        pending = self._pending_claims.setdefault(claim.wallet_id, [])
+        pending.append((claim, replaces, saved))
+        if len(pending) == 1:
+            # run the flush on its own so a cancelled caller can't strand the batch
+            asyncio.ensure_future(self._flush_claims(claim.wallet_id))
+        await saved
+
+    async def _flush_claims(self, wallet_id: str):
+        async with self._wallet_locks.get(wallet_id):
+            batch = self._pending_claims.pop(wallet_id)
+            try:
+                await self._save_claims(
+                    wallet_id,
+                    [claim for claim, _, _ in batch],
+                    [replaces for _, replaces, _ in batch if replaces is not None],
+                )
+            except Exception as err:
+                for _, _, saved in batch:
+                    if not saved.done():
+                        saved.set_exception(err)
+            else:
+                for _, _, saved in batch:
+                    if not saved.done():
+                        saved.set_result(None)
+
+    async def _save_claims(
+        self,
+        wallet_id: str,
+        claims: Sequence[TokenClaimRecord],
+        replaced: Sequence[str] = (),
+    ):
+        async with self._profile.transaction() as txn:
+            stale = await self._store_claims(txn, wallet_id, claims, replaced)
+            await txn.commit()
+        if stale:
+            self._token_cache.invalidate_wallet(wallet_id)
+            await self._publish_invalidation(wallet_id, SCOPE_TOKENS)
+
+    async def _store_claims(
+        self,
+        session: ProfileSession,
+        wallet_id: str,
+        claims: Sequence[TokenClaimRecord],
+        replaced: Sequence[str] = (),
+    ) -> bool:
+        """Store new claims, dropping expired and surplus claims of the wallet.
+
+        Args:
+            session: The session to write the claims in
+            wallet_id: The wallet the claims belong to
+            claims: The new claims
+            replaced: The ids of existing claims to drop, unless also new
+
+        Returns:
+            bool: Whether any existing claim was dropped
+
+        """
+        now = int(time.time())
+        existing = await TokenClaimRecord.query(session, {"wallet_id": wallet_id})
+        stale = [claim for claim in existing if claim.exp < now]
+        live = {claim.claim_id: claim for claim in existing if claim.exp >= now}
+        for claim in claims:
+            if claim.claim_id not in live:
+                try:
+                    await claim.save(session)
+                except StorageDuplicateError:
+                    pass
+                live[claim.claim_id] = claim
+        new_ids = {claim.claim_id for claim in claims}
+        for claim_id in set(replaced) - new_ids:
+            if claim_id in live:
+                stale.append(live.pop(claim_id))
+        if len(live) > self._max_token_claims:
+            # oldest first, existing claims before new ones of the same second
+            oldest = sorted(
+                live.values(), key=lambda claim: (claim.iat, claim.claim_id in new_ids)
+            )[: len(live) - self._max_token_claims]
+            stale.extend(oldest)
+        for claim in stale:
+            await claim.delete_record(session)
+        return bool(stale)
 
+    async def _delete_claim(self, wallet_id: str, iat: int, jti: str = None):
+        record = StorageRecord(
+            TokenClaimRecord.RECORD_TYPE,
+            None,
+            id=TokenClaimRecord.claim_id_for(wallet_id, iat, jti),
+        )
         async with self._profile.session() as session:
-            tokens_wallet_record = await TokensWalletRecord.retrieve_by_id(session, wallet_record.wallet_id)
-            LOGGER.info(tokens_wallet_record)
+            try:
+                await session.inject(BaseStorage).delete_record(record)
+            except StorageNotFoundError:
+                pass
+        self._token_cache.invalidate_wallet(wallet_id)
+
+    async def revoke_claims(
+        self,
+        wallet_id: str,
+        iats: Sequence[int] = None,
+        jtis: Sequence[str] = None,
+    ) -> int:
+        """Revoke the tokens issued for a wallet.
+
+        Args:
+            wallet_id: The wallet to revoke tokens for
+            iats: The issued-at claims of the tokens to revoke
+            jtis: The identifiers of the tokens to revoke
+
+        Returns:
+            int: The number of claims revoked, all if neither iats nor jtis given
+
+        """
+        selection = None
+        if iats is not None or jtis is not None:
+            selection = TokenSelection(iats or (), jtis or ())
+        return (await self.revoke_claims_bulk({wallet_id: selection}))[wallet_id]
+
+    async def revoke_claims_bulk(
+        self, revocations: Mapping[str, Optional[TokenSelection]]
+    ) -> Dict[str, int]:
+        """Revoke the tokens issued for many wallets, in batched deletes.
+
+        In stateless mode the selected tokens are denied, or the revocation
+        epoch of the wallet is bumped when all tokens are revoked. Claims
+        stored for tokens issued before are deleted either way.
+
+        Args:
+            revocations: The tokens to revoke per wallet id, None to revoke
+                all tokens of that wallet
+
+        Returns:
+            Dict[str, int]: The number of claims revoked per wallet id, in
+                stateless mode the number of entries denied when selected
+
+        """
+        if self._stateless_tokens:
+            await self._revocations.ensure_loaded(self._profile)
+        ttl = self._token_ttl
+        revoked = {}
+        wallet_ids = list(revocations)
+        for start in range(0, len(wallet_ids), BULK_BATCH_SIZE):
+            batch = wallet_ids[start : start + BULK_BATCH_SIZE]
+            changes = RevocationChanges()
+            locks = self._wallet_locks.many(batch)
+            async with locks, self._profile.transaction() as txn:
+                for wallet_id in batch:
+                    selection = revocations[wallet_id]
+                    claims = await self._selected_claims(txn, wallet_id, selection)
+                    for claim in claims:
+                        await claim.delete_record(txn)
+                    revoked[wallet_id] = len(claims)
+                    if not self._stateless_tokens:
+                        continue
+                    if selection is None:
+                        await self._revocations.revoke_wallet(txn, changes, wallet_id)
+                        continue
+                    for iat in set(selection.iats):
+                        await self._revocations.deny(
+                            txn, changes, wallet_id, iat, iat + ttl
+                        )
+                    # a token with this jti was issued at the latest now
+                    for jti in set(selection.jtis):
+                        await self._revocations.deny(
+                            txn, changes, wallet_id, None, int(time.time()) + ttl, jti
+                        )
+                    revoked[wallet_id] = len(set(selection.iats)) + len(
+                        set(selection.jtis)
+                    )
+                await txn.commit()
+                # only what was committed reaches the in-memory state
+                self._revocations.apply(changes)
+            for wallet_id in batch:
+                self._token_cache.invalidate_wallet(wallet_id)
+                await self._publish_invalidation(wallet_id, SCOPE_TOKENS)
+        return revoked
 
-        # return this token...    
-        return token
+    async def _selected_claims(
+        self,
+        session: ProfileSession,
+        wallet_id: str,
+        selection: Optional[TokenSelection],
+    ) -> List[TokenClaimRecord]:
+        if selection is None:
+            return await TokenClaimRecord.query(session, {"wallet_id": wallet_id})
+        claims = {}
+        for tag, values in (("iat", selection.iats), ("jti", selection.jtis)):
+            if not values:
+                continue
+            tag_filter = {
+                "wallet_id": wallet_id,
+                tag: {"$in": sorted({str(value) for value in values})},
+            }
+            for claim in await TokenClaimRecord.query(session, tag_filter):
+                claims[claim.claim_id] = claim
+        return list(claims.values())
+
+    async def migrate_wallet_claims(self, wallet_id: str) -> IssuedAtClaims:
+        """Move the live legacy claims of a wallet record to token claim records.
+
+        Args:
+            wallet_id: The wallet whose inline issued_at_claims to migrate
+
+        Returns:
+            IssuedAtClaims: The claims that are still live and were migrated
+
+        """
+        async with self._wallet_locks.get(wallet_id):
+            async with self._profile.transaction() as txn:
+                claims = await self._migrate_claims(txn, wallet_id)
+                await txn.commit()
+        self._token_cache.invalidate_wallet(wallet_id)
+        return claims
+
+    async def migrate_wallet_claims_bulk(
+        self, wallet_ids: Sequence[str], stock_token_grace: int = 0
+    ) -> Dict[str, int]:
+        """Migrate the legacy claims of many wallet records, in batched writes.
+
+        Wallets removed in the meantime are skipped. Migrating a wallet again
+        changes nothing, so no per-wallet locks are taken: the records are
+        read for update and a lazy migration racing with this one writes the
+        same claims.
+
+        Args:
+            wallet_ids: The wallets to migrate
+            stock_token_grace: Seconds the token last issued to a wallet by
+                the stock manager stays valid, not carried over if 0
+
+        Returns:
+            Dict[str, int]: The number of claims migrated per wallet id
+
+        """
+        migrated = {}
+        for start in range(0, len(wallet_ids), BULK_BATCH_SIZE):
+            batch = wallet_ids[start : start + BULK_BATCH_SIZE]
+            async with self._profile.transaction() as txn:
+                for wallet_id in batch:
+                    try:
+                        claims = await self._migrate_claims(
+                            txn, wallet_id, stock_token_grace
+                        )
+                    except StorageNotFoundError:
+                        continue
+                    migrated[wallet_id] = len(claims)
+                await txn.commit()
+            for wallet_id in batch:
+                self._token_cache.invalidate_wallet(wallet_id)
+                self._wallet_records.invalidate(wallet_id)
+        return migrated
+
+    async def _migrate_claims(
+        self, session: ProfileSession, wallet_id: str, stock_token_grace: int = 0
+    ) -> IssuedAtClaims:
+        wallet = await TokensWalletRecord.retrieve_by_id(
+            session, wallet_id, for_update=True
+        )
+        claims = wallet.pop_issued_at_claims()
+        changed = bool(claims)
+        # legacy tokens were always issued with the default lifetime
+        ttl = int(TOKEN_TTL.total_seconds())
+        now = int(time.time())
+        claims.prune(now - ttl)
+        claims.trim(self._max_token_claims)
+        records = [
+            TokenClaimRecord(wallet_id=wallet_id, iat=iat, exp=iat + ttl)
+            for iat in claims
+        ]
+        if stock_token_grace > 0 and wallet.jwt_iat is not None:
+            # tokens of the stock manager have no expiry, keep the last one
+            # for a grace period only
+            if claims.add(wallet.jwt_iat):
+                records.append(
+                    TokenClaimRecord(
+                        wallet_id=wallet_id,
+                        iat=wallet.jwt_iat,
+                        exp=now + stock_token_grace,
+                    )
+                )
+            wallet.jwt_iat = None
+            changed = True
+        if not changed:
+            return claims
+
+        for record in records:
+            try:
+                await record.save(session)
+            except StorageDuplicateError:
+                pass
+        await wallet.save(session)
+        return claims
 
     async def get_profile_for_token(
             self, context: InjectionContext, token: str) -> Profile:
-        LOGGER.info('> get_profile_for_token!!!')
-        # return await super().get_profile_for_token(context=context, token=token)
         """Get the profile associated with a JWT header token.
 
         Args:
@@ -155,41 +734,159 @@ class TractionMultitenantManager(MultitenantManager):
         Raises:
             WalletKeyMissingError: If the wallet_key is missing for an unmanaged wallet
             InvalidTokenError: If there is an exception while decoding the token
+            TenantThrottledError: If the wallet is over its admission rate
 
         Returns:
             Profile associated with the token
 
         """
+        started = time.perf_counter()
+        outcome = "rejected"
+        with self._tracer.trace("get_profile_for_token") as trace:
+            try:
+                verified = self._token_cache.get(token)
+                hit = verified is not None
+                if not hit:
+                    verified = await self._check_token(token, trace)
+                trace.set(wallet_id=verified.wallet_id)
+                if self._admission is not None:
+                    # admitted only once verified, so forged tokens can't use up
+                    # the share of another wallet
+                    outcome = "throttled"
+                    with trace.span("admission"):
+                        await self._admission.admit(verified.wallet_id)
+                with trace.span("profile_open"):
+                    profile = await self._get_token_profile(context, verified)
+                outcome = "cached" if hit else "verified"
+                return profile
+            finally:
+                TOKEN_AUTH_SECONDS.labels(outcome).observe(
+                    time.perf_counter() - started
+                )
+                trace.set(outcome=outcome)
+
+    async def refresh_auth_token(self, token: str) -> str:
+        """Exchange a valid token for a new one with a full lifetime.
+
+        The claim of the presented token is replaced by the claim of the new
+        one, other tokens of the wallet stay valid even if issued in the same
+        second. The wallet record is not read again, and refreshes of the same
+        wallet that arrive together are stored with a single write. In
+        stateless mode nothing is written, the old token expires on its own.
+
+        Args:
+            token: The token to refresh
+
+        Raises:
+            MultitenantManagerError: If the token is not valid
+            InvalidTokenError: If there is an exception while decoding the token
+
+        Returns:
+            str: The new token
+
+        """
+        verified = self._token_cache.get(token) or await self._check_token(token)
+        wallet_key = verified.extra_settings.get("wallet.key")
+        iat = int(datetime.now(tz=timezone.utc).timestamp())
+        exp = iat + self._token_ttl
+        jti = uuid4().hex
+
+        if self._stateless_tokens:
+            epoch = self._revocations.epoch(verified.wallet_id)
+            return self._encode_token(
+                verified.wallet, wallet_key, iat, exp, jti, epoch
+            )
+
+        if iat == verified.iat:
+            # a token issued this second can't be given a later expiry
+            return token
+
+        new_token = self._encode_token(verified.wallet, wallet_key, iat, exp, jti)
+        await self._register_claim(
+            TokenClaimRecord(wallet_id=verified.wallet_id, iat=iat, exp=exp, jti=jti),
+            replaces=TokenClaimRecord.claim_id_for(
+                verified.wallet_id, verified.iat, verified.jti
+            ),
+        )
+        return new_token
+
+    async def _get_token_profile(
+        self, context: InjectionContext, verified: VerifiedToken
+    ) -> Profile:
+        """Get the profile of a verified token."""
+        return await self.get_wallet_profile(
+            context, verified.wallet_record, dict(verified.extra_settings)
+        )
+
+    async def _check_token(self, token: str, trace: Trace = NULL_TRACE) -> VerifiedToken:
         jwt_secret = self._profile.context.settings.get("multitenant.jwt_secret")
         extra_settings = {}
 
         try:
-            token_body = jwt.decode(token, jwt_secret, algorithms=["HS256"])
+            with trace.span("jwt_decode"):
+                token_body = jwt.decode(token, jwt_secret, algorithms=["HS256"])
         except jwt.exceptions.ExpiredSignatureError as err:
-            LOGGER.error("Expired Signature... clean up claims")
             # ignore expiry so we can get the iat...
             token_body = jwt.decode(token, jwt_secret, algorithms=["HS256"], options={"verify_exp": False})
-            wallet_id = token_body.get("wallet_id")
-            iat = token_body.get("iat")
-            async with self._profile.session() as session:
-                wallet = await TokensWalletRecord.retrieve_by_id(session, wallet_id)
-                LOGGER.info(wallet)
-                wallet.issued_at_claims.remove(iat)
-                await wallet.save(session)
-            
-            async with self._profile.session() as session:
-                wallet = await TokensWalletRecord.retrieve_by_id(session, wallet_id)
-                LOGGER.info(wallet)
-
+            LOGGER.debug(
+                "Expired token of wallet %s, iat %s",
+                token_body.get("wallet_id"),
+                token_body.get("iat"),
+            )
+            if "epoch" not in token_body:
+                with trace.span("save"):
+                    await self._delete_claim(
+                        token_body.get("wallet_id"),
+                        token_body.get("iat"),
+                        token_body.get("jti"),
+                    )
             raise err
 
         wallet_id = token_body.get("wallet_id")
         wallet_key = token_body.get("wallet_key")
         iat = token_body.get("iat")
+        jti = token_body.get("jti")
 
-        async with self._profile.session() as session:
-            wallet = await TokensWalletRecord.retrieve_by_id(session, wallet_id)
-            LOGGER.info(wallet)
+        if self._stateless_tokens and "epoch" in token_body:
+            # the signature proves the claims, revocation state is in memory
+            await self._revocations.ensure_loaded(self._profile)
+            with trace.span("claim_check", stateless=True):
+                if self._revocations.is_revoked(
+                    wallet_id, iat, token_body["epoch"], jti
+                ):
+                    raise MultitenantManagerError("Token not valid")
+            wallet = self._wallet_records.get(wallet_id)
+            if wallet is None:
+                with trace.span("record_fetch"):
+                    async with self._profile.session() as session:
+                        wallet = await WalletAuthView.retrieve(
+                            session, wallet_id, TokensWalletRecord
+                        )
+                self._wallet_records.put(wallet)
+            token_valid = True
+        else:
+            async with self._profile.session() as session:
+                with trace.span("record_fetch"):
+                    # only the fields checked here, the full record is built
+                    # when the wallet profile has to be opened
+                    wallet = await WalletAuthView.retrieve(
+                        session, wallet_id, TokensWalletRecord
+                    )
+                storage = session.inject(BaseStorage)
+                with trace.span("claim_check"):
+                    try:
+                        await storage.get_record(
+                            TokenClaimRecord.RECORD_TYPE,
+                            TokenClaimRecord.claim_id_for(wallet_id, iat, jti),
+                            {"retrieveTags": False},
+                        )
+                        token_valid = True
+                    except StorageNotFoundError:
+                        token_valid = False
+
+            if not token_valid and not jti and wallet.has_legacy_claims:
+                with trace.span("claim_migrate"):
+                    token_valid = iat in await self.migrate_wallet_claims(wallet_id)
 
         if wallet.requires_external_key:
             if not wallet_key:
@@ -197,16 +894,131 @@ class TractionMultitenantManager(MultitenantManager):
 
             extra_settings["wallet.key"] = wallet_key
 
-        token_valid = False    
-        for claim in wallet.issued_at_claims:
-            LOGGER.info(f"claim = {claim}, iat = {iat}")
-            if claim == iat:
-                LOGGER.info(f"claim = {claim}, iat = {iat} - matched!!!")
-                token_valid = True
-
         if not token_valid:
             raise MultitenantManagerError("Token not valid")
 
-        profile = await self.get_wallet_profile(context, wallet, extra_settings)
+        verified = VerifiedToken(
+            wallet_id=wallet_id,
+            iat=iat,
+            exp=token_body.get("exp"),
+            wallet=wallet,
+            extra_settings=dict(extra_settings),
+            jti=jti,
+        )
+        if verified.exp is not None:
+            # stock tokens carried over by a migration have no expiry, they
+            # are checked against their claim every time
+            self._token_cache.put(token, verified)
+
+        return verified
+
+
+class TractionMultitenantManager(MultitokenManagerMixin, MultitenantManager):
+    """Multitenant manager for individually stored wallets with multiple tokens."""
+
+    def __init__(self, profile: Profile):
+        super().__init__(profile)
+        self._profiles = WalletProfileCache(
+            profile.settings.get_int("multitenant.cache_size") or 100,
+            profile.settings.get_int("multitenant.profile_idle_timeout"),
+        )
+
+    @property
+    def open_profiles(self) -> Iterable[Profile]:
+        """Return iterator over open profiles."""
+        yield from self._profiles.profiles()
+
+    @property
+    def profile_cache(self) -> WalletProfileCache:
+        """Accessor for the open wallet profile cache."""
+        return self._profiles
+
+    async def get_wallet_profile(
+        self,
+        base_context: InjectionContext,
+        wallet_record: WalletRecord,
+        extra_settings: dict = {},
+        *,
+        provision=False,
+    ) -> Profile:
+        """Get profile for a wallet record.
 
+        Args:
+            base_context: Base context to extend from
+            wallet_record: Wallet record to get the context for
+            extra_settings: Any extra context settings
+
+        Returns:
+            Profile: Profile for the wallet record
+
+        """
+        return await self._profiles.get_or_open(
+            wallet_record.wallet_id,
+            lambda: self._open_wallet_profile(
+                base_context, wallet_record, dict(extra_settings), provision
+            ),
+        )
+
+    async def _get_token_profile(
+        self, context: InjectionContext, verified: VerifiedToken
+    ) -> Profile:
+        """Get the profile of a verified token.
+
+        The full wallet record is only built if the profile isn't open yet.
+        """
+        return await self._profiles.get_or_open(
+            verified.wallet_id,
+            lambda: self._open_wallet_profile(
+                context, verified.wallet_record, dict(verified.extra_settings), False
+            ),
+        )
+
+    async def _open_wallet_profile(
+        self,
+        base_context: InjectionContext,
+        wallet_record: WalletRecord,
+        extra_settings: dict,
+        provision: bool,
+    ) -> Profile:
+        # Extend base context
+        context = base_context.copy()
+
+        # Settings we don't want to use from base wallet
+        reset_settings = {
+            "wallet.recreate": False,
+            "wallet.seed": None,
+            "wallet.rekey": None,
+            "wallet.name": None,
+            "wallet.type": None,
+            "mediation.open": None,
+            "mediation.invite": None,
+            "mediation.default_id": None,
+            "mediation.clear": None,
+        }
+        extra_settings["admin.webhook_urls"] = self.get_webhook_urls(
+            base_context, wallet_record
+        )
+
+        context.settings = (
+            context.settings.extend(reset_settings)
+            .extend(wallet_record.settings)
+            .extend(extra_settings)
+        )
+
+        profile, _ = await wallet_config(context, provision=provision)
         return profile
+
+    async def _evict_wallet_profile(self, wallet_id: str):
+        # requests still using the profile keep it open, it is closed once
+        # they are done and the next request opens it with the new settings
+        self._profiles.discard(wallet_id)
+
+    async def remove_wallet_profile(self, profile: Profile):
+        """Remove the wallet profile instance.
+
+        Args:
+            profile: The wallet profile instance
+
+        """
+        self._profiles.remove(profile.settings.get_str("wallet.id"))
+        await profile.remove()
@@ -0,0 +1,303 @@
+"""Resumable batch migration of wallet records to multitoken claims."""
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Deque, List, Optional, Sequence, Tuple
+
+from aries_cloudagent.core.profile import Profile
+from aries_cloudagent.storage.base import BaseStorage
+from aries_cloudagent.storage.error import StorageNotFoundError
+from aries_cloudagent.storage.record import StorageRecord
+from aries_cloudagent.wallet.models.wallet_record import WalletRecord
+
+from ..common.storage import iter_record_batches
+from .manager import BULK_BATCH_SIZE
+
+LOGGER = logging.getLogger(__name__)
+
+# the reader holds a session of its own for the whole scan and checkpoints
+# take another, so with two batches in flight a migration never needs more
+# than four connections and leaves room in a small pool for admin requests
+DEFAULT_CONCURRENCY = 2
+
+
+class WalletClaimsMigration:
+    """Migrate the claims of all wallet records ahead of their first use.
+
+    Wallet records are read a page at a time. Records holding inline
+    issued_at_claims, or a stock token to carry over, are migrated in batched
+    writes with up to `concurrency` batches in flight; the others are never
+    written. After every page whose batches are done the position is saved
+    as a checkpoint, and a later run resumes from there. Records are read in
+    storage order, which the in-memory and askar backends keep stable; if
+    the checkpoint no longer matches, the run starts over, which only costs
+    reads as migrated records need no more writes.
+    """
+
+    RECORD_TYPE = "wallet_claims_migration"
+    RECORD_ID = "checkpoint.wallet_claims_migration"
+
+    def __init__(
+        self,
+        profile: Profile,
+        manager,
+        *,
+        page_size: int = 500,
+        batch_size: int = BULK_BATCH_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        stock_token_grace: int = 0,
+    ):
+        """Initialize WalletClaimsMigration.
+
+        Args:
+            profile: The base profile holding the wallet records
+            manager: The multitoken manager migrating the claims
+            page_size: Number of wallet records read per page
+            batch_size: Number of wallets migrated per transaction
+            concurrency: Maximum number of batches migrated concurrently
+            stock_token_grace: Seconds the last stock token of a wallet stays
+                valid, not carried over if 0
+        """
+        self._profile = profile
+        self._manager = manager
+        self.page_size = max(page_size, 1)
+        self.batch_size = max(batch_size, 1)
+        self.concurrency = max(concurrency, 1)
+        self.stock_token_grace = stock_token_grace
+        self.scanned = 0
+        self.resumed_at = 0
+        self.migrated = 0
+        self.claims = 0
+        self.failed = 0
+        self.completed = False
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        """Accessor to check if the migration is running."""
+        return bool(self._task and not self._task.done())
+
+    @property
+    def progress(self) -> dict:
+        """Accessor for the migration progress."""
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+        scanned = self.scanned - self.resumed_at
+        return {
+            "scanned": self.scanned,
+            "resumed_at": self.resumed_at,
+            "migrated": self.migrated,
+            "claims": self.claims,
+            "failed": self.failed,
+            "running": self.running,
+            "completed": self.completed,
+            "elapsed": elapsed,
+            "records_per_second": scanned / elapsed if elapsed else None,
+        }
+
+    def start(self, restart: bool = False):
+        """Start migrating in the background, unless already running.
+
+        Args:
+            restart: Whether to ignore the checkpoint and start over
+        """
+        if not self.running:
+            self._task = asyncio.ensure_future(self.run(restart))
+
+    async def stop(self):
+        """Cancel a migration that is still running, keeping its checkpoint."""
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def wait(self):
+        """Wait for a migration started in the background."""
+        if self._task:
+            await asyncio.shield(self._task)
+
+    async def _load_checkpoint(self) -> dict:
+        async with self._profile.session() as session:
+            try:
+                record = await session.inject(BaseStorage).get_record(
+                    self.RECORD_TYPE, self.RECORD_ID
+                )
+            except StorageNotFoundError:
+                return {}
+        return json.loads(record.value)
+
+    async def _save_checkpoint(self, offset: int, last_wallet_id: Optional[str]):
+        value = json.dumps(
+            {
+                "offset": offset,
+                "last_wallet_id": last_wallet_id,
+                "migrated": self.migrated,
+                "claims": self.claims,
+                "completed": self.completed,
+            }
+        )
+        async with self._profile.session() as session:
+            storage = session.inject(BaseStorage)
+            try:
+                record = await storage.get_record(self.RECORD_TYPE, self.RECORD_ID)
+                await storage.update_record(record, value, {})
+            except StorageNotFoundError:
+                await storage.add_record(
+                    StorageRecord(self.RECORD_TYPE, value, {}, self.RECORD_ID)
+                )
+
+    def _needs_migration(self, row: StorageRecord) -> bool:
+        value = json.loads(row.value)
+        return bool(value.get("issued_at_claims")) or bool(
+            self.stock_token_grace and value.get("jwt_iat") is not None
+        )
+
+    async def _migrate_batch(self, wallet_ids: Sequence[str], limit: asyncio.Semaphore):
+        async with limit:
+            try:
+                migrated = await self._manager.migrate_wallet_claims_bulk(
+                    wallet_ids, self.stock_token_grace
+                )
+            except Exception as err:
+                self.failed += len(wallet_ids)
+                LOGGER.warning(
+                    "Migration of %d wallet records failed: %s", len(wallet_ids), err
+                )
+                return
+        self.migrated += len(migrated)
+        self.claims += sum(migrated.values())
+
+    async def run(self, restart: bool = False) -> dict:
+        """Migrate all wallet records, resuming from the checkpoint.
+
+        Args:
+            restart: Whether to ignore the checkpoint and start over
+
+        Returns:
+            dict: The migration progress
+
+        """
+        progress = await self._run(restart)
+        if progress is None:
+            # the scan of the first attempt is closed by now, so starting over
+            # does not hold on to its session
+            LOGGER.warning("Migration checkpoint does not match, starting over")
+            progress = await self._run(restart=True)
+        return progress
+
+    async def _run(self, restart: bool) -> Optional[dict]:
+        checkpoint = {} if restart else await self._load_checkpoint()
+        self.started = time.time()
+        self.finished = None
+        if checkpoint.get("completed"):
+            self.scanned = self.resumed_at = checkpoint["offset"]
+            self.migrated = checkpoint["migrated"]
+            self.claims = checkpoint["claims"]
+            self.completed = True
+            self.finished = self.started
+            return self.progress
+
+        skip = checkpoint.get("offset", 0)
+        expected_wallet_id = checkpoint.get("last_wallet_id")
+        self.scanned = self.resumed_at = 0
+        self.migrated = checkpoint.get("migrated", 0)
+        self.claims = checkpoint.get("claims", 0)
+        self.failed = 0
+        self.completed = False
+        if skip:
+            LOGGER.info("Resuming wallet claims migration after %d records", skip)
+
+        limit = asyncio.Semaphore(self.concurrency)
+        # batches in flight by the page they belong to, oldest first
+        pages: Deque[Tuple[int, Optional[str], List[asyncio.Future]]] = deque()
+        # the last record of the pages whose batches are all done
+        settled: Optional[str] = expected_wallet_id
+        last_saved = time.monotonic()
+
+        async def settle(block: bool):
+            nonlocal settled, last_saved
+            while pages and (block or all(task.done() for task in pages[0][2])):
+                offset, last_wallet_id, tasks = pages.popleft()
+                if tasks:
+                    await asyncio.gather(*tasks)
+                self.scanned, settled = offset, last_wallet_id
+            if time.monotonic() - last_saved > 1:
+                await self._save_checkpoint(self.scanned, settled)
+                last_saved = time.monotonic()
+                LOGGER.info(
+                    "Wallet claims migration: %d records scanned, %d migrated",
+                    self.scanned,
+                    self.migrated,
+                )
+
+        try:
+            offset = 0
+            async with self._profile.session() as session:
+                async for rows in iter_record_batches(
+                    session, WalletRecord.RECORD_TYPE, batch_size=self.page_size
+                ):
+                    if offset < skip:
+                        if offset + len(rows) < skip:
+                            offset += len(rows)
+                            continue
+                        # the page holding the last record migrated before
+                        position = skip - offset
+                        if rows[position - 1].id != expected_wallet_id:
+                            return None
+                        rows = rows[position:]
+                        offset = self.scanned = self.resumed_at = skip
+                        if not rows:
+                            continue
+
+                    candidates = [row.id for row in rows if self._needs_migration(row)]
+                    tasks = [
+                        asyncio.ensure_future(
+                            self._migrate_batch(
+                                candidates[start : start + self.batch_size], limit
+                            )
+                        )
+                        for start in range(0, len(candidates), self.batch_size)
+                    ]
+                    offset += len(rows)
+                    pages.append((offset, rows[-1].id, tasks))
+                    # don't read ahead of the writes by more than a page per
+                    # batch in flight
+                    if len(pages) > self.concurrency:
+                        await asyncio.gather(*pages[0][2])
+                    await settle(block=False)
+
+            await settle(block=True)
+            self.scanned = max(self.scanned, offset)
+            if self.failed:
+                # the failed wallets are somewhere before the checkpoint, the
+                # next run has to read everything again to find them
+                await self._save_checkpoint(0, None)
+            else:
+                self.completed = True
+                await self._save_checkpoint(self.scanned, None)
+        except asyncio.CancelledError:
+            # keep what is done, batches cut short are migrated again
+            tasks = [task for _, _, page_tasks in pages for task in page_tasks]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._save_checkpoint(self.scanned, settled)
+            raise
+        finally:
+            self.finished = time.time()
+
+        LOGGER.info(
+            "Wallet claims migration finished: %d records scanned, %d migrated "
+            "with %d claims, %d failed",
+            self.scanned,
+            self.migrated,
+            self.claims,
+            self.failed,
+        )
+        return self.progress
@@ -0,0 +1,79 @@
+"""Projection of the wallet record fields needed to check tokens."""
+
+import json
+from typing import Optional, Type
+
+from aries_cloudagent.core.profile import ProfileSession
+from aries_cloudagent.storage.base import BaseStorage
+from aries_cloudagent.wallet.models.wallet_record import WalletRecord
+
+
+class WalletAuthView:
+    """The fields of a stored wallet record that token checks read.
+
+    Decoding a view skips building the record, its settings and its legacy
+    claims, and a view only holds on to the stored value as it was read. The
+    full record is built from it on first access to `record`, which is only
+    needed to open the wallet profile.
+    """
+
+    __slots__ = (
+        "wallet_id",
+        "requires_external_key",
+        "has_legacy_claims",
+        "_value",
+        "_record",
+        "_record_class",
+    )
+
+    def __init__(
+        self,
+        wallet_id: str,
+        value: str,
+        record_class: Type[WalletRecord] = WalletRecord,
+    ):
+        """Initialize WalletAuthView.
+
+        Args:
+            wallet_id: The wallet id, the id of the stored record
+            value: The JSON value of the stored record
+            record_class: The record class to build the full record with
+        """
+        self.wallet_id = wallet_id
+        self._value = value
+        value = json.loads(value)
+        self.requires_external_key = (
+            value.get("key_management_mode") == WalletRecord.MODE_UNMANAGED
+        )
+        self.has_legacy_claims = bool(value.get("issued_at_claims"))
+        self._record: Optional[WalletRecord] = None
+        self._record_class = record_class
+
+    @classmethod
+    async def retrieve(
+        cls,
+        session: ProfileSession,
+        wallet_id: str,
+        record_class: Type[WalletRecord] = WalletRecord,
+    ) -> "WalletAuthView":
+        """Read the view of a stored wallet record.
+
+        Raises:
+            StorageNotFoundError: If the wallet record does not exist
+
+        """
+        row = await session.inject(BaseStorage).get_record(
+            WalletRecord.RECORD_TYPE, wallet_id, {"retrieveTags": False}
+        )
+        return cls(wallet_id, row.value, record_class)
+
+    @property
+    def record(self) -> WalletRecord:
+        """Accessor for the full wallet record, built on first access."""
+        if self._record is None:
+            self._record = self._record_class.from_storage(
+                self.wallet_id, json.loads(self._value)
+            )
+            # the record holds everything from now on
+            self._value = None
+        return self._record
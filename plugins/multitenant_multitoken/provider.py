@@ -21,8 +21,8 @@ class TractionMultitenantManagerProvider(MultitenantManagerProvider):
     """
 
     askar_profile_manager_path = (
-        "aries_cloudagent.multitenant."
-        "askar_profile_manager.AskarProfileMultitenantManager"
+        "plugins.multitenant_multitoken."
+        "askar_profile_manager.TractionAskarProfileMultitenantManager"
     )
     MANAGER_TYPES = {
         "basic": "plugins.multitenant_multitoken.manager.TractionMultitenantManager",
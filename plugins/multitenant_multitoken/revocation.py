@@ -0,0 +1,297 @@
+"""Revocation state of stateless multitoken tokens."""
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aries_cloudagent.core.profile import Profile, ProfileSession
+from aries_cloudagent.storage.base import BaseStorage
+from aries_cloudagent.storage.error import StorageNotFoundError
+from aries_cloudagent.storage.record import StorageRecord
+
+from ..common.storage import iter_record_batches
+from .claims import TokenClaimRecord
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DenySet:
+    """Revoked tokens that are not yet expired.
+
+    Entries are dropped once the token they were added for has expired, the
+    signature check rejects the token from then on. Expired entries are found
+    with a heap ordered by exp, so pruning never scans the whole set.
+    """
+
+    __slots__ = ("_entries", "_expiry")
+
+    def __init__(self):
+        """Initialize DenySet."""
+        self._entries: Dict[str, int] = {}
+        self._expiry: List[Tuple[int, str]] = []
+
+    def __contains__(self, key: str) -> bool:
+        """Check whether a token is denied."""
+        exp = self._entries.get(key)
+        return exp is not None and exp > time.time()
+
+    def __len__(self) -> int:
+        """Return the number of denied tokens."""
+        return len(self._entries)
+
+    def add(self, key: str, exp: int):
+        """Deny a token until it expires.
+
+        Args:
+            key: The key of the denied token
+            exp: The expiry of the token
+        """
+        self.prune()
+        if exp <= time.time() or self._entries.get(key, 0) >= exp:
+            return
+        self._entries[key] = exp
+        heapq.heappush(self._expiry, (exp, key))
+
+    def prune(self, now: float = None) -> int:
+        """Drop the entries of expired tokens.
+
+        Returns:
+            int: The number of entries dropped
+
+        """
+        now = time.time() if now is None else now
+        pruned = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            exp, key = heapq.heappop(self._expiry)
+            if self._entries.get(key) == exp:
+                del self._entries[key]
+                pruned += 1
+        return pruned
+
+    def clear(self):
+        """Drop all entries."""
+        self._entries.clear()
+        self._expiry.clear()
+
+
+class RevocationChanges:
+    """Revocation state written in a transaction, to apply once it commits."""
+
+    __slots__ = ("epochs", "denied")
+
+    def __init__(self):
+        """Initialize RevocationChanges."""
+        self.epochs: Dict[str, int] = {}
+        self.denied: Dict[str, int] = {}
+
+
+class TokenRevocations:
+    """Per-wallet revocation epochs and denied tokens, held in memory.
+
+    A stateless token carries the revocation epoch of its wallet at issue and
+    is valid as long as its signature holds, the epoch is still current and
+    it is not denied. Revoking all tokens of a wallet bumps its epoch,
+    revoking single tokens adds them to the deny set. Both are written to
+    storage so they survive restarts, but verification only reads memory.
+    Writes collect their changes, which are applied to memory once the
+    transaction they were made in has committed.
+    """
+
+    RECORD_TYPE_EPOCH = "token_revocation_epoch"
+    RECORD_TYPE_DENIED = "token_revocation_denied"
+
+    def __init__(self):
+        """Initialize TokenRevocations."""
+        self._epochs: Dict[str, int] = {}
+        self._denied = DenySet()
+        self._loading: Optional[asyncio.Future] = None
+        self.loaded = False
+
+    @property
+    def stats(self) -> dict:
+        """Accessor for the table sizes."""
+        return {"epochs": len(self._epochs), "denied": len(self._denied)}
+
+    @staticmethod
+    def _denied_key(wallet_id: str, iat: Optional[int], jti: str = None) -> str:
+        # a single token by its jti, or all tokens of the wallet issued at iat
+        if jti:
+            return f"{wallet_id}#{jti}"
+        return TokenClaimRecord.claim_id_for(wallet_id, iat)
+
+    @classmethod
+    def _denied_key_for_tags(cls, tags: dict) -> str:
+        return cls._denied_key(tags["wallet_id"], tags.get("~iat"), tags.get("jti"))
+
+    @staticmethod
+    def _record_id(record_type: str, key: str) -> str:
+        # record ids are unique across types in some backends, so they can't
+        # be the wallet or claim ids the records belong to
+        return f"{key}.{record_type}"
+
+    def epoch(self, wallet_id: str) -> int:
+        """Get the current revocation epoch of a wallet."""
+        return self._epochs.get(wallet_id, 0)
+
+    def is_revoked(
+        self, wallet_id: str, iat: int, epoch: int, jti: str = None
+    ) -> bool:
+        """Check whether a stateless token has been revoked.
+
+        Args:
+            wallet_id: The wallet the token was issued for
+            iat: The issued-at claim of the token
+            epoch: The revocation epoch the token was issued in
+            jti: The identifier of the token, if it has one
+
+        """
+        return (
+            epoch != self._epochs.get(wallet_id, 0)
+            or self._denied_key(wallet_id, iat) in self._denied
+            or bool(jti and self._denied_key(wallet_id, iat, jti) in self._denied)
+        )
+
+    async def ensure_loaded(self, profile: Profile):
+        """Load the revocation state from storage, once."""
+        if self.loaded:
+            return
+        if not self._loading:
+            self._loading = asyncio.ensure_future(self._load(profile))
+        try:
+            await asyncio.shield(self._loading)
+        except Exception:
+            # let the next caller try again
+            self._loading = None
+            raise
+
+    async def _load(self, profile: Profile):
+        epochs = {}
+        denied = DenySet()
+        now = int(time.time())
+        async with profile.session() as session:
+            async for rows in iter_record_batches(session, self.RECORD_TYPE_EPOCH):
+                for row in rows:
+                    epochs[row.tags["wallet_id"]] = int(row.value)
+            async for rows in iter_record_batches(
+                session, self.RECORD_TYPE_DENIED, {"~exp": {"$gt": str(now)}}
+            ):
+                for row in rows:
+                    denied.add(self._denied_key_for_tags(row.tags), int(row.value))
+
+        # revocations made while loading are newer than what was read
+        for wallet_id, epoch in epochs.items():
+            if epoch > self._epochs.get(wallet_id, 0):
+                self._epochs[wallet_id] = epoch
+        for key, exp in denied._entries.items():
+            self._denied.add(key, exp)
+        self.loaded = True
+        LOGGER.debug(
+            "Loaded %d revocation epochs and %d denied tokens",
+            len(epochs),
+            len(denied),
+        )
+
+    async def reload_wallet(self, profile: Profile, wallet_id: str):
+        """Read the revocation state of a wallet changed by another replica."""
+        if not self.loaded:
+            # a load still to come reads it all anyway
+            return
+        now = int(time.time())
+        async with profile.session() as session:
+            storage = session.inject(BaseStorage)
+            try:
+                record = await storage.get_record(
+                    self.RECORD_TYPE_EPOCH,
+                    self._record_id(self.RECORD_TYPE_EPOCH, wallet_id),
+                )
+                epoch = int(record.value)
+            except StorageNotFoundError:
+                epoch = 0
+            rows = await storage.find_all_records(
+                self.RECORD_TYPE_DENIED,
+                {"wallet_id": wallet_id, "~exp": {"$gt": str(now)}},
+            )
+        if epoch > self.epoch(wallet_id):
+            self._epochs[wallet_id] = epoch
+        for row in rows:
+            self._denied.add(self._denied_key_for_tags(row.tags), int(row.value))
+
+    def apply(self, changes: RevocationChanges):
+        """Apply the changes of a committed transaction to memory."""
+        for wallet_id, epoch in changes.epochs.items():
+            if epoch > self.epoch(wallet_id):
+                self._epochs[wallet_id] = epoch
+        for key, exp in changes.denied.items():
+            self._denied.add(key, exp)
+
+    async def revoke_wallet(
+        self, session: ProfileSession, changes: RevocationChanges, wallet_id: str
+    ) -> int:
+        """Revoke all stateless tokens of a wallet by moving on to a new epoch.
+
+        Args:
+            session: The session to write the epoch in
+            changes: The changes to apply once the session has committed
+            wallet_id: The wallet to revoke tokens for
+
+        Returns:
+            int: The new revocation epoch
+
+        """
+        storage = session.inject(BaseStorage)
+        record_id = self._record_id(self.RECORD_TYPE_EPOCH, wallet_id)
+        tags = {"wallet_id": wallet_id}
+        try:
+            record = await storage.get_record(self.RECORD_TYPE_EPOCH, record_id)
+        except StorageNotFoundError:
+            record = None
+        epoch = max(int(record.value) if record else 0, self.epoch(wallet_id)) + 1
+        if record:
+            await storage.update_record(record, str(epoch), tags)
+        else:
+            await storage.add_record(
+                StorageRecord(self.RECORD_TYPE_EPOCH, str(epoch), tags, record_id)
+            )
+        changes.epochs[wallet_id] = epoch
+        return epoch
+
+    async def deny(
+        self,
+        session: ProfileSession,
+        changes: RevocationChanges,
+        wallet_id: str,
+        iat: Optional[int],
+        exp: int,
+        jti: str = None,
+    ):
+        """Revoke the stateless token with a jti, or all issued at iat.
+
+        Args:
+            session: The session to write the denied token in
+            changes: The changes to apply once the session has committed
+            wallet_id: The wallet the token was issued for
+            iat: The issued-at claim of the tokens, ignored if jti is given
+            exp: The expiry of the token, the entry is dropped after it
+            jti: The identifier of the token
+
+        """
+        if exp <= time.time():
+            return
+        key = self._denied_key(wallet_id, iat, jti)
+        record_id = self._record_id(self.RECORD_TYPE_DENIED, key)
+        storage = session.inject(BaseStorage)
+        tags = {"wallet_id": wallet_id, "~exp": str(exp)}
+        if jti:
+            tags["jti"] = jti
+        else:
+            tags["~iat"] = str(iat)
+        try:
+            record = await storage.get_record(self.RECORD_TYPE_DENIED, record_id)
+            await storage.update_record(record, str(exp), tags)
+        except StorageNotFoundError:
+            await storage.add_record(
+                StorageRecord(self.RECORD_TYPE_DENIED, str(exp), tags, record_id)
+            )
+        changes.denied[key] = max(exp, changes.denied.get(key, 0))
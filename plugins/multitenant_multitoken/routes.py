@@ -0,0 +1,387 @@
+"""Multitoken admin routes."""
+
+import asyncio
+
+from aiohttp import web
+from aiohttp_apispec import docs, request_schema, response_schema
+
+from marshmallow import fields, validate
+
+from aries_cloudagent.admin.request_context import AdminRequestContext
+from aries_cloudagent.messaging.models.openapi import OpenAPISchema
+from aries_cloudagent.messaging.valid import UUIDFour
+from aries_cloudagent.multitenant.base import (
+    BaseMultitenantManager,
+    MultitenantManagerError,
+)
+from aries_cloudagent.multitenant.error import WalletKeyMissingError
+from aries_cloudagent.storage.error import StorageNotFoundError
+from jwt import InvalidTokenError
+
+from .manager import (
+    BULK_BATCH_SIZE,
+    MultitokenManagerMixin,
+    TokenRequest,
+    TokenSelection,
+)
+from .migration import DEFAULT_CONCURRENCY, WalletClaimsMigration
+
+MAX_TOKENS_PER_WALLET = 100
+
+
+class WalletTokensRequestSchema(OpenAPISchema):
+    """Tokens requested for a single wallet."""
+
+    wallet_id = fields.Str(
+        required=True, description="Subwallet identifier", example=UUIDFour.EXAMPLE
+    )
+    wallet_key = fields.Str(
+        required=False,
+        description="Master key used for key derivation. Only required for "
+        "unmanaged wallets.",
+        example="MySecretKey123",
+    )
+    count = fields.Int(
+        required=False,
+        missing=1,
+        validate=validate.Range(min=1, max=MAX_TOKENS_PER_WALLET),
+        description="Number of tokens to create",
+        example=1,
+    )
+
+
+class CreateTokensRequestSchema(OpenAPISchema):
+    """Request schema for creating tokens for many wallets."""
+
+    wallets = fields.List(
+        fields.Nested(WalletTokensRequestSchema()),
+        required=True,
+        validate=validate.Length(min=1),
+        description="Wallets to create tokens for",
+    )
+
+
+class WalletTokensResultSchema(OpenAPISchema):
+    """Tokens created for a single wallet."""
+
+    wallet_id = fields.Str(description="Subwallet identifier", example=UUIDFour.EXAMPLE)
+    iat = fields.Int(description="Issued at claim shared by the tokens")
+    tokens = fields.List(fields.Str(), description="Authorization tokens")
+    jtis = fields.List(
+        fields.Str(), description="Identifiers of the tokens, in the same order"
+    )
+    error = fields.Str(description="Reason no tokens were created")
+
+
+class CreateTokensResponseSchema(OpenAPISchema):
+    """Response schema for creating tokens for many wallets."""
+
+    results = fields.List(fields.Nested(WalletTokensResultSchema()))
+
+
+class WalletRevocationRequestSchema(OpenAPISchema):
+    """Tokens to revoke for a single wallet."""
+
+    wallet_id = fields.Str(
+        required=True, description="Subwallet identifier", example=UUIDFour.EXAMPLE
+    )
+    iats = fields.List(
+        fields.Int(),
+        required=False,
+        description="Issued at claims of the tokens to revoke, all tokens if "
+        "neither iats nor jtis are given",
+    )
+    jtis = fields.List(
+        fields.Str(),
+        required=False,
+        description="Identifiers of the tokens to revoke",
+    )
+
+
+class RevokeTokensRequestSchema(OpenAPISchema):
+    """Request schema for revoking tokens of many wallets."""
+
+    wallets = fields.List(
+        fields.Nested(WalletRevocationRequestSchema()),
+        required=True,
+        validate=validate.Length(min=1),
+        description="Wallets to revoke tokens for",
+    )
+
+
+class WalletRevocationResultSchema(OpenAPISchema):
+    """Tokens revoked for a single wallet."""
+
+    wallet_id = fields.Str(description="Subwallet identifier", example=UUIDFour.EXAMPLE)
+    revoked = fields.Int(description="Number of claims revoked")
+
+
+class RevokeTokensResponseSchema(OpenAPISchema):
+    """Response schema for revoking tokens of many wallets."""
+
+    results = fields.List(fields.Nested(WalletRevocationResultSchema()))
+
+
+class RefreshTokenResponseSchema(OpenAPISchema):
+    """Response schema for refreshing the bearer token."""
+
+    token = fields.Str(
+        description="Authorization token to use from now on",
+        example="eyJhbGciOiJFZERTQSJ9.eyJhIjogIjAifQ."
+        "dBjftJeZ4CVP-mB92K27uhbUJU1p1r_wW1gFWFOEjXk",
+    )
+
+
+class MigrateClaimsRequestSchema(OpenAPISchema):
+    """Request schema for migrating the claims of all wallet records."""
+
+    restart = fields.Bool(
+        required=False,
+        missing=False,
+        description="Start over instead of resuming from the checkpoint",
+    )
+    page_size = fields.Int(
+        required=False,
+        missing=500,
+        validate=validate.Range(min=1, max=10_000),
+        description="Number of wallet records read per page",
+    )
+    batch_size = fields.Int(
+        required=False,
+        missing=BULK_BATCH_SIZE,
+        validate=validate.Range(min=1, max=1000),
+        description="Number of wallets migrated per transaction",
+    )
+    concurrency = fields.Int(
+        required=False,
+        missing=DEFAULT_CONCURRENCY,
+        validate=validate.Range(min=1, max=32),
+        description="Maximum number of batches migrated concurrently",
+    )
+    stock_token_grace = fields.Int(
+        required=False,
+        missing=0,
+        validate=validate.Range(min=0),
+        description="Seconds the last token issued by the stock manager stays "
+        "valid, not carried over if 0",
+    )
+
+
+class MigrateClaimsProgressSchema(OpenAPISchema):
+    """Progress of the wallet claims migration."""
+
+    scanned = fields.Int(description="Wallet records read and done with")
+    resumed_at = fields.Int(description="Wallet records skipped by the checkpoint")
+    migrated = fields.Int(description="Wallet records migrated")
+    claims = fields.Int(description="Token claims written for migrated records")
+    failed = fields.Int(description="Wallet records that failed to migrate")
+    running = fields.Bool(description="Whether the migration is running")
+    completed = fields.Bool(description="Whether all wallet records are migrated")
+    elapsed = fields.Float(description="Seconds since the migration started")
+    records_per_second = fields.Float(
+        allow_none=True, description="Wallet records read per second"
+    )
+
+
+def _multitoken_manager(context: AdminRequestContext) -> MultitokenManagerMixin:
+    multitenant_mgr = context.profile.inject_or(BaseMultitenantManager)
+    if not isinstance(multitenant_mgr, MultitokenManagerMixin):
+        raise web.HTTPForbidden(reason="Multitoken multitenancy is not enabled")
+    return multitenant_mgr
+
+
+@docs(tags=["multitenancy"], summary="Create authorization tokens for many wallets")
+@request_schema(CreateTokensRequestSchema())
+@response_schema(CreateTokensResponseSchema(), 200, description="")
+async def tokens_create(request: web.BaseRequest):
+    """
+    Request handler for creating tokens for many subwallets at once.
+
+    Args:
+        request: aiohttp request object
+    """
+
+    context: AdminRequestContext = request["context"]
+    body = request["data"]
+    multitenant_mgr = _multitoken_manager(context)
+
+    results = await multitenant_mgr.create_auth_tokens(
+        [
+            TokenRequest(
+                wallet_id=wallet["wallet_id"],
+                wallet_key=wallet.get("wallet_key"),
+                count=wallet["count"],
+            )
+            for wallet in body["wallets"]
+        ]
+    )
+
+    return web.json_response(
+        {
+            "results": [
+                {"wallet_id": result.wallet_id, "error": result.error.roll_up}
+                if result.error
+                else {
+                    "wallet_id": result.wallet_id,
+                    "iat": result.iat,
+                    "tokens": list(result.tokens),
+                    "jtis": list(result.jtis),
+                }
+                for result in results
+            ]
+        }
+    )
+
+
+@docs(tags=["multitenancy"], summary="Revoke authorization tokens of many wallets")
+@request_schema(RevokeTokensRequestSchema())
+@response_schema(RevokeTokensResponseSchema(), 200, description="")
+async def tokens_revoke(request: web.BaseRequest):
+    """
+    Request handler for revoking tokens of many subwallets at once.
+
+    Args:
+        request: aiohttp request object
+    """
+
+    context: AdminRequestContext = request["context"]
+    body = request["data"]
+    multitenant_mgr = _multitoken_manager(context)
+
+    revocations = {}
+    for wallet in body["wallets"]:
+        selection = None
+        if "iats" in wallet or "jtis" in wallet:
+            selection = TokenSelection(wallet.get("iats", ()), wallet.get("jtis", ()))
+        if wallet["wallet_id"] in revocations:
+            known = revocations[wallet["wallet_id"]]
+            selection = (
+                None
+                if known is None or selection is None
+                else TokenSelection(
+                    [*known.iats, *selection.iats], [*known.jtis, *selection.jtis]
+                )
+            )
+        revocations[wallet["wallet_id"]] = selection
+
+    revoked = await multitenant_mgr.revoke_claims_bulk(revocations)
+
+    return web.json_response(
+        {
+            "results": [
+                {"wallet_id": wallet_id, "revoked": count}
+                for wallet_id, count in revoked.items()
+            ]
+        }
+    )
+
+
+@docs(tags=["multitenancy"], summary="Exchange the bearer token for a new one")
+@response_schema(RefreshTokenResponseSchema(), 200, description="")
+async def token_refresh(request: web.BaseRequest):
+    """
+    Request handler for refreshing the token of a subwallet.
+
+    The presented token stops being valid once the new one is issued.
+
+    Args:
+        request: aiohttp request object
+    """
+
+    context: AdminRequestContext = request["context"]
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise web.HTTPUnauthorized(reason="Only subwallet tokens can be refreshed")
+    multitenant_mgr = _multitoken_manager(context)
+
+    try:
+        new_token = await multitenant_mgr.refresh_auth_token(token)
+    except (
+        InvalidTokenError,
+        MultitenantManagerError,
+        StorageNotFoundError,
+        WalletKeyMissingError,
+    ) as err:
+        raise web.HTTPUnauthorized(reason=str(err)) from err
+
+    return web.json_response({"token": new_token})
+
+
+@docs(
+    tags=["multitenancy"],
+    summary="Migrate the token claims of all wallet records in the background",
+)
+@request_schema(MigrateClaimsRequestSchema())
+@response_schema(MigrateClaimsProgressSchema(), 200, description="")
+async def wallets_migrate_claims(request: web.BaseRequest):
+    """
+    Request handler for starting the wallet claims migration.
+
+    A migration that is already running is left alone and its progress
+    returned.
+
+    Args:
+        request: aiohttp request object
+    """
+
+    context: AdminRequestContext = request["context"]
+    body = request["data"]
+    multitenant_mgr = _multitoken_manager(context)
+    profile = context.profile
+
+    migration = profile.inject_or(WalletClaimsMigration)
+    if not (migration and migration.running):
+        migration = WalletClaimsMigration(
+            profile,
+            multitenant_mgr,
+            page_size=body["page_size"],
+            batch_size=body["batch_size"],
+            concurrency=body["concurrency"],
+            stock_token_grace=body["stock_token_grace"],
+        )
+        profile.context.injector.bind_instance(WalletClaimsMigration, migration)
+        migration.start(restart=body["restart"])
+        # let it load the checkpoint so the progress shows where it resumes
+        await asyncio.sleep(0)
+
+    return web.json_response(migration.progress)
+
+
+@docs(tags=["multitenancy"], summary="Get the progress of the wallet claims migration")
+@response_schema(MigrateClaimsProgressSchema(), 200, description="")
+async def wallets_migrate_claims_progress(request: web.BaseRequest):
+    """
+    Request handler for the progress of the wallet claims migration.
+
+    Args:
+        request: aiohttp request object
+    """
+
+    context: AdminRequestContext = request["context"]
+    _multitoken_manager(context)
+
+    migration = context.profile.inject_or(WalletClaimsMigration)
+    if not migration:
+        raise web.HTTPNotFound(reason="No wallet claims migration started")
+
+    return web.json_response(migration.progress)
+
+
+async def register(app: web.Application):
+    """Register routes."""
+
+    app.add_routes(
+        [
+            web.post("/multitenancy/tokens", tokens_create),
+            web.post("/multitenancy/tokens/revoke", tokens_revoke),
+            web.post("/multitenancy/wallets/migrate-claims", wallets_migrate_claims),
+            web.get(
+                "/multitenancy/wallets/migrate-claims",
+                wallets_migrate_claims_progress,
+                allow_head=False,
+            ),
+            # subwallets can't reach /multitenancy routes with their token
+            web.post("/wallet/token/refresh", token_refresh),
+        ]
+    )
+
@@ -0,0 +1,214 @@
+"""Background expiry of stale token claims."""
+
+import asyncio
+import json
+import logging
+import time
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from aries_cloudagent.core.profile import Profile
+from aries_cloudagent.storage.base import BaseStorage
+from aries_cloudagent.storage.error import StorageNotFoundError
+from aries_cloudagent.storage.record import StorageRecord
+
+from ..common.storage import fetch_records, iter_record_batches
+from .claims import TokenClaimRecord
+from .manager import TokensWalletRecord
+from .revocation import TokenRevocations
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SweepResult(NamedTuple):
+    """Outcome of a single sweep."""
+
+    claims: int
+    records: int
+    migrated: int
+
+
+class ClaimSweeper:
+    """Periodically expire stale token claims across all tenant wallets.
+
+    Expired token claim records are found with a range query on their exp tag
+    and deleted one batch per transaction, as are the stored entries of
+    revoked stateless tokens once the tokens have expired. Until a full scan
+    finds no wallet record with inline issued_at_claims, the sweep also moves
+    those legacy claims to token claim records. At most `concurrency` batches
+    are written at a time so the sweep cannot starve the storage connection
+    pool.
+    """
+
+    def __init__(
+        self,
+        profile: Profile,
+        manager,
+        *,
+        interval: float = 300,
+        batch_size: int = 100,
+        concurrency: int = 2,
+    ):
+        """Initialize ClaimSweeper.
+
+        Args:
+            profile: The base profile holding the wallet records
+            manager: The multitenant manager owning the claims
+            interval: Seconds between sweeps
+            batch_size: Number of records read and written per batch
+            concurrency: Maximum number of batches written concurrently
+        """
+        self._profile = profile
+        self._manager = manager
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = max(concurrency, 1)
+        self._legacy_claims = True
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_settings(cls, profile: Profile, manager) -> "ClaimSweeper":
+        """Create a sweeper configured from the profile settings."""
+        settings = profile.settings
+        return cls(
+            profile,
+            manager,
+            interval=settings.get_int("multitenant.sweep_interval") or 300,
+            batch_size=settings.get_int("multitenant.sweep_batch_size") or 100,
+            concurrency=settings.get_int("multitenant.sweep_concurrency") or 2,
+        )
+
+    @property
+    def running(self) -> bool:
+        """Accessor to check if the periodic sweep is running."""
+        return bool(self._task and not self._task.done())
+
+    def start(self):
+        """Start sweeping periodically."""
+        if not self.running:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop sweeping and wait for the current sweep to wind down."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                result = await self.sweep()
+            except Exception:
+                LOGGER.exception("Token claim sweep failed")
+                continue
+            LOGGER.info(
+                "Token claim sweep expired %d claims, "
+                "checked %d wallet records and migrated %d",
+                result.claims,
+                result.records,
+                result.migrated,
+            )
+
+    async def sweep(self) -> SweepResult:
+        """Expire stale claims and migrate legacy claims.
+
+        Returns:
+            SweepResult: The number of claims expired, wallet records checked
+                and wallet records migrated
+
+        """
+        claims = await self._expire_records(TokenClaimRecord.RECORD_TYPE)
+        await self._expire_records(TokenRevocations.RECORD_TYPE_DENIED)
+        records = migrated = 0
+        if self._legacy_claims:
+            records, legacy, migrated = await self._migrate_claims()
+            # only a scan that found nothing left to migrate ends migration,
+            # a record whose migration failed is picked up by the next sweep
+            self._legacy_claims = bool(legacy)
+        return SweepResult(claims=claims, records=records, migrated=migrated)
+
+    async def _expire_records(self, record_type: str) -> int:
+        tag_query = {"~exp": {"$lt": str(int(time.time()))}}
+
+        async def delete_batch(claim_ids: Sequence[str]) -> int:
+            deleted = 0
+            async with self._profile.transaction() as txn:
+                storage = txn.inject(BaseStorage)
+                for claim_id in claim_ids:
+                    try:
+                        await storage.delete_record(
+                            StorageRecord(record_type, None, id=claim_id)
+                        )
+                        deleted += 1
+                    except StorageNotFoundError:
+                        pass
+                await txn.commit()
+            return deleted
+
+        # read a batch for each writer, delete them and read again from the
+        # start: deleted records no longer match, so nothing is skipped and
+        # only one round of ids is held at a time
+        expired = 0
+        while True:
+            async with self._profile.session() as session:
+                rows = await fetch_records(
+                    session,
+                    record_type,
+                    tag_query,
+                    limit=self.batch_size * self.concurrency,
+                )
+            if not rows:
+                break
+            claim_ids = [row.id for row in rows]
+            deleted = sum(
+                await _gather_logged(
+                    *(
+                        delete_batch(claim_ids[start : start + self.batch_size])
+                        for start in range(0, len(claim_ids), self.batch_size)
+                    )
+                )
+            )
+            if not deleted:
+                # what is left can't be deleted now, the next sweep retries
+                break
+            expired += deleted
+        return expired
+
+    async def _migrate_claims(self) -> Tuple[int, int, int]:
+        limit = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        records = 0
+
+        async def migrate(wallet_id: str) -> int:
+            try:
+                return int(bool(await self._manager.migrate_wallet_claims(wallet_id)))
+            except StorageNotFoundError:
+                return 0
+            finally:
+                limit.release()
+
+        async with self._profile.session() as session:
+            async for rows in iter_record_batches(
+                session, TokensWalletRecord.RECORD_TYPE, batch_size=self.batch_size
+            ):
+                records += len(rows)
+                for row in rows:
+                    if json.loads(row.value).get("issued_at_claims"):
+                        await limit.acquire()
+                        tasks.append(asyncio.ensure_future(migrate(row.id)))
+
+        return records, len(tasks), sum(await _gather_logged(*tasks))
+
+
+async def _gather_logged(*aws) -> List[int]:
+    results = []
+    for result in await asyncio.gather(*aws, return_exceptions=True):
+        if isinstance(result, Exception):
+            LOGGER.error("Token claim sweep batch failed: %s", result)
+        else:
+            results.append(result)
+    return results
@@ -0,0 +1,255 @@
+"""Sampled tracing of the stages of token operations.
+
+A trace covers one operation, such as authenticating a request, and holds a
+span per stage of it. Only a sample of operations is traced; the others get
+a trace that records nothing, so an unsampled request pays for little more
+than a method call per stage. Finished traces are handed to a sink.
+"""
+
+import json
+import logging
+import random
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque, List, Optional
+from uuid import uuid4
+
+from aries_cloudagent.config.settings import BaseSettings
+from aries_cloudagent.utils.classloader import ClassLoader
+
+from ..common.metrics import REGISTRY
+
+LOGGER = logging.getLogger(__name__)
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "acapy_token_stage_seconds",
+    "Time spent in a stage of a sampled token operation",
+    ["operation", "stage"],
+)
+
+
+class Span:
+    """A timed stage of a traced operation."""
+
+    __slots__ = ("name", "start", "duration", "attributes")
+
+    def __init__(self, name: str, start: float, attributes: dict):
+        """Initialize Span."""
+        self.name = name
+        self.start = start
+        self.duration: Optional[float] = None
+        self.attributes = attributes
+
+    def serialize(self, trace_start: float) -> dict:
+        """Get the span as a plain dict, times in ms from the trace start."""
+        return {
+            "name": self.name,
+            "offset_ms": (self.start - trace_start) * 1000,
+            "duration_ms": (self.duration or 0) * 1000,
+            **self.attributes,
+        }
+
+
+class _SpanTimer:
+    __slots__ = ("_trace", "_span")
+
+    def __init__(self, trace: "Trace", span: Span):
+        self._trace = trace
+        self._span = span
+
+    def __enter__(self) -> Span:
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self._span
+        span.duration = time.perf_counter() - span.start
+        if exc_type:
+            span.attributes["error"] = exc_type.__name__
+        self._trace.spans.append(span)
+
+
+class Trace:
+    """The spans of one sampled operation."""
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "timestamp",
+        "start",
+        "duration",
+        "attributes",
+        "spans",
+        "_tracer",
+    )
+
+    def __init__(self, tracer: "Tracer", name: str):
+        """Initialize Trace."""
+        self.name = name
+        self.trace_id = uuid4().hex
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.attributes = {}
+        self.spans: List[Span] = []
+        self._tracer = tracer
+
+    def span(self, name: str, **attributes) -> _SpanTimer:
+        """Time a stage, use as a context manager."""
+        return _SpanTimer(self, Span(name, time.perf_counter(), attributes))
+
+    def set(self, **attributes):
+        """Add attributes to the trace, never secrets such as tokens or keys."""
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Trace":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            self.attributes["error"] = exc_type.__name__
+        self.duration = time.perf_counter() - self.start
+        self._tracer.export(self)
+
+    def serialize(self) -> dict:
+        """Get the trace as a plain dict."""
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "timestamp": self.timestamp,
+            "duration_ms": (self.duration or 0) * 1000,
+            "attributes": dict(self.attributes),
+            "spans": [span.serialize(self.start) for span in self.spans],
+        }
+
+
+class _NullSpanTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+class _NullTrace:
+    """Trace of an operation that was not sampled, recording nothing."""
+
+    __slots__ = ()
+
+    _TIMER = _NullSpanTimer()
+
+    def span(self, name: str, **attributes) -> _NullSpanTimer:
+        return self._TIMER
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self) -> "_NullTrace":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class SpanSink(ABC):
+    """Destination of finished traces.
+
+    Sinks are called on the event loop and must not block; a sink doing I/O
+    should hand traces off to a task of its own.
+    """
+
+    @abstractmethod
+    def export(self, trace: Trace):
+        """Handle a finished trace."""
+
+
+class LogSpanSink(SpanSink):
+    """Write traces as debug level log records with the trace as JSON."""
+
+    def export(self, trace: Trace):
+        """Log a finished trace."""
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            data = trace.serialize()
+            LOGGER.debug("trace %s", json.dumps(data), extra={"trace": data})
+
+
+class MemorySpanSink(SpanSink):
+    """Keep the most recent traces in memory."""
+
+    def __init__(self, capacity: int = 1000):
+        """Initialize MemorySpanSink.
+
+        Args:
+            capacity: The number of traces kept
+        """
+        self.traces: Deque[Trace] = deque(maxlen=capacity)
+
+    def export(self, trace: Trace):
+        """Keep a finished trace."""
+        self.traces.append(trace)
+
+
+class MetricsSpanSink(SpanSink):
+    """Record the duration of every stage in a histogram per stage."""
+
+    def export(self, trace: Trace):
+        """Record the stages of a finished trace."""
+        for span in trace.spans:
+            STAGE_SECONDS.labels(trace.name, span.name).observe(span.duration)
+
+
+SINKS = {"log": LogSpanSink, "memory": MemorySpanSink, "metrics": MetricsSpanSink}
+
+
+class Tracer:
+    """Start sampled traces and export them to a sink."""
+
+    def __init__(self, sample_rate: float = 0.0, sink: SpanSink = None):
+        """Initialize Tracer.
+
+        Args:
+            sample_rate: Fraction of operations traced, from 0 to 1
+            sink: Where finished traces go, logged at debug level by default
+        """
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.sink = sink or LogSpanSink()
+        self._random = random.random
+
+    @classmethod
+    def from_settings(cls, settings: BaseSettings) -> "Tracer":
+        """Create the tracer configured in settings.
+
+        `multitenant.trace_sample_rate` is the fraction of operations traced,
+        none by default. `multitenant.trace_sink` is "log", "memory",
+        "metrics" or the class path of a SpanSink taking no arguments.
+        """
+        sample_rate = float(settings.get("multitenant.trace_sample_rate") or 0)
+        sink_type = settings.get("multitenant.trace_sink") or "log"
+        sink_class = SINKS.get(sink_type) or ClassLoader.load_class(sink_type)
+        return cls(sample_rate, sink_class())
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any operation is traced."""
+        return self.sample_rate > 0
+
+    def trace(self, name: str):
+        """Start the trace of an operation, recording nothing if not sampled.
+
+        Use the result as a context manager, the trace is exported on exit.
+        """
+        if self.sample_rate and self._random() < self.sample_rate:
+            return Trace(self, name)
+        return NULL_TRACE
+
+    def export(self, trace: Trace):
+        """Hand a finished trace to the sink."""
+        try:
+            self.sink.export(trace)
+        except Exception:
+            LOGGER.exception("Error exporting trace %s", trace.name)
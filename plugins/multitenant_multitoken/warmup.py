@@ -0,0 +1,163 @@
+"""Background warm-up of recently active wallet profiles."""
+
+import asyncio
+import heapq
+import logging
+from typing import Dict, List, Optional
+
+from aries_cloudagent.core.profile import Profile
+from aries_cloudagent.storage.error import StorageNotFoundError
+from aries_cloudagent.wallet.models.wallet_record import WalletRecord
+
+from ..common.storage import iter_record_batches
+from .claims import TokenClaimRecord
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ProfileWarmup:
+    """Open the profiles of the most recently active wallets after startup.
+
+    Activity is taken from the iat of the token claims still in storage, so
+    the wallets that were issued tokens most recently are opened first.
+    Profiles are opened with bounded concurrency in a background task, the
+    admin server keeps serving requests meanwhile. Stateless tokens leave no
+    claims behind, so there is nothing to warm up with them.
+    """
+
+    def __init__(
+        self,
+        profile: Profile,
+        manager,
+        *,
+        count: int,
+        concurrency: int = 2,
+        batch_size: int = 100,
+    ):
+        """Initialize ProfileWarmup.
+
+        Args:
+            profile: The base profile holding the wallet records
+            manager: The multitenant manager to open the profiles with
+            count: The number of most recently active wallets to open
+            concurrency: Maximum number of profiles opened concurrently
+            batch_size: Number of claim records read per page
+        """
+        self._profile = profile
+        self._manager = manager
+        self.count = count
+        self.concurrency = max(concurrency, 1)
+        self.batch_size = batch_size
+        self.total = 0
+        self.opened = 0
+        self.skipped = 0
+        self.failed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_settings(cls, profile: Profile, manager) -> "ProfileWarmup":
+        """Create a warm-up configured from the profile settings."""
+        settings = profile.settings
+        count = settings.get_int("multitenant.warmup_count") or 0
+        cache = getattr(manager, "profile_cache", None)
+        if cache is not None and count > cache.capacity:
+            # any more would evict the profiles warmed up first
+            LOGGER.warning(
+                "multitenant.warmup_count %d is over multitenant.cache_size, "
+                "warming up %d wallet profiles",
+                count,
+                cache.capacity,
+            )
+            count = cache.capacity
+        return cls(
+            profile,
+            manager,
+            count=count,
+            concurrency=settings.get_int("multitenant.warmup_concurrency") or 2,
+        )
+
+    @property
+    def progress(self) -> dict:
+        """Accessor for the warm-up progress."""
+        return {
+            "total": self.total,
+            "opened": self.opened,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "done": bool(self._task and self._task.done()),
+        }
+
+    def start(self):
+        """Start warming up in the background."""
+        if self.count <= 0 or self._task:
+            return
+        if getattr(self._manager, "stateless_tokens", False):
+            LOGGER.info("Skipping warm-up, stateless tokens leave no activity")
+            return
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        """Cancel a warm-up that is still running."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def run(self):
+        """Open the profiles of the most recently active wallets."""
+        wallet_ids = await self._recent_wallet_ids()
+        self.total = len(wallet_ids)
+        LOGGER.info("Warming up %d wallet profiles", self.total)
+
+        limit = asyncio.Semaphore(self.concurrency)
+        report_every = max(self.total // 10, 1)
+
+        async def warm(wallet_id: str):
+            async with limit:
+                try:
+                    await self._open(wallet_id)
+                except Exception as err:
+                    self.failed += 1
+                    LOGGER.warning("Warm-up of wallet %s failed: %s", wallet_id, err)
+            done = self.opened + self.skipped + self.failed
+            if done % report_every == 0:
+                LOGGER.info(
+                    "Warm-up progress: %d/%d wallet profiles", done, self.total
+                )
+
+        await asyncio.gather(*(warm(wallet_id) for wallet_id in wallet_ids))
+        LOGGER.info(
+            "Warm-up finished: %d opened, %d skipped, %d failed",
+            self.opened,
+            self.skipped,
+            self.failed,
+        )
+
+    async def _recent_wallet_ids(self) -> List[str]:
+        last_active: Dict[str, int] = {}
+        async with self._profile.session() as session:
+            async for rows in iter_record_batches(
+                session, TokenClaimRecord.RECORD_TYPE, batch_size=self.batch_size
+            ):
+                for row in rows:
+                    wallet_id = row.tags.get("wallet_id")
+                    iat = int(row.tags.get("~iat", 0))
+                    if wallet_id and iat > last_active.get(wallet_id, -1):
+                        last_active[wallet_id] = iat
+        return heapq.nlargest(self.count, last_active, key=last_active.get)
+
+    async def _open(self, wallet_id: str):
+        try:
+            async with self._profile.session() as session:
+                wallet_record = await WalletRecord.retrieve_by_id(session, wallet_id)
+        except StorageNotFoundError:
+            self.skipped += 1
+            return
+        # unmanaged wallets can only be opened with the key from a token
+        if wallet_record.requires_external_key:
+            self.skipped += 1
+            return
+        await self._manager.get_wallet_profile(self._profile.context, wallet_record)
+        self.opened += 1
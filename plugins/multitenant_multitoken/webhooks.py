@@ -0,0 +1,364 @@
+"""Batched webhook dispatch of record events, enriched with traction fields."""
+
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+from aries_cloudagent.config.settings import BaseSettings
+from aries_cloudagent.core.event_bus import Event
+from aries_cloudagent.core.profile import Profile
+
+from ..common.metrics import REGISTRY
+from ..common.traction_metadata import find_traction
+
+LOGGER = logging.getLogger(__name__)
+
+RECORD_EVENT_PATTERN = re.compile("^acapy::record::([^:]*)(?:::.*)?$")
+PLUGIN_CONFIG_SECTION = "webhook_batch"
+BASE_WALLET = "base"
+
+EVENTS = REGISTRY.counter(
+    "acapy_webhook_batch_events_total", "Record events buffered for batched webhooks"
+)
+DROPPED = REGISTRY.counter(
+    "acapy_webhook_batch_dropped_total",
+    "Record events dropped because a tenant buffer was full",
+)
+PENDING = REGISTRY.gauge(
+    "acapy_webhook_batch_pending_events", "Record events buffered and not yet sent"
+)
+BATCHES = REGISTRY.counter(
+    "acapy_webhook_batch_batches_total",
+    "Webhook batches by outcome",
+    ["outcome"],
+)
+
+
+class _TenantBuffer:
+    __slots__ = ("events", "profile", "timer", "queued")
+
+    def __init__(self, max_pending: int):
+        self.events: Deque[dict] = deque(maxlen=max_pending)
+        self.profile: Optional[Profile] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # a batch of this tenant is queued or being sent, the next one is
+        # held back until it is done so a tenant's events arrive in order
+        self.queued = False
+
+
+class BatchWebhookDispatcher:
+    """Send record events as batched webhooks, one buffer per tenant.
+
+    The event handler only appends to the tenant buffer, so it never holds up
+    the event bus. A buffer is flushed when it holds `max_batch` events or
+    `max_delay` seconds after its first event. Flushed batches wait in a
+    bounded queue for one of `concurrency` senders, one batch per tenant at a
+    time so its events arrive in order. While the senders are behind events
+    keep collecting in the buffers, and a full buffer drops its oldest
+    events. Once `max_total_pending` events are buffered across all tenants
+    an event drops the oldest of its own tenant, or itself if its tenant has
+    none buffered. Failed posts are retried with exponential backoff.
+
+    The batches are sent on top of the stock per event webhooks, the
+    `webhook` and `wallet.webhook_urls` targets must be dropped to not
+    receive every event twice.
+
+    Each batch is posted to every target URL as
+    `{"wallet_id": ..., "events": [{"topic", "payload", "traction"}]}`.
+    As for stock webhooks an API key can follow the URL after a `#`.
+    """
+
+    def __init__(
+        self,
+        urls: Sequence[str],
+        *,
+        max_batch: int = 100,
+        max_delay: float = 1.0,
+        max_pending: int = 10_000,
+        max_total_pending: int = 100_000,
+        max_queued: int = 100,
+        concurrency: int = 4,
+        retries: int = 5,
+        backoff: float = 0.5,
+        timeout: float = 10.0,
+    ):
+        """Initialize BatchWebhookDispatcher.
+
+        Args:
+            urls: Target URLs, optionally followed by #api_key
+            max_batch: Maximum number of events per batch
+            max_delay: Seconds an event may wait for its batch to fill up
+            max_pending: Maximum number of events buffered per tenant
+            max_total_pending: Maximum number of events buffered across all
+                tenants
+            max_queued: Maximum number of batches waiting for a sender
+            concurrency: Number of batches sent at the same time
+            retries: Number of times a failed post is retried
+            backoff: Seconds before the first retry, doubled for each next one
+            timeout: Seconds before a post is abandoned
+        """
+        self.targets: List[Tuple[str, Optional[str]]] = []
+        for url in urls:
+            endpoint, _, api_key = url.partition("#")
+            self.targets.append((endpoint, api_key or None))
+        self.max_batch = max(max_batch, 1)
+        self.max_delay = max_delay
+        self.max_pending = max(max_pending, self.max_batch)
+        self.max_total_pending = max(max_total_pending, 1)
+        self._pending = 0
+        self._warned_tenant_webhooks = False
+        self.concurrency = max(concurrency, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._buffers: Dict[str, _TenantBuffer] = {}
+        self._queue: "asyncio.Queue[Tuple[str, Optional[Profile], List[dict]]]" = (
+            asyncio.Queue(maxsize=max(max_queued, 1))
+        )
+        self._senders: List[asyncio.Task] = []
+        self._session: Optional[ClientSession] = None
+
+    @classmethod
+    def from_settings(cls, settings: BaseSettings) -> Optional["BatchWebhookDispatcher"]:
+        """Create the dispatcher configured in the plugin config, if enabled."""
+        config = (settings.get("plugin_config") or {}).get(PLUGIN_CONFIG_SECTION) or {}
+        urls = config.get("urls")
+        if isinstance(urls, str):
+            urls = [url.strip() for url in urls.split(",") if url.strip()]
+        if not urls:
+            return None
+        options = {
+            key: config[key]
+            for key in (
+                "max_batch",
+                "max_delay",
+                "max_pending",
+                "max_total_pending",
+                "max_queued",
+                "concurrency",
+                "retries",
+                "backoff",
+                "timeout",
+            )
+            if config.get(key) is not None
+        }
+        if settings.get("admin.webhook_urls"):
+            LOGGER.warning(
+                "Both webhook and plugin_config.%s.urls are set, every record "
+                "event is sent once by each, drop webhook to only send batches",
+                PLUGIN_CONFIG_SECTION,
+            )
+        return cls(urls, **options)
+
+    @property
+    def running(self) -> bool:
+        """Accessor to check if the senders are running."""
+        return bool(self._senders)
+
+    @property
+    def pending(self) -> int:
+        """Accessor for the number of buffered events."""
+        return self._pending
+
+    def start(self):
+        """Start the senders."""
+        if self._senders:
+            return
+        self._session = ClientSession(
+            connector=TCPConnector(limit=self.concurrency * 2),
+            timeout=ClientTimeout(total=self.timeout),
+        )
+        self._senders = [
+            asyncio.ensure_future(self._send_batches()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self, drain_timeout: float = 5.0):
+        """Send what is buffered, waiting up to drain_timeout, then stop."""
+        for wallet_id in list(self._buffers):
+            self._flush(wallet_id, force=True)
+        if self._senders:
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                LOGGER.warning(
+                    "Stopped with %d webhook batches unsent", self._queue.qsize()
+                )
+            for task in self._senders:
+                task.cancel()
+            await asyncio.gather(*self._senders, return_exceptions=True)
+            self._senders = []
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def on_record_event(self, profile: Profile, event: Event):
+        """Buffer a record event for the tenant it belongs to."""
+        match = RECORD_EVENT_PATTERN.search(event.topic)
+        if not match:
+            return
+        wallet_id = profile.settings.get("wallet.id") or BASE_WALLET
+        if profile.settings.get("wallet.webhook_urls") and not (
+            self._warned_tenant_webhooks
+        ):
+            self._warned_tenant_webhooks = True
+            LOGGER.warning(
+                "Wallet %s has webhook URLs of its own, its events are sent "
+                "twice, once by them and once batched",
+                wallet_id,
+            )
+        buffer = self._buffers.get(wallet_id)
+        if not buffer:
+            buffer = self._buffers[wallet_id] = _TenantBuffer(self.max_pending)
+        buffer.profile = profile
+        EVENTS.labels().inc()
+
+        if self._pending >= self.max_total_pending and not buffer.events:
+            DROPPED.labels().inc()
+            if not (buffer.queued or buffer.timer):
+                del self._buffers[wallet_id]
+            return
+        if (
+            len(buffer.events) == self.max_pending
+            or self._pending >= self.max_total_pending
+        ):
+            buffer.events.popleft()
+            DROPPED.labels().inc()
+            self._pending -= 1
+            PENDING.labels().dec()
+        buffer.events.append({"topic": match.group(1), "payload": event.payload})
+        self._pending += 1
+        PENDING.labels().inc()
+
+        if len(buffer.events) >= self.max_batch:
+            self._flush(wallet_id)
+        elif not buffer.timer:
+            buffer.timer = asyncio.get_event_loop().call_later(
+                self.max_delay, self._flush, wallet_id
+            )
+
+    def _flush(self, wallet_id: str, force: bool = False):
+        buffer = self._buffers.get(wallet_id)
+        if not buffer:
+            return
+        if buffer.timer:
+            buffer.timer.cancel()
+            buffer.timer = None
+
+        while buffer.events and (force or not buffer.queued):
+            if self._queue.full():
+                break
+            count = min(len(buffer.events), self.max_batch)
+            batch = [buffer.events.popleft() for _ in range(count)]
+            self._pending -= count
+            PENDING.labels().dec(count)
+            self._queue.put_nowait((wallet_id, buffer.profile, batch))
+            buffer.queued = True
+            if not force:
+                break
+
+        if buffer.events:
+            # the senders are behind, try again once they had time to catch up
+            buffer.timer = asyncio.get_event_loop().call_later(
+                self.max_delay, self._flush, wallet_id
+            )
+        elif not buffer.queued:
+            del self._buffers[wallet_id]
+
+    async def _send_batches(self):
+        while True:
+            wallet_id, profile, batch = await self._queue.get()
+            try:
+                await self._add_traction(profile, batch)
+                await self._post_batch(wallet_id, batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                LOGGER.exception("Error sending webhook batch of wallet %s", wallet_id)
+            finally:
+                self._queue.task_done()
+                self._batch_done(wallet_id)
+
+    def _batch_done(self, wallet_id: str):
+        buffer = self._buffers.get(wallet_id)
+        if not buffer:
+            return
+        buffer.queued = False
+        if len(buffer.events) >= self.max_batch:
+            self._flush(wallet_id)
+        elif not buffer.events and not buffer.timer:
+            del self._buffers[wallet_id]
+
+    async def _add_traction(self, profile: Optional[Profile], batch: List[dict]):
+        """Add the traction fields of their connection to the events of a batch.
+
+        The metadata of all connections in the batch is read with one query.
+        """
+        connection_ids = {
+            event["payload"].get("connection_id")
+            for event in batch
+            if isinstance(event["payload"], dict)
+        }
+        connection_ids.discard(None)
+        if not profile or not connection_ids:
+            return
+        try:
+            async with profile.session() as session:
+                traction = await find_traction(session, connection_ids)
+        except Exception as err:
+            # the events are still worth sending without their traction fields
+            LOGGER.debug("Traction fields of webhook batch not read: %s", err)
+            return
+        for event in batch:
+            if isinstance(event["payload"], dict):
+                fields = traction.get(event["payload"].get("connection_id"))
+                if fields:
+                    event["traction"] = fields
+
+    async def _post_batch(self, wallet_id: str, batch: List[dict]):
+        body = json.dumps({"wallet_id": wallet_id, "events": batch})
+        for endpoint, api_key in self.targets:
+            headers = {"Content-Type": "application/json"}
+            if wallet_id != BASE_WALLET:
+                headers["x-wallet-id"] = wallet_id
+            if api_key:
+                headers["x-api-key"] = api_key
+            BATCHES.labels(await self._post(endpoint, body, headers)).inc()
+
+    async def _post(self, endpoint: str, body: str, headers: dict) -> str:
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(delay)
+                delay *= 2
+            started = time.perf_counter()
+            try:
+                async with self._session.post(
+                    endpoint, data=body, headers=headers
+                ) as response:
+                    status = response.status
+            except (ClientError, asyncio.TimeoutError) as err:
+                LOGGER.debug("Webhook batch post to %s failed: %s", endpoint, err)
+                continue
+            LOGGER.debug(
+                "Webhook batch posted to %s in %.3fs with status %d",
+                endpoint,
+                time.perf_counter() - started,
+                status,
+            )
+            if status < 300:
+                return "sent"
+            if 400 <= status < 500 and status not in (408, 429):
+                LOGGER.warning(
+                    "Webhook batch rejected by %s with status %d", endpoint, status
+                )
+                return "rejected"
+        LOGGER.warning(
+            "Webhook batch to %s failed after %d attempts", endpoint, self.retries + 1
+        )
+        return "failed"
@@ -2,12 +2,18 @@
 
 import os
 import logging
+import re
 
 from aries_cloudagent.config.injection_context import InjectionContext
+from aries_cloudagent.core.event_bus import EventBus
 from aries_cloudagent.core.protocol_registry import ProtocolRegistry
 \
 from aries_cloudagent.protocols.connections.v1_0.message_types import MESSAGE_TYPES
 
+from .traction import on_connection_request
+
+CONNECTION_REQUEST_EVENT_PATTERN = re.compile("^acapy::record::connections::request$")
+
 
 async def setup(context: InjectionContext):
     """Setup plugin."""
@@ -15,4 +21,9 @@ async def setup(context: InjectionContext):
     assert protocol_registry
     print("> override_protocol loading...")
     print("> register_message_types for connections v1_0...")
-    protocol_registry.register_message_types(MESSAGE_TYPES)
\ No newline at end of file
+    protocol_registry.register_message_types(MESSAGE_TYPES)
+
+    bus = context.inject(EventBus)
+    if not bus:
+        raise ValueError("EventBus missing in context")
+    bus.subscribe(CONNECTION_REQUEST_EVENT_PATTERN, on_connection_request)
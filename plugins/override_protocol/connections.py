@@ -0,0 +1,138 @@
+"""Incremental connection record queries."""
+
+import base64
+import binascii
+import json
+from typing import AsyncIterator, Mapping, Sequence, Tuple
+
+from aries_cloudagent.connections.models.conn_record import ConnRecord
+from aries_cloudagent.core.profile import ProfileSession
+from aries_cloudagent.messaging.models.base_record import match_post_filter
+from aries_cloudagent.storage.base import BaseStorage
+from aries_cloudagent.storage.error import StorageNotFoundError
+
+from ..common.storage import DEFAULT_BATCH_SIZE, iter_record_batches
+from .traction import traction_query
+
+TAG_FILTER_PARAMS = (
+    "invitation_id",
+    "my_did",
+    "their_did",
+    "request_id",
+    "invitation_key",
+    "their_public_did",
+    "invitation_msg_id",
+)
+
+
+class InvalidCursorError(ValueError):
+    """Raised for a cursor that was not produced by a connection query."""
+
+
+def encode_cursor(position: int) -> str:
+    """Encode the position after the last returned record as an opaque cursor."""
+    payload = json.dumps({"p": position}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Decode a cursor into the position to resume from."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded))["p"]
+    except (binascii.Error, ValueError, TypeError, KeyError) as err:
+        raise InvalidCursorError("Invalid cursor") from err
+    if not isinstance(position, int) or position < 0:
+        raise InvalidCursorError("Invalid cursor")
+    return position
+
+
+def connections_filters(query: Mapping) -> Tuple[dict, dict]:
+    """Get the stock connection tag and post filters of a list query."""
+    tag_filter = {}
+    for param_name in TAG_FILTER_PARAMS:
+        if param_name in query and query[param_name] != "":
+            tag_filter[param_name] = query[param_name]
+
+    post_filter = {}
+    if query.get("alias"):
+        post_filter["alias"] = query["alias"]
+    if query.get("state"):
+        post_filter["state"] = [v for v in ConnRecord.State.get(query["state"]).value]
+    if query.get("their_role"):
+        post_filter["their_role"] = [
+            v for v in ConnRecord.Role.get(query["their_role"]).value
+        ]
+    if query.get("connection_protocol"):
+        post_filter["connection_protocol"] = query["connection_protocol"]
+
+    return tag_filter, post_filter
+
+
+async def iter_connections(
+    session: ProfileSession,
+    tag_filter: dict = None,
+    post_filter: dict = None,
+    *,
+    external_reference_id: str = None,
+    tags: Sequence[str] = None,
+    position: int = 0,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> AsyncIterator[Tuple[int, ConnRecord]]:
+    """Iterate over matching connection records, reading storage in pages.
+
+    Records are read in storage order. Each record is yielded with its
+    position in the underlying search, pass that position back in to resume
+    after it.
+
+    Args:
+        session: The profile session to use
+        tag_filter: Stock connection tag filters
+        post_filter: Stock connection post filters, matched as the stock
+            listing does
+        external_reference_id: Only connections with this external reference
+        tags: Only connections with all of these traction tags
+        position: Skip the records before this search position
+        batch_size: Number of records read per page
+
+    """
+    by_traction = bool(external_reference_id or tags)
+    if by_traction:
+        # resolve through the traction index, the stock tag filters are
+        # checked on each connection
+        record_type = ConnRecord.RECORD_TYPE_METADATA
+        query = traction_query(external_reference_id, tags)
+        storage = session.inject(BaseStorage)
+    else:
+        record_type = ConnRecord.RECORD_TYPE
+        query = ConnRecord.prefix_tag_filter(tag_filter)
+
+    current = 0
+    batches = iter_record_batches(session, record_type, query, batch_size=batch_size)
+    try:
+        async for rows in batches:
+            if current + len(rows) <= position:
+                current += len(rows)
+                continue
+            for row in rows:
+                current += 1
+                if current <= position:
+                    continue
+                if by_traction:
+                    try:
+                        row = await storage.get_record(
+                            ConnRecord.RECORD_TYPE, row.tags["connection_id"]
+                        )
+                    except StorageNotFoundError:
+                        # metadata left behind by a removed connection
+                        continue
+                    if any(
+                        row.tags.get(name) != value
+                        for name, value in (tag_filter or {}).items()
+                    ):
+                        continue
+                value = json.loads(row.value)
+                if match_post_filter(value, post_filter, positive=True, alt=True):
+                    yield current, ConnRecord.from_storage(row.id, value)
+    finally:
+        await batches.aclose()
@@ -1,7 +1,9 @@
 """Connection handling admin routes."""
 
+import asyncio
 import functools
 import json
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
 
 from aiohttp import web
 from aiohttp_apispec import (
@@ -12,10 +14,11 @@ from aiohttp_apispec import (
     response_schema,
 )
 
-from marshmallow import fields, validate, validates_schema
+from marshmallow import ValidationError, fields, validate, validates_schema
 
 from aries_cloudagent.admin.request_context import AdminRequestContext
 from aries_cloudagent.connections.models.conn_record import ConnRecord, ConnRecordSchema
+from aries_cloudagent.core.profile import Profile
 from aries_cloudagent.messaging.models.base import BaseModelError
 from aries_cloudagent.messaging.models.openapi import OpenAPISchema
 from aries_cloudagent.messaging.valid import (
@@ -38,46 +41,102 @@ from aries_cloudagent.protocols.connections.v1_0.routes import (
 	connections_list,
 	connections_retrieve,
 	connections_metadata,
-	connections_metadata_set,
 	connections_endpoints,
 	connections_create_static,
-	connections_create_invitation,
 	connections_receive_invitation,
 	connections_accept_invitation,
 	connections_accept_request,
 	connections_establish_inbound,
 	connections_remove,
+	ConnectionMetadataSchema,
+	ConnectionMetadataSetRequestSchema,
+	ConnectionsConnIdMatchInfoSchema,
 	CreateInvitationRequestSchema,
 	CreateInvitationQueryStringSchema,
 	InvitationResultSchema,
 	ReceiveInvitationQueryStringSchema,
 	ReceiveInvitationRequestSchema,
-	ConnRecordSchema
+	ConnRecordSchema,
+	ConnectionListSchema,
+	ConnectionsListQueryStringSchema,
+	connection_sort_key,
 	)
 
+from .connections import (
+    connections_filters,
+    decode_cursor,
+    encode_cursor,
+    iter_connections,
+)
+from ..common.traction_metadata import TRACTION_METADATA_KEY
+from .traction import attach_traction, store_traction
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 100
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+MAX_BATCH_INVITATIONS = 5000
+DEFAULT_BATCH_CONCURRENCY = 10
+MAX_BATCH_CONCURRENCY = 50
+
+
+async def request_body(request: web.BaseRequest) -> dict:
+    """Get the JSON body of a request, parsing it at most once per request.
+
+    The data validated by the request schemas is used when it is a plain dict,
+    any other body is parsed once and kept on the request for later handlers.
+    """
+    if "body" not in request:
+        data = request.get("data")
+        if not isinstance(data, dict):
+            # schemas loading into a model don't keep the raw fields around
+            data = await request.json() if request.body_exists else {}
+        request["body"] = data
+    return request["body"]
+
+
+def traction_fields(body: dict) -> Optional[dict]:
+    """Pick the traction fields out of a request body, None if there are none."""
+    traction = body.get("traction")
+    if not traction:
+        return None
+    values = {
+        key: traction[key]
+        for key in ("external_reference_id", "tags")
+        if traction.get(key) is not None
+    }
+    return values or None
+
 
 def traction_deco(func):
+    """Pull the traction fields out of the request body for a connection route.
+
+    The fields are put on the request as `request["traction"]`. Handlers that
+    store them on the record they create set `request["traction_attached"]`,
+    for any other handler the fields are attached to the connection whose id
+    is in the response.
+    """
+
     @functools.wraps(func)
-    async def wrapper(request):
-        print('> traction_deco')
-        print(request)
-        params = await request.json()
-        try:
-            print('... calling...')
-            ret = await func(request)
-            return ret
-            # body = json.loads(ret.body)
-
-            #if params["traction"]:
-            #	body["~traction"] = params["traction"]
-
-            # ideally use something like Dispatcher.make_message when we have agentmessages
-            # obj = BasicMessage.deserialize(body)
-            #print(obj)
-            #obj._decorators["traction"] = TractionDecorator(external_reference_id=params["external_reference_id"], tags=params["tags"])
-            #return web.json_response(body)
-        finally:
-            print('< traction_deco')
+    async def wrapper(request: web.BaseRequest):
+        body = await request_body(request)
+        traction = traction_fields(body)
+        if traction and body is not request.get("data"):
+            # only the fields of a schema validated body are known to be sound
+            errors = TractionFieldsSchema().validate(traction)
+            if errors:
+                raise web.HTTPUnprocessableEntity(reason=json.dumps(errors))
+        request["traction"] = traction
+        response = await func(request)
+
+        if traction and not request.get("traction_attached"):
+            result = json.loads(response.body)
+            connection_id = result.get("connection_id")
+            if connection_id:
+                context: AdminRequestContext = request["context"]
+                await attach_traction(context.profile, connection_id, traction)
+
+        return response
 
     return wrapper
 
@@ -103,17 +162,526 @@ class TractionCreateInvitationRequestSchema(CreateInvitationRequestSchema, Tract
 class TractionReceiveInvitationRequestSchema(ReceiveInvitationRequestSchema, TractionSchema):
     """Request schema for receiving connection."""
 
+
+class TractionInvitationResultSchema(InvitationResultSchema, TractionSchema):
+    """Result schema for a new connection invitation."""
+
+
+async def create_invitation(
+    profile: Profile, options: dict, traction: dict = None
+) -> dict:
+    """Create a connection invitation, storing traction fields for its record.
+
+    Args:
+        profile: The profile to create the invitation in
+        options: Create invitation query and body parameters
+        traction: Traction fields to store on the connection record
+
+    Returns:
+        The connection invitation details
+
+    """
+    public = options.get("public", False)
+    if public and not profile.settings.get("public_invites"):
+        raise web.HTTPForbidden(
+            reason="Configuration does not include public invitations"
+        )
+
+    connection_mgr = ConnectionManager(profile)
+    try:
+        (connection, invitation) = await connection_mgr.create_invitation(
+            my_label=options.get("my_label"),
+            auto_accept=options.get("auto_accept"),
+            public=public,
+            multi_use=options.get("multi_use", False),
+            alias=options.get("alias"),
+            recipient_keys=options.get("recipient_keys"),
+            my_endpoint=options.get("service_endpoint"),
+            routing_keys=options.get("routing_keys"),
+            metadata=options.get("metadata"),
+            mediation_id=options.get("mediation_id"),
+        )
+        if connection and traction:
+            async with profile.session() as session:
+                await store_traction(session, connection.connection_id, traction)
+
+        result = {
+            "connection_id": connection and connection.connection_id,
+            "invitation": invitation.serialize(),
+            "invitation_url": invitation.to_url(profile.settings.get("invite_base_url")),
+        }
+    except (ConnectionManagerError, StorageError, BaseModelError) as err:
+        raise web.HTTPBadRequest(reason=err.roll_up) from err
+
+    if connection and connection.alias:
+        result["alias"] = connection.alias
+    if traction:
+        result["traction"] = traction
+
+    return result
+
+
+class BatchInvitationOptionsSchema(TractionCreateInvitationRequestSchema):
+    """Options of one invitation in a batch."""
+
+    alias = fields.Str(description="Alias", required=False, example="Barry")
+    auto_accept = fields.Boolean(
+        description="Auto-accept connection (defaults to configuration)",
+        required=False,
+    )
+    public = fields.Boolean(
+        description="Create invitation from public DID (default false)", required=False
+    )
+    multi_use = fields.Boolean(
+        description="Create invitation for multiple use (default false)", required=False
+    )
+
+
+class CreateInvitationsRequestSchema(OpenAPISchema):
+    """Request schema for creating connection invitations in bulk."""
+
+    count = fields.Int(
+        required=False,
+        validate=validate.Range(min=1, max=MAX_BATCH_INVITATIONS),
+        description="Number of invitations to create with the same options",
+        example=100,
+    )
+    options = fields.Nested(
+        BatchInvitationOptionsSchema(),
+        required=False,
+        description="Options of every invitation created by count",
+    )
+    invitations = fields.List(
+        fields.Nested(BatchInvitationOptionsSchema()),
+        required=False,
+        validate=validate.Length(min=1, max=MAX_BATCH_INVITATIONS),
+        description="Options of each invitation to create",
+    )
+
+    @validates_schema
+    def validate_fields(self, data, **kwargs):
+        """Validate that the invitations are given by either count or list."""
+        if ("count" in data) == ("invitations" in data):
+            raise ValidationError("Exactly one of count or invitations is required")
+        if "options" in data and "count" not in data:
+            raise ValidationError("Options are only used with count")
+
+
+class CreateInvitationsQueryStringSchema(CreateInvitationQueryStringSchema):
+    """Parameters and validators for create invitations request query string."""
+
+    concurrency = fields.Int(
+        required=False,
+        validate=validate.Range(min=1, max=MAX_BATCH_CONCURRENCY),
+        description="Number of invitations created at the same time",
+        example=DEFAULT_BATCH_CONCURRENCY,
+    )
+    stream = fields.Boolean(
+        required=False,
+        description="Stream the invitations as newline delimited JSON",
+    )
+
+
+class BatchInvitationResultSchema(TractionInvitationResultSchema):
+    """Result schema for one invitation of a batch."""
+
+    index = fields.Int(description="Position of the invitation in the request")
+    error = fields.Str(
+        description="Reason the invitation or its traction fields were not created"
+    )
+
+
+class CreateInvitationsResultSchema(OpenAPISchema):
+    """Result schema for connection invitations created in bulk."""
+
+    results = fields.List(
+        fields.Nested(BatchInvitationResultSchema()),
+        description="Invitations in request order",
+    )
+
+
+async def create_invitations(
+    profile: Profile,
+    items: Sequence[Tuple[dict, Optional[dict]]],
+    concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+) -> AsyncIterator[List[dict]]:
+    """Create connection invitations concurrently, yielding them in chunks.
+
+    At most `concurrency` invitations are created at a time. Results come in
+    completion order tagged with their index in `items`, the traction fields
+    of a chunk are stored in a single transaction before it is yielded. An
+    invitation that can't be created gets an error in place of its details,
+    one whose traction fields can't be stored gets an error next to them.
+
+    Args:
+        profile: The profile to create the invitations in
+        items: Create invitation options and traction fields of each invitation
+        concurrency: Number of invitations created at the same time
+
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def create(index: int, options: dict) -> dict:
+        async with semaphore:
+            try:
+                result = await create_invitation(profile, options)
+            except web.HTTPException as err:
+                return {"index": index, "error": err.reason}
+            except (
+                ConnectionManagerError,
+                StorageError,
+                BaseModelError,
+                WalletError,
+            ) as err:
+                return {"index": index, "error": err.roll_up}
+        result["index"] = index
+        return result
+
+    async def complete(chunk: List[dict]) -> List[dict]:
+        attached = []
+        for result in chunk:
+            traction = "error" not in result and items[result["index"]][1]
+            if traction:
+                result["traction"] = traction
+                if result["connection_id"]:
+                    attached.append((result, traction))
+        if attached:
+            try:
+                async with profile.transaction() as txn:
+                    for result, traction in attached:
+                        await store_traction(txn, result["connection_id"], traction)
+                    await txn.commit()
+            except StorageError as err:
+                # the invitations exist, only their traction fields are missing
+                for result, _ in attached:
+                    del result["traction"]
+                    result["error"] = f"Traction fields not stored: {err.roll_up}"
+        return chunk
+
+    tasks = [
+        asyncio.ensure_future(create(index, options))
+        for index, (options, _) in enumerate(items)
+    ]
+    try:
+        chunk = []
+        for task in asyncio.as_completed(tasks):
+            chunk.append(await task)
+            if len(chunk) == STREAM_CHUNK_SIZE:
+                yield await complete(chunk)
+                chunk = []
+        if chunk:
+            yield await complete(chunk)
+    finally:
+        # stop creating invitations nobody is waiting for
+        for task in tasks:
+            task.cancel()
+
+
+class TractionConnectionsListQueryStringSchema(ConnectionsListQueryStringSchema):
+    """Parameters and validators for connections list request query string."""
+
+    external_reference_id = fields.Str(
+        description="External Reference Id", example="id_xyz", required=False
+    )
+    tag = fields.List(
+        fields.Str(description="Tag for grouping and categorizing"),
+        required=False,
+        description="Tags the connections must all have",
+    )
+    limit = fields.Int(
+        required=False,
+        validate=validate.Range(min=1, max=MAX_PAGE_SIZE),
+        description="Page size, returns a single page with a cursor to the next",
+        example=DEFAULT_PAGE_SIZE,
+    )
+    cursor = fields.Str(
+        required=False,
+        description="Cursor returned with the previous page",
+    )
+    stream = fields.Boolean(
+        required=False,
+        description="Stream all matching records as newline delimited JSON",
+    )
+
+
+class TractionConnectionListSchema(ConnectionListSchema):
+    """Result schema for a paged connection list."""
+
+    next_cursor = fields.Str(
+        required=False,
+        allow_none=True,
+        description="Cursor of the next page, null on the last page",
+    )
+
+
+async def stream_connections(
+    request: web.BaseRequest, profile: Profile, **query
+) -> web.StreamResponse:
+    """Write the matching connection records as newline delimited JSON.
+
+    Records are serialized and sent one storage page at a time, so memory use
+    does not grow with the number of records.
+    """
+    response = web.StreamResponse(headers={"Content-Type": NDJSON_CONTENT_TYPE})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    chunk = []
+    async with profile.session() as session:
+        records = iter_connections(session, **query)
+        try:
+            async for _, record in records:
+                chunk.append(json.dumps(record.serialize()))
+                if len(chunk) == STREAM_CHUNK_SIZE:
+                    await response.write(("\n".join(chunk) + "\n").encode())
+                    chunk = []
+        finally:
+            await records.aclose()
+    if chunk:
+        await response.write(("\n".join(chunk) + "\n").encode())
+
+    await response.write_eof()
+    return response
+
+
+@docs(tags=["connection"], summary="Query agent-to-agent connections")
+@querystring_schema(TractionConnectionsListQueryStringSchema())
+@response_schema(TractionConnectionListSchema(), 200, description="")
+async def traction_connections_list(request: web.BaseRequest):
+    """
+    Request handler for searching connection records.
+
+    Filtering on traction fields resolves through their index. With a limit
+    or cursor a single page is returned along with the cursor of the next
+    one, with stream all records are sent as newline delimited JSON. Both
+    read storage incrementally and return records in storage order. Any
+    other query is handled by the stock listing.
+
+    Args:
+        request: aiohttp request object
+
+    Returns:
+        The connection list response
+
+    """
+    params = request.get("querystring") or {}
+    external_reference_id = params.get("external_reference_id")
+    tags = params.get("tag") or []
+    limit = params.get("limit")
+    cursor = params.get("cursor")
+    stream = params.get("stream", False)
+    paged = bool(limit or cursor)
+    if not (paged or stream or external_reference_id or tags):
+        return await connections_list(request)
+
+    context: AdminRequestContext = request["context"]
+    tag_filter, post_filter = connections_filters(params)
+    try:
+        page_size = limit or DEFAULT_PAGE_SIZE
+        position = decode_cursor(cursor) if cursor else 0
+    except ValueError as err:
+        raise web.HTTPBadRequest(reason=str(err)) from err
+    query = {
+        "tag_filter": tag_filter,
+        "post_filter": post_filter,
+        "external_reference_id": external_reference_id,
+        "tags": tags,
+        "position": position,
+    }
+
+    if stream:
+        return await stream_connections(request, context.profile, **query)
+
+    results = []
+    next_cursor = None
+    try:
+        async with context.profile.session() as session:
+            records = iter_connections(session, **query)
+            try:
+                async for record_position, record in records:
+                    if paged and len(results) == page_size:
+                        next_cursor = encode_cursor(position)
+                        break
+                    results.append(record.serialize())
+                    position = record_position
+            finally:
+                await records.aclose()
+    except (StorageError, BaseModelError) as err:
+        raise web.HTTPBadRequest(reason=err.roll_up) from err
+
+    if paged:
+        return web.json_response({"results": results, "next_cursor": next_cursor})
+
+    results.sort(key=connection_sort_key)
+    return web.json_response({"results": results})
+
+
 @docs(
     tags=["connection"],
     summary="Create a new connection invitation",
 )
 @querystring_schema(CreateInvitationQueryStringSchema())
-@request_schema(CreateInvitationRequestSchema())
-@response_schema(InvitationResultSchema(), 200, description="")
+@request_schema(TractionCreateInvitationRequestSchema())
+@response_schema(TractionInvitationResultSchema(), 200, description="")
 @traction_deco
 async def traction_connections_create_invitation(request: web.BaseRequest):
-    return await connections_create_invitation(request) 
+    """
+    Request handler for creating a new connection invitation.
+
+    Args:
+        request: aiohttp request object
+
+    Returns:
+        The connection invitation details
+
+    """
+    context: AdminRequestContext = request["context"]
+    options = dict(await request_body(request))
+    query = request.get("querystring")
+    if query is None:
+        query = {
+            param: json.loads(request.query[param])
+            for param in ("auto_accept", "public", "multi_use")
+            if param in request.query
+        }
+        if "alias" in request.query:
+            query["alias"] = request.query["alias"]
+    options.update(query)
+
+    result = await create_invitation(context.profile, options, request["traction"])
+    request["traction_attached"] = True
+
+    return web.json_response(result)
+
 
+@docs(
+    tags=["connection"],
+    summary="Create connection invitations in bulk",
+)
+@querystring_schema(CreateInvitationsQueryStringSchema())
+@request_schema(CreateInvitationsRequestSchema())
+@response_schema(CreateInvitationsResultSchema(), 200, description="")
+async def traction_connections_create_invitations(request: web.BaseRequest):
+    """
+    Request handler for creating connection invitations in bulk.
+
+    Takes a count of invitations with the same options, or a list with the
+    options of each. Query parameters are defaults for every invitation.
+    With stream the invitations are sent as newline delimited JSON as they
+    are created, otherwise all are returned in request order.
+
+    Args:
+        request: aiohttp request object
+
+    Returns:
+        The connection invitation details
+
+    """
+    context: AdminRequestContext = request["context"]
+    body = await request_body(request)
+    query = dict(request.get("querystring") or {})
+    concurrency = query.pop("concurrency", DEFAULT_BATCH_CONCURRENCY)
+    stream = query.pop("stream", False)
+
+    if body.get("invitations"):
+        entries = body["invitations"]
+    elif body.get("count"):
+        entries = [body.get("options") or {}] * body["count"]
+    else:
+        raise web.HTTPBadRequest(reason="Exactly one of count or invitations is required")
+
+    items = []
+    for entry in entries:
+        options = {**query, **entry}
+        items.append((options, traction_fields(options)))
+    chunks = create_invitations(context.profile, items, concurrency)
+
+    if stream:
+        response = web.StreamResponse(headers={"Content-Type": NDJSON_CONTENT_TYPE})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        try:
+            async for chunk in chunks:
+                lines = "".join(json.dumps(result) + "\n" for result in chunk)
+                await response.write(lines.encode())
+        finally:
+            await chunks.aclose()
+        await response.write_eof()
+        return response
+
+    results = []
+    try:
+        async for chunk in chunks:
+            results.extend(chunk)
+    finally:
+        await chunks.aclose()
+    results.sort(key=lambda result: result["index"])
+
+    return web.json_response({"results": results})
+
+
+@docs(tags=["connection"], summary="Set connection metadata")
+@match_info_schema(ConnectionsConnIdMatchInfoSchema())
+@request_schema(ConnectionMetadataSetRequestSchema())
+@response_schema(ConnectionMetadataSchema(), 200, description="")
+async def traction_connections_metadata_set(request: web.BaseRequest):
+    """
+    Request handler for setting metadata of a connection record.
+
+    Traction fields are stored through the traction index, a plain metadata
+    write would replace its tags and drop the connection from traction
+    queries.
+
+    Args:
+        request: aiohttp request object
+
+    Returns:
+        All metadata of the connection
+
+    """
+    context: AdminRequestContext = request["context"]
+    connection_id = request.match_info["conn_id"]
+    body = await request_body(request)
+    metadata = body.get("metadata") or {}
+
+    traction = metadata.get(TRACTION_METADATA_KEY)
+    if traction is not None:
+        errors = (
+            TractionFieldsSchema().validate(traction)
+            if isinstance(traction, dict)
+            else {TRACTION_METADATA_KEY: ["Not a valid mapping type."]}
+        )
+        if errors:
+            raise web.HTTPUnprocessableEntity(reason=json.dumps(errors))
+
+    try:
+        async with context.profile.session() as session:
+            record = await ConnRecord.retrieve_by_id(session, connection_id)
+            for key, value in metadata.items():
+                if key == TRACTION_METADATA_KEY:
+                    await store_traction(session, connection_id, value)
+                else:
+                    await record.metadata_set(session, key, value)
+            result = await record.metadata_get_all(session)
+    except StorageNotFoundError as err:
+        raise web.HTTPNotFound(reason=err.roll_up) from err
+    except BaseModelError as err:
+        raise web.HTTPBadRequest(reason=err.roll_up) from err
+
+    return web.json_response({"results": result})
+
+
+@docs(
+    tags=["connection"],
+    summary="Receive a new connection invitation",
+)
+@querystring_schema(ReceiveInvitationQueryStringSchema())
+# the invitation schema loads into a message, traction fields are read raw
+@request_schema(ReceiveInvitationRequestSchema())
+@response_schema(ConnRecordSchema(), 200, description="")
+@traction_deco
+async def traction_connections_receive_invitation(request: web.BaseRequest):
+    return await connections_receive_invitation(request)
 
 
 async def register(app: web.Application):
@@ -121,14 +689,17 @@ async def register(app: web.Application):
 
     app.add_routes(
         [
-            web.get("/connections", connections_list, allow_head=False),
+            web.get("/connections", traction_connections_list, allow_head=False),
             web.get("/connections/{conn_id}", connections_retrieve, allow_head=False),
             web.get(
                 "/connections/{conn_id}/metadata",
                 connections_metadata,
                 allow_head=False,
             ),
-            web.post("/connections/{conn_id}/metadata", connections_metadata_set),
+            web.post(
+                "/connections/{conn_id}/metadata",
+                traction_connections_metadata_set,
+            ),
             web.get(
                 "/connections/{conn_id}/endpoints",
                 connections_endpoints,
@@ -136,7 +707,14 @@ async def register(app: web.Application):
             ),
             web.post("/connections/create-static", connections_create_static),
             web.post("/connections/create-invitation", traction_connections_create_invitation),
-            web.post("/connections/receive-invitation", connections_receive_invitation),
+            web.post(
+                "/connections/create-invitations",
+                traction_connections_create_invitations,
+            ),
+            web.post(
+                "/connections/receive-invitation",
+                traction_connections_receive_invitation,
+            ),
             web.post(
                 "/connections/{conn_id}/accept-invitation",
                 connections_accept_invitation,
@@ -0,0 +1,99 @@
+"""Storage of traction fields for connection records."""
+
+import json
+import logging
+from typing import Sequence
+
+from aries_cloudagent.connections.models.conn_record import ConnRecord
+from aries_cloudagent.core.event_bus import Event
+from aries_cloudagent.core.profile import Profile, ProfileSession
+from aries_cloudagent.storage.base import BaseStorage
+from aries_cloudagent.storage.error import StorageNotFoundError
+from aries_cloudagent.storage.record import StorageRecord
+
+from ..common.traction_metadata import TRACTION_METADATA_KEY
+
+LOGGER = logging.getLogger(__name__)
+
+EXTERNAL_REFERENCE_TAG = "external_reference_id"
+TAG_PREFIX = "tag:"
+
+
+def traction_tags(connection_id: str, traction: dict) -> dict:
+    """Get the storage tags indexing the traction fields of a connection.
+
+    Every traction tag becomes a storage tag of its own, so connections with
+    a tag are found with an equality match and not by scanning values.
+    """
+    tags = {"key": TRACTION_METADATA_KEY, "connection_id": connection_id}
+    if traction.get("external_reference_id"):
+        tags[EXTERNAL_REFERENCE_TAG] = traction["external_reference_id"]
+    for tag in traction.get("tags") or ():
+        tags[TAG_PREFIX + tag] = "1"
+    return tags
+
+
+def traction_query(
+    external_reference_id: str = None, tags: Sequence[str] = None
+) -> dict:
+    """Get the tag query matching connections by their traction fields."""
+    query = {"key": TRACTION_METADATA_KEY}
+    if external_reference_id:
+        query[EXTERNAL_REFERENCE_TAG] = external_reference_id
+    for tag in tags or ():
+        query[TAG_PREFIX + tag] = "1"
+    return query
+
+
+async def store_traction(session: ProfileSession, connection_id: str, traction: dict):
+    """Store the traction fields of a connection as indexed connection metadata.
+
+    The fields are kept in the connection's "traction" metadata. They are not
+    tags of the connection record itself because every save of a ConnRecord
+    rewrites its tags from its TAG_NAMES.
+    """
+    storage = session.inject(BaseStorage)
+    value = json.dumps(traction)
+    tags = traction_tags(connection_id, traction)
+    try:
+        record = await storage.find_record(
+            ConnRecord.RECORD_TYPE_METADATA,
+            {"key": TRACTION_METADATA_KEY, "connection_id": connection_id},
+        )
+        await storage.update_record(record, value, tags)
+    except StorageNotFoundError:
+        await storage.add_record(
+            StorageRecord(ConnRecord.RECORD_TYPE_METADATA, value, tags)
+        )
+
+
+async def attach_traction(profile: Profile, connection_id: str, traction: dict):
+    """Store traction fields on an existing connection record."""
+    async with profile.session() as session:
+        # fail on connections that don't exist instead of storing orphans
+        await ConnRecord.retrieve_by_id(session, connection_id)
+        await store_traction(session, connection_id, traction)
+
+
+async def on_connection_request(profile: Profile, event: Event):
+    """Index the traction fields a connection inherited from its invitation.
+
+    Connections spawned from a multi-use invitation get a copy of its metadata
+    without the index tags, they are added once the connection request is in.
+    """
+    connection_id = event.payload.get("connection_id")
+    if not connection_id:
+        return
+    async with profile.session() as session:
+        storage = session.inject(BaseStorage)
+        try:
+            record = await storage.find_record(
+                ConnRecord.RECORD_TYPE_METADATA,
+                {"key": TRACTION_METADATA_KEY, "connection_id": connection_id},
+            )
+        except StorageNotFoundError:
+            return
+        tags = traction_tags(connection_id, json.loads(record.value))
+        if record.tags != tags:
+            LOGGER.debug("Indexing traction fields of connection %s", connection_id)
+            await storage.update_record(record, record.value, tags)